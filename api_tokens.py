@@ -0,0 +1,259 @@
+# api_tokens.py - Token API firmati (HMAC) con revoca opzionale su PostgreSQL
+"""
+Token autodescrittivi: `talon.<payload>.<firma>`, payload JSON in base64url
+(utente, username, emissione, scadenza, jti) firmato HMAC-SHA256.
+La verifica non richiede lookup: basta la chiave condivisa tra i processi
+(TALON_API_TOKEN_SECRET, obbligatoria). Senza chiave i token API sono
+disattivati: nessun token viene emesso né accettato. La SECRET_KEY dell'app
+non viene usata perché è nel sorgente (o diversa per ogni processo in debug).
+
+Revoca (logout):
+  - in memoria: jti -> scadenza, con un heap delle scadenze svuotato da un
+    thread in background, così la memoria resta proporzionale ai soli token
+    revocati e non ancora scaduti;
+  - su PostgreSQL (opzionale, tabella api_token_revocati): la revoca viene
+    salvata e notificata agli altri processi sul canale di invalidazione
+    cache (vedi migrations/add_api_token_revocati.sql e cache_invalidation.py).
+    All'avvio i token revocati ancora validi vengono caricati dalla tabella.
+"""
+import os
+import hmac
+import json
+import time
+import heapq
+import base64
+import hashlib
+import logging
+import secrets
+import datetime
+import threading
+from typing import Dict, Optional
+
+import psycopg2
+
+from db import db_connection
+import schema_capabilities
+
+# ===========================================
+# CONFIGURAZIONE
+# ===========================================
+
+TOKEN_PREFIX = 'talon'
+
+# Durata dei token API
+TOKEN_TTL_SECONDS = int(os.environ.get('TALON_API_TOKEN_TTL', str(24 * 3600)))
+
+# Intervallo di pulizia delle revoche scadute
+SWEEP_SECONDS = float(os.environ.get('TALON_API_TOKEN_SWEEP_SECONDS', '60'))
+
+# Chiave di firma condivisa tra processi (senza chiave i token API sono disattivati)
+TOKEN_SECRET = os.environ.get('TALON_API_TOKEN_SECRET')
+
+logger = logging.getLogger(__name__)
+
+_secret: Optional[bytes] = TOKEN_SECRET.encode() if TOKEN_SECRET else None
+
+# Revoche in memoria: jti -> scadenza (epoch) + heap (scadenza, jti)
+_revoked: Dict[str, int] = {}
+_expiry_heap = []
+_revoked_lock = threading.Lock()
+
+_store_enabled = False
+_sweeper: Optional[threading.Thread] = None
+_sweeper_stop = threading.Event()
+
+# ===========================================
+# CODIFICA / FIRMA
+# ===========================================
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def is_enabled() -> bool:
+    """True se la chiave di firma è configurata."""
+    return _secret is not None
+
+def _get_secret() -> bytes:
+    if _secret is None:
+        raise RuntimeError("Token API disattivati: TALON_API_TOKEN_SECRET non impostata")
+    return _secret
+
+def _sign(payload_b64: str, secret: bytes) -> str:
+    digest = hmac.new(secret, f'{TOKEN_PREFIX}.{payload_b64}'.encode('ascii'), hashlib.sha256).digest()
+    return _b64encode(digest)
+
+def _decode(token: str) -> Optional[Dict]:
+    """Verifica firma e scadenza; restituisce il payload o None."""
+    try:
+        prefix, payload_b64, signature = token.split('.')
+    except (AttributeError, ValueError):
+        return None
+    if prefix != TOKEN_PREFIX or _secret is None:
+        return None
+
+    expected = _sign(payload_b64, _get_secret())
+    if not hmac.compare_digest(expected, signature):
+        return None
+
+    try:
+        payload = json.loads(_b64decode(payload_b64))
+        exp = int(payload['exp'])
+        payload['uid'] = int(payload['uid'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    if exp <= time.time():
+        return None
+    return payload
+
+# ===========================================
+# API
+# ===========================================
+
+def issue_token(user_id: int, username: str, ttl: int = None) -> str:
+    """Crea un token firmato per l'utente (RuntimeError se la chiave manca)."""
+    now = int(time.time())
+    payload = {
+        'uid': user_id,
+        'usr': username,
+        'iat': now,
+        'exp': now + (TOKEN_TTL_SECONDS if ttl is None else int(ttl)),
+        'jti': secrets.token_urlsafe(12),
+    }
+    payload_b64 = _b64encode(json.dumps(payload, separators=(',', ':')).encode())
+    return f'{TOKEN_PREFIX}.{payload_b64}.{_sign(payload_b64, _get_secret())}'
+
+def verify_token(token: str) -> Optional[Dict]:
+    """
+    Valida un token senza accessi al database.
+    Restituisce i dati di sessione (stesso formato della sessione Flask) o None.
+    """
+    payload = _decode(token)
+    if payload is None:
+        return None
+    if payload.get('jti') in _revoked:
+        return None
+
+    created = datetime.datetime.fromtimestamp(payload.get('iat', 0))
+    return {
+        'user_id': payload['uid'],
+        'username': payload.get('usr'),
+        'login_time': created.isoformat(),
+        'created': created,
+        'expires': datetime.datetime.fromtimestamp(payload['exp']),
+        'jti': payload.get('jti'),
+    }
+
+def mark_revoked(jti: str, expires_at: int):
+    """Registra una revoca in memoria (usato anche dal listener NOTIFY)."""
+    if not jti or int(expires_at) <= time.time():
+        return
+    with _revoked_lock:
+        if jti not in _revoked:
+            _revoked[jti] = int(expires_at)
+            heapq.heappush(_expiry_heap, (int(expires_at), jti))
+
+def revoke_token(token: str) -> bool:
+    """Revoca un token valido (logout). Restituisce True se era valido."""
+    payload = _decode(token)
+    if payload is None or not payload.get('jti'):
+        return False
+
+    mark_revoked(payload['jti'], payload['exp'])
+    if _store_enabled:
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        '''
+                        INSERT INTO api_token_revocati (jti, utente_id, scadenza)
+                        VALUES (%s, %s, to_timestamp(%s))
+                        ON CONFLICT (jti) DO NOTHING
+                        ''',
+                        (payload['jti'], payload['uid'], payload['exp'])
+                    )
+        except psycopg2.Error as e:
+            logger.warning(f"Revoca token non salvata su database: {e}")
+    return True
+
+def sweep_expired() -> int:
+    """Rimuove le revoche scadute (heap: O(k log n) per k scadute)."""
+    now = time.time()
+    removed = 0
+    with _revoked_lock:
+        while _expiry_heap and _expiry_heap[0][0] <= now:
+            _, jti = heapq.heappop(_expiry_heap)
+            if _revoked.pop(jti, None) is not None:
+                removed += 1
+    if _store_enabled:
+        try:
+            with db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('DELETE FROM api_token_revocati WHERE scadenza <= NOW()')
+        except psycopg2.Error as e:
+            logger.debug(f"Pulizia api_token_revocati non riuscita: {e}")
+    return removed
+
+def _load_revocations() -> bool:
+    """Carica le revoche valide dalla tabella; False se la tabella non esiste."""
+    if not schema_capabilities.get().has_table('api_token_revocati'):
+        return False
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    '''
+                    SELECT jti, EXTRACT(EPOCH FROM scadenza)::bigint
+                    FROM api_token_revocati
+                    WHERE scadenza > NOW()
+                    '''
+                )
+                rows = cur.fetchall()
+    except psycopg2.Error as e:
+        logger.warning(f"Revoche token non caricate: {e}")
+        return False
+    for jti, expires_at in rows:
+        mark_revoked(jti, expires_at)
+    return True
+
+def _sweep_loop():
+    while not _sweeper_stop.wait(SWEEP_SECONDS):
+        try:
+            sweep_expired()
+        except Exception:
+            logger.exception("Errore nella pulizia dei token revocati")
+
+def init_app(app):
+    """Configura la chiave di firma, carica le revoche e avvia la pulizia."""
+    global _store_enabled, _sweeper
+    if _secret is None:
+        app.logger.warning("TALON_API_TOKEN_SECRET non impostata: token API disattivati")
+
+    _store_enabled = _load_revocations()
+    if not _store_enabled:
+        app.logger.info("Tabella api_token_revocati assente: revoche token solo in memoria")
+
+    if _sweeper is None or not _sweeper.is_alive():
+        _sweeper_stop.clear()
+        _sweeper = threading.Thread(target=_sweep_loop, name='talon-token-sweeper', daemon=True)
+        _sweeper.start()
+
+def _on_schema_refresh(capabilities):
+    """Tabella revoche creata o rimossa dopo l'avvio."""
+    global _store_enabled
+    _store_enabled = _load_revocations()
+
+schema_capabilities.on_refresh(_on_schema_refresh)
+
+def get_token_info() -> Dict:
+    with _revoked_lock:
+        revoked = len(_revoked)
+    return {
+        'enabled': is_enabled(),
+        'ttl_seconds': TOKEN_TTL_SECONDS,
+        'revoked_in_memory': revoked,
+        'store': 'postgres' if _store_enabled else 'memory',
+        'sweeper_running': _sweeper is not None and _sweeper.is_alive(),
+    }
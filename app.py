@@ -23,30 +23,18 @@ import urllib.parse
 # === DB: PostgreSQL ===
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from psycopg2 import pool
 
-# Configurazione Database PostgreSQL
-PG_HOST = "127.0.0.1"
-PG_PORT = 5432
-PG_DB   = "talon"
-PG_USER = "talon"
-PG_PASS = "TalonDB!2025"
-
-# Pool di connessioni per migliori performance
-try:
-    connection_pool = psycopg2.pool.SimpleConnectionPool(
-        1, 20,  # min 1, max 20 connessioni
-        host=PG_HOST,
-        port=PG_PORT,
-        database=PG_DB,
-        user=PG_USER,
-        password=PG_PASS,
-        cursor_factory=RealDictCursor
-    )
-    print("[OK] Pool di connessioni PostgreSQL creato con successo")
-except Exception as e:
-    print(f"[ERROR] Errore creazione pool connessioni: {e}")
-    connection_pool = None
+# Configurazione Database PostgreSQL (pool condiviso in db.py)
+import db
+import cache_invalidation
+import response_cache
+import api_tokens
+import permission_matrix
+import enti_hierarchy
+import audit_log
+import log_pipeline
+import schema_capabilities
+from db import PG_HOST, PG_PORT, PG_DB, PG_USER, PG_PASS
 
 # Importa il modulo SSO
 try:
@@ -64,8 +52,8 @@ except ImportError as e:
 # Importa il modulo di autenticazione
 from auth import (
     login_required, permission_required, entity_access_required,
-    get_user_by_username, get_user_permissions, get_user_accessible_entities,
-    log_user_action, get_current_user_info, setup_auth_context_processor,
+    get_user_by_username, get_user_for_login, get_user_permissions, get_user_accessible_entities,
+    log_user_action, get_current_user_info, setup_auth_context_processor, setup_request_principal,
     admin_required, operatore_or_admin_required, is_admin, is_operatore_or_above,
     get_user_role, update_session_with_role_info, validate_user_role_consistency,
     debug_user_permissions, get_system_auth_stats, ROLE_ADMIN, ROLE_OPERATORE, ROLE_VISUALIZZATORE
@@ -106,11 +94,8 @@ def create_app():
     app.config['JSON_AS_ASCII'] = False
     app.config['JSONIFY_MIMETYPE'] = 'application/json; charset=utf-8'
     
-    # Setup logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
-    )
+    # Setup logging (asincrono, con id di correlazione per richiesta)
+    log_pipeline.configure(app)
     app.logger.setLevel(logging.INFO)
     
     # ===========================================
@@ -124,7 +109,6 @@ def create_app():
     else:
         app.config['SECRET_KEY'] = 'talon-secret-key-super-secure-2025-auth-v2'
     
-    app.config['user_sessions'] = {}  # Sessioni in memoria per token API
     app.config['USE_SSO'] = SSO_AVAILABLE  # Flag per SSO
     
     # Configurazione sessioni Flask
@@ -144,6 +128,13 @@ def create_app():
         "user": PG_USER,
         "password": PG_PASS,
     }
+    app.config['DB_POOL_MIN'] = db.POOL_MIN_CONN
+    app.config['DB_POOL_MAX'] = db.POOL_MAX_CONN
+    db.configure_pool(
+        app.config['POSTGRES'],
+        minconn=app.config['DB_POOL_MIN'],
+        maxconn=app.config['DB_POOL_MAX']
+    )
     
     
     # ===========================================
@@ -157,11 +148,14 @@ def create_app():
         def after_request_handler(response):
             """Gestisce headers per cache e SSO"""
             # FORZA DISABILITA CACHE SEMPRE
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-            response.headers['Last-Modified'] = '0'
-            response.headers['ETag'] = ''
+            # (tranne le API JSON con ETag di response_cache.py, già "no-cache":
+            # il browser le riconvalida ad ogni uso e può ricevere 304)
+            if not (response.mimetype == 'application/json' and response.headers.get('ETag')):
+                response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate, max-age=0'
+                response.headers['Pragma'] = 'no-cache'
+                response.headers['Expires'] = '0'
+                response.headers['Last-Modified'] = '0'
+                response.headers['ETag'] = ''
             
             # Aggiungi timestamp per forzare refresh
             import time
@@ -243,6 +237,28 @@ def create_app():
     
     # Configura il context processor per autenticazione
     setup_auth_context_processor(app)
+
+    # Utente risolto una volta per richiesta (Principal)
+    setup_request_principal(app)
+    
+    # Connessione DB unica per richiesta, rilasciata a fine richiesta
+    db.setup_request_connection(app)
+
+    # Oggetti dello schema (tabelle, viste, funzioni, trigger) rilevati una volta
+    schema_capabilities.init_app(app)
+
+    # Invalidazione cache tra processi (LISTEN/NOTIFY)
+    cache_invalidation.start_listener(app)
+
+    # Token API firmati (chiave, revoche, pulizia scadenze)
+    api_tokens.init_app(app)
+
+    # Matrice ruolo -> permessi e indice gerarchia enti compilati all'avvio
+    permission_matrix.load()
+    try:
+        enti_hierarchy.get_index()
+    except psycopg2.Error as e:
+        app.logger.warning(f"Indice gerarchia enti non caricato all'avvio: {e}")
     
     # ===========================================
     # FUNZIONI DATABASE (PostgreSQL con Pool)
@@ -250,46 +266,23 @@ def create_app():
     
     def get_db_connection():
         """
-        Restituisce una connessione dal pool PostgreSQL.
+        Restituisce una connessione dal pool PostgreSQL condiviso.
         Usa RealDictCursor per ottenere risultati come dizionari.
         """
-        if connection_pool:
-            try:
-                conn = connection_pool.getconn()
-                if conn:
-                    # Test rapido della connessione
-                    with conn.cursor() as cur:
-                        cur.execute("SELECT 1")
-                    return conn
-            except Exception as e:
-                app.logger.error(f"Errore ottenimento connessione dal pool: {e}")
-                # Prova connessione diretta come fallback
-        
-        # Fallback: connessione diretta se il pool non funziona
         try:
-            return psycopg2.connect(
-                host=PG_HOST,
-                port=PG_PORT,
-                database=PG_DB,
-                user=PG_USER,
-                password=PG_PASS,
-                cursor_factory=RealDictCursor
-            )
+            # Le connessioni inattive da tempo vengono verificate dal pool
+            return db.get_connection(cursor_factory=RealDictCursor)
         except Exception as e:
-            app.logger.error(f"Errore connessione diretta PostgreSQL: {e}")
+            app.logger.error(f"Errore ottenimento connessione dal pool: {e}")
             raise
     
     def return_db_connection(conn):
         """Restituisce la connessione al pool"""
-        if connection_pool and conn:
+        if conn:
             try:
-                connection_pool.putconn(conn)
+                conn.close()
             except Exception as e:
                 app.logger.error(f"Errore restituzione connessione al pool: {e}")
-                try:
-                    conn.close()
-                except:
-                    pass
     
     def verify_password(stored_hash: str, password: str, username: str = None) -> bool:
         """Verifica password con Werkzeug e fallback per hash legacy"""
@@ -351,18 +344,8 @@ def create_app():
             return False
 
     def create_api_session_token(user_data: dict) -> str:
-        """Crea token di sessione per API"""
-        import time
-        import random
-        token = f"talon_{user_data['id']}_{int(time.time())}_{random.randint(10000,99999)}"
-        
-        app.config['user_sessions'][token] = {
-            'user_id': user_data['id'],
-            'username': user_data['username'],
-            'created': datetime.datetime.now(),
-            'expires': datetime.datetime.now() + datetime.timedelta(hours=24)
-        }
-        return token
+        """Crea token di sessione per API (firmato, valido 24 ore)"""
+        return api_tokens.issue_token(user_data['id'], user_data['username'])
     
     # ===========================================
     # HEALTH CHECK E STATUS
@@ -394,6 +377,36 @@ def create_app():
         
         return jsonify(status), 200 if status['status'] == 'healthy' else 503
 
+    @app.route('/health/db-pool')
+    @admin_required
+    def health_db_pool():
+        """Telemetria del pool di connessioni (solo admin)"""
+        min_held = request.args.get('min_held', type=float)
+        telemetry = db.get_pool_telemetry(min_held)
+        telemetry['cache_listener'] = cache_invalidation.get_listener_info()
+        telemetry['response_cache'] = response_cache.stats()
+        telemetry['logging'] = log_pipeline.stats()
+        telemetry['timestamp'] = datetime.datetime.now().isoformat()
+        return jsonify(telemetry)
+
+    @app.route('/health/schema')
+    @admin_required
+    def health_schema():
+        """Oggetti dello schema rilevati all'avvio (solo admin)"""
+        return jsonify(schema_capabilities.get().info())
+
+    @app.route('/health/schema/refresh', methods=['POST'])
+    @admin_required
+    def health_schema_refresh():
+        """Rileva di nuovo lo schema dopo una migrazione (solo admin)"""
+        try:
+            capabilities = schema_capabilities.refresh()
+        except psycopg2.Error as e:
+            return jsonify({'success': False, 'error': str(e)}), 503
+        log_user_action(session.get('user_id'), 'SCHEMA_REFRESH',
+                        f"Schema rilevato di nuovo: {len(capabilities.missing())} oggetti attesi assenti")
+        return jsonify({'success': True, **capabilities.info()})
+
     
     # ===========================================
     # ROUTE STATICHE
@@ -604,8 +617,8 @@ def create_app():
             return redirect(url_for('show_login'))
         
         try:
-            # Verifica credenziali
-            user = get_user_by_username(username.strip())
+            # Verifica credenziali (utente, ruolo e cono in un'unica query)
+            user = get_user_for_login(username.strip())
             
             if not user:
                 error_msg = 'Credenziali non valide'
@@ -634,6 +647,11 @@ def create_app():
                 flash(error_msg, 'error')
                 return redirect(url_for('show_login'))
             
+            # Login API senza chiave di firma: nessun token da restituire
+            if is_api_request and not api_tokens.is_enabled():
+                return jsonify({'error': 'Token API non disponibili su questo server',
+                                'code': 'API_TOKENS_DISABLED'}), 503
+
             # Login riuscito - crea sessione
             session.permanent = True
             session.clear()
@@ -648,20 +666,12 @@ def create_app():
             session['cognome'] = user.get('cognome', '')
             session['email'] = user.get('email', f"{username}@talon.local")
             
-            # Aggiorna sessione con informazioni ruolo
-            update_session_with_role_info(user['id'])
+            # Aggiorna sessione con informazioni ruolo (pre-carica le cache con la riga letta)
+            update_session_with_role_info(user['id'], user)
             
-            # Aggiorna ultimo accesso
+            # Aggiorna ultimo accesso (scrittura differita, vedi audit_log.py)
             try:
-                conn = get_db_connection()
-                with conn:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            'UPDATE utenti SET ultimo_accesso = NOW() WHERE id = %s', 
-                            (user['id'],)
-                        )
-                        conn.commit()
-                return_db_connection(conn)
+                audit_log.touch_last_access(user['id'])
             except Exception as e:
                 app.logger.error(f"Impossibile aggiornare ultimo_accesso: {e}")
             
@@ -1406,13 +1416,11 @@ def create_app():
             )
             app.logger.info(f"Logout utente: {username}")
         
-        # Pulisci token API se presente
+        # Revoca token API se presente
         auth_header = request.headers.get('Authorization', '')
         if auth_header.startswith('Bearer '):
             token = auth_header.split(' ')[1]
-            sessions = app.config.get('user_sessions', {})
-            if token in sessions:
-                del sessions[token]
+            api_tokens.revoke_token(token)
         
         # Pulisci sessione Flask
         session.clear()
@@ -2034,7 +2042,7 @@ def main():
     else:
         print("[LAUNCH] MODALITÀ PRODUZIONE")
         print("=" * 60)
-        serve(app, host='0.0.0.0', port=5000, threads=16)
+        serve(app, host='0.0.0.0', port=5000, threads=db.SERVER_THREADS)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
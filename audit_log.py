@@ -0,0 +1,332 @@
+# audit_log.py - Scrittura asincrona a lotti del log azioni utente (log_utenti)
+"""
+`log_user_action()` accoda la riga in memoria e ritorna subito; un thread
+dedicato la scrive in log_utenti a lotti (`execute_values`), ogni
+AUDIT_FLUSH_MS millisecondi o appena si raggiungono AUDIT_BATCH_ROWS righe.
+
+Il timestamp viene fissato al momento dell'accodamento, così l'ordine e
+l'orario delle azioni non dipendono dal ritardo di scrittura.
+
+Politica di backpressure quando la coda è piena (TALON_AUDIT_OVERFLOW):
+  - 'drop'  (default) la riga viene scartata e conteggiata: il log resta
+            best-effort e non rallenta mai le richieste;
+  - 'block' attende fino a AUDIT_BLOCK_SECONDS, poi scarta;
+  - 'sync'  scrive la riga direttamente nel thread della richiesta.
+Allo shutdown (atexit) la coda viene svuotata.
+
+Lo stesso writer aggiorna in differita utenti.ultimo_accesso al login
+(`touch_last_access`), così il login non attende scritture.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import datetime
+import threading
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db import db_connection
+
+# ===========================================
+# CONFIGURAZIONE
+# ===========================================
+
+# 0 = scrittura sincrona come in passato (debug, script)
+AUDIT_ASYNC = os.environ.get('TALON_AUDIT_ASYNC', '1') == '1'
+
+# Righe massime in attesa di scrittura
+AUDIT_QUEUE_SIZE = int(os.environ.get('TALON_AUDIT_QUEUE_SIZE', '10000'))
+
+# Flush ogni N ms o ogni M righe
+AUDIT_FLUSH_MS = int(os.environ.get('TALON_AUDIT_FLUSH_MS', '500'))
+AUDIT_BATCH_ROWS = int(os.environ.get('TALON_AUDIT_BATCH_ROWS', '200'))
+
+# Politica a coda piena: drop | block | sync
+AUDIT_OVERFLOW = os.environ.get('TALON_AUDIT_OVERFLOW', 'drop').lower()
+AUDIT_BLOCK_SECONDS = float(os.environ.get('TALON_AUDIT_BLOCK_SECONDS', '0.5'))
+
+# Secondi massimi di attesa per lo svuotamento allo shutdown
+AUDIT_SHUTDOWN_SECONDS = float(os.environ.get('TALON_AUDIT_SHUTDOWN_SECONDS', '5'))
+
+INSERT_SQL = '''
+    INSERT INTO log_utenti
+    (utente_id, azione, dettagli, risorsa_tipo, risorsa_id, ip_address, esito, timestamp)
+    VALUES %s
+'''
+
+LAST_ACCESS_SQL = '''
+    UPDATE utenti u
+    SET ultimo_accesso = v.ultimo_accesso
+    FROM (VALUES %s) AS v(id, ultimo_accesso)
+    WHERE u.id = v.id
+'''
+
+# Tipi di voce in coda
+KIND_LOG = 'log'
+KIND_LAST_ACCESS = 'last_access'
+
+logger = logging.getLogger(__name__)
+
+# ===========================================
+# SCRITTURA
+# ===========================================
+
+def _insert_rows(cur, rows: List[tuple]):
+    execute_values(cur, INSERT_SQL, rows, page_size=max(len(rows), 1))
+
+def _update_last_access(cur, pairs: List[tuple]):
+    latest: Dict[int, datetime.datetime] = {}
+    for user_id, ts in pairs:
+        if user_id not in latest or ts > latest[user_id]:
+            latest[user_id] = ts
+    execute_values(cur, LAST_ACCESS_SQL, list(latest.items()),
+                   template='(%s, %s::timestamp)', page_size=max(len(latest), 1))
+
+def write_rows(rows: List[tuple]):
+    """Inserisce un lotto di righe in un'unica istruzione."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            _insert_rows(cur, rows)
+
+def write_last_access(pairs: List[tuple]):
+    """Aggiorna ultimo_accesso per un lotto di (utente_id, timestamp)."""
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            _update_last_access(cur, pairs)
+
+def write_items(items: List[tuple]):
+    """
+    Scrive voci miste (log e ultimo accesso) in un'unica transazione:
+    in caso di errore non viene scritto nulla e il lotto può essere
+    ritentato senza duplicare righe di log.
+    """
+    logs = [data for kind, data in items if kind == KIND_LOG]
+    accesses = [data for kind, data in items if kind == KIND_LAST_ACCESS]
+    if not logs and not accesses:
+        return
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            if logs:
+                _insert_rows(cur, logs)
+            if accesses:
+                _update_last_access(cur, accesses)
+
+class AuditLogWriter(threading.Thread):
+    """Thread daemon che svuota la coda di log a lotti."""
+
+    _STOP = object()
+
+    def __init__(self):
+        super().__init__(name='talon-audit-writer', daemon=True)
+        self.queue: 'queue.Queue' = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'batches': 0,
+            'dropped': 0,
+            'written_sync': 0,
+            'failed': 0,
+        }
+
+    def _count(self, name: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def submit(self, item: tuple):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self._overflow(item)
+            return
+        self._count('enqueued')
+
+    def _overflow(self, item: tuple):
+        if AUDIT_OVERFLOW == 'sync':
+            try:
+                write_items([item])
+                self._count('written_sync')
+            except psycopg2.Error as e:
+                self._count('failed')
+                logger.debug(f"Impossibile scrivere log_utenti: {e}")
+            return
+        if AUDIT_OVERFLOW == 'block':
+            try:
+                self.queue.put(item, timeout=AUDIT_BLOCK_SECONDS)
+                self._count('enqueued')
+                return
+            except queue.Full:
+                pass
+        with self._stats_lock:
+            self.stats['dropped'] += 1
+            dropped = self.stats['dropped']
+        # Avviso non ripetuto ad ogni riga persa
+        if dropped == 1 or dropped % 1000 == 0:
+            logger.warning(f"Coda log_utenti piena: {dropped} righe scartate")
+
+    def _flush(self, batch: List[tuple]):
+        if not batch:
+            return
+        try:
+            written = self._write_batch(batch)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Connessione persa: un secondo tentativo su una nuova connessione
+            try:
+                written = self._write_batch(batch)
+            except psycopg2.Error as e:
+                self._count('failed', len(batch))
+                logger.warning(f"Lotto log_utenti perso ({len(batch)} righe): {e}")
+                return
+        except psycopg2.Error as e:
+            self._count('failed', len(batch))
+            logger.warning(f"Lotto log_utenti perso ({len(batch)} righe): {e}")
+            return
+        with self._stats_lock:
+            self.stats['written'] += written
+            self.stats['batches'] += 1
+
+    def _write_batch(self, batch: List[tuple]) -> int:
+        """
+        Scrive il lotto in una transazione. Se una voce non è valida
+        (DataError, IntegrityError: dettagli troppo lunghi, utente
+        cancellato) le voci vengono riscritte una alla volta e si perde solo
+        quella errata. Restituisce le voci scritte.
+        """
+        try:
+            write_items(batch)
+            return len(batch)
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            logger.warning(f"Lotto log_utenti rifiutato, scrittura riga per riga: {e}")
+        written = 0
+        for item in batch:
+            try:
+                write_items([item])
+                written += 1
+            except psycopg2.Error as e:
+                kind, data = item
+                self._count('failed')
+                logger.warning(f"Voce {kind} scartata (utente {data[0]}): {e}")
+        return written
+
+    def run(self):
+        interval = AUDIT_FLUSH_MS / 1000.0
+        stopping = False
+        while not stopping:
+            batch: List[tuple] = []
+            try:
+                item = self.queue.get(timeout=interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + interval
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= AUDIT_BATCH_ROWS:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._flush(batch)
+            except Exception:
+                self._count('failed', len(batch))
+                logger.exception("Errore inatteso nella scrittura di log_utenti")
+
+        # Righe arrivate dopo lo stop
+        rest = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                rest.append(item)
+        for i in range(0, len(rest), AUDIT_BATCH_ROWS):
+            self._flush(rest[i:i + AUDIT_BATCH_ROWS])
+
+    def stop(self, timeout: float = AUDIT_SHUTDOWN_SECONDS):
+        """Svuota la coda e termina il thread."""
+        if not self.is_alive():
+            return
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Coda log_utenti piena allo shutdown: alcune righe potrebbero perdersi")
+            return
+        self.join(timeout)
+
+    def info(self) -> Dict:
+        with self._stats_lock:
+            info = dict(self.stats)
+        info.update({
+            'running': self.is_alive(),
+            'queue_depth': self.queue.qsize(),
+            'queue_size': AUDIT_QUEUE_SIZE,
+            'flush_ms': AUDIT_FLUSH_MS,
+            'batch_rows': AUDIT_BATCH_ROWS,
+            'overflow_policy': AUDIT_OVERFLOW,
+        })
+        return info
+
+# ===========================================
+# API
+# ===========================================
+
+_writer: Optional[AuditLogWriter] = None
+_writer_lock = threading.Lock()
+
+def _get_writer() -> AuditLogWriter:
+    global _writer
+    writer = _writer
+    if writer is not None and writer.is_alive():
+        return writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = AuditLogWriter()
+            _writer.start()
+        return _writer
+
+def enqueue(user_id: int, action: str, details: str = None,
+            resource_type: str = None, resource_id: int = None,
+            ip_address: str = None, result: str = 'SUCCESS'):
+    """Accoda una riga di log_utenti (timestamp fissato ora)."""
+    row = (user_id, action, details, resource_type, resource_id,
+           ip_address, result, datetime.datetime.now())
+    if not AUDIT_ASYNC:
+        write_rows([row])
+        return
+    _get_writer().submit((KIND_LOG, row))
+
+def touch_last_access(user_id: int):
+    """Accoda l'aggiornamento di utenti.ultimo_accesso (timestamp fissato ora)."""
+    pair = (user_id, datetime.datetime.now())
+    if not AUDIT_ASYNC:
+        write_last_access([pair])
+        return
+    _get_writer().submit((KIND_LAST_ACCESS, pair))
+
+def flush(timeout: float = AUDIT_SHUTDOWN_SECONDS):
+    """Scrive tutte le righe in coda e ferma il writer (riavviato al prossimo log)."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop(timeout)
+
+def get_audit_info() -> Dict:
+    writer = _writer
+    if writer is None:
+        return {'running': False, 'async': AUDIT_ASYNC, 'overflow_policy': AUDIT_OVERFLOW}
+    info = writer.info()
+    info['async'] = AUDIT_ASYNC
+    return info
+
+atexit.register(flush)
@@ -2,29 +2,48 @@
 import datetime
 import os
 from functools import wraps
-from flask import request, jsonify, redirect, current_app, session, flash, url_for
-from typing import Optional, Dict, List
+from types import MappingProxyType
+from flask import request, jsonify, redirect, current_app, session, flash, url_for, g, has_request_context
+from typing import Optional, Dict, List, FrozenSet
 
 # === DB: PostgreSQL ===
 # Richiede: F:\talon_app\talon_app\python311_full\python.exe -m pip install --upgrade psycopg2-binary
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+# Pool di connessioni condiviso
+from db import get_connection, db_connection
+
+# Indice gerarchia enti (cono d'ombra)
+import enti_hierarchy
+from enti_hierarchy import EntitySet
+
+# Cache LRU/TTL per le lookup di autenticazione
+from auth_cache import TTLCache, MISSING
+
+# Scrittura asincrona del log azioni
+import audit_log
+
+# Token API firmati
+import api_tokens
+
+# Matrice ruolo -> permessi (bitmask)
+import permission_matrix
+
+# Oggetti presenti nello schema (rilevati all'avvio)
+import schema_capabilities
+
 # ===========================================
 # CONFIGURAZIONE
 # ===========================================
 
-# Usa le stesse credenziali configurate in app.py
-PG_HOST = "127.0.0.1"
-PG_PORT = 5432
-PG_DB   = "talon"
-PG_USER = "talon"
-PG_PASS = "TalonDB!2025"
-
-# Cache per migliorare le performance
-_permission_cache: Dict[str, Dict] = {}
-_entity_cache: Dict[str, Dict] = {}
-_cache_timeout = 300  # 5 minuti
+# Cache per migliorare le performance (LRU limitata + TTL, indicizzata per utente)
+DEFAULT_CACHE_TTL = 300  # 5 minuti
+_cache_timeout = int(os.environ.get('TALON_AUTH_CACHE_TTL', str(DEFAULT_CACHE_TTL)))
+_cache_max_size = int(os.environ.get('TALON_AUTH_CACHE_SIZE', '4096'))
+_permission_cache = TTLCache('permissions', maxsize=_cache_max_size, ttl=_cache_timeout)
+_entity_cache = TTLCache('entities', maxsize=_cache_max_size, ttl=_cache_timeout)
+permission_matrix.set_ttl(_cache_timeout)
 
 # Costanti per i ruoli
 ROLE_ADMIN = 'ADMIN'
@@ -42,19 +61,10 @@ LEVEL_VISUALIZZATORE = 10
 
 def get_auth_db_connection():
     """
-    Connessione a PostgreSQL con cursori dict-like.
-    Usa le stesse credenziali dell'app.
+    Connessione a PostgreSQL presa dal pool condiviso.
+    `conn.close()` restituisce la connessione al pool.
     """
-    # Consente override da app.config se presente
-    cfg = getattr(current_app, "config", {}).get("POSTGRES", None) if current_app else None
-    params = {
-        "host": (cfg or {}).get("host", PG_HOST),
-        "port": (cfg or {}).get("port", PG_PORT),
-        "dbname": (cfg or {}).get("dbname", PG_DB),
-        "user": (cfg or {}).get("user", PG_USER),
-        "password": (cfg or {}).get("password", PG_PASS),
-    }
-    return psycopg2.connect(**params)
+    return get_connection()
 
 def _is_true(value) -> bool:
     """Gestisce booleani provenienti da vecchi schemi (0/1) e nuovi (boolean)."""
@@ -73,11 +83,12 @@ def _is_true(value) -> bool:
 
 def get_user_by_id(user_id: int) -> Optional[Dict]:
     """Recupera utente per ID con cache"""
-    cache_key = f"user_{user_id}"
-    if cache_key in _permission_cache:
-        cache_data = _permission_cache[cache_key]
-        if datetime.datetime.now() - cache_data['timestamp'] < datetime.timedelta(seconds=_cache_timeout):
-            return cache_data['data']
+    cache_key = ('user', user_id)
+    cached = _permission_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached
+    # Invalidazioni arrivate durante la query annullano la memorizzazione
+    version = _permission_cache.version(user_id)
 
     sql = '''
         SELECT u.*, r.nome AS ruolo_nome, r.livello_accesso, em.nome AS ente_nome,
@@ -90,18 +101,14 @@ def get_user_by_id(user_id: int) -> Optional[Dict]:
           AND (u.eliminato IS NULL OR u.eliminato = FALSE)
     '''
     try:
-        conn = get_auth_db_connection()
-        with conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(sql, (user_id,))
                 row = cur.fetchone()
                 result = dict(row) if row else None
 
         # Cache del risultato
-        _permission_cache[cache_key] = {
-            'data': result,
-            'timestamp': datetime.datetime.now()
-        }
+        _permission_cache.set(cache_key, result, user_id=user_id, version=version)
         return result
     except psycopg2.Error as e:
         if hasattr(current_app, 'logger'):
@@ -121,8 +128,7 @@ def get_user_by_username(username: str) -> Optional[Dict]:
           AND (u.eliminato IS NULL OR u.eliminato = FALSE)
     '''
     try:
-        conn = get_auth_db_connection()
-        with conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(sql, (username,))
                 row = cur.fetchone()
@@ -132,155 +138,150 @@ def get_user_by_username(username: str) -> Optional[Dict]:
             current_app.logger.error(f"Errore database get_user_by_username: {e}")
         return None
 
+def get_user_permission_mask(user_id: int) -> int:
+    """Bitmask dei permessi dell'utente (matrice ruolo -> permessi, nessuna query)"""
+    return permission_matrix.get_matrix().mask_for_user(get_user_by_id(user_id))
+
 def get_user_permissions(user_id: int) -> List[str]:
-    """Recupera tutti i permessi di un utente con cache"""
-    cache_key = f"permissions_{user_id}"
-    if cache_key in _permission_cache:
-        cache_data = _permission_cache[cache_key]
-        if datetime.datetime.now() - cache_data['timestamp'] < datetime.timedelta(seconds=_cache_timeout):
-            return cache_data['data']
+    """Recupera tutti i permessi di un utente dalla matrice compilata"""
+    matrix = permission_matrix.get_matrix()
+    mask = matrix.mask_for_user(get_user_by_id(user_id))
+    return sorted(matrix.names_for(mask))
 
-    sql = '''
-        SELECT DISTINCT p.nome
-        FROM permessi p
-        JOIN ruoli_permessi rp ON p.id = rp.permesso_id
-        JOIN utenti u ON u.ruolo_id = rp.ruolo_id
-        WHERE u.id = %s
-          AND (p.attivo IS NULL OR p.attivo = TRUE OR p.attivo = TRUE)
-          AND (u.attivo IS NULL OR u.attivo = TRUE OR u.attivo = TRUE)
-    '''
+# Vista opzionale con gli enti accessibili per utente (vedi schema_capabilities.py)
+VIEW_ENTI_ACCESSIBILI = 'v_enti_accessibili'
+
+def _query_view_entities(user_id: int) -> Optional[List[int]]:
+    """Enti dalla vista v_enti_accessibili (None se la vista non esiste)."""
+    if not schema_capabilities.get().has_table(VIEW_ENTI_ACCESSIBILI):
+        return None
     try:
-        conn = get_auth_db_connection()
-        with conn:
+        with db_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (user_id,))
+                cur.execute(
+                    'SELECT DISTINCT ente_id FROM v_enti_accessibili WHERE utente_id = %s',
+                    (user_id,)
+                )
                 rows = cur.fetchall()
-                # rows: list of tuples [(name,), ...]
-                result = [r[0] for r in rows]
+    except psycopg2.errors.UndefinedTable:
+        # Vista eliminata dopo il rilevamento dello schema
+        schema_capabilities.forget(VIEW_ENTI_ACCESSIBILI)
+        return None
+    return [r[0] for r in rows]
 
-        _permission_cache[cache_key] = {
-            'data': result,
-            'timestamp': datetime.datetime.now()
-        }
-        return result
-    except psycopg2.Error as e:
-        if hasattr(current_app, 'logger'):
-            current_app.logger.warning(f"Tabelle permessi non disponibili: {e}")
-        # Fallback basato sul ruolo
-        user = get_user_by_id(user_id)
-        if user:
-            role = (user.get('ruolo_nome') or '').upper()
-            if role == ROLE_ADMIN:
-                return ['VIEW_ENTI_CIVILI', 'CREATE_ENTI_CIVILI', 'EDIT_ENTI_CIVILI', 'DELETE_ENTI_CIVILI',
-                        'VIEW_ENTI_MILITARI', 'CREATE_ENTI_MILITARI', 'EDIT_ENTI_MILITARI', 'DELETE_ENTI_MILITARI',
-                        'VIEW_OPERAZIONI', 'CREATE_OPERAZIONI', 'EDIT_OPERAZIONI', 'DELETE_OPERAZIONI',
-                        'VIEW_ATTIVITA', 'CREATE_ATTIVITA', 'EDIT_ATTIVITA', 'DELETE_ATTIVITA']
-            elif role == ROLE_OPERATORE:
-                return ['VIEW_ENTI_CIVILI', 'CREATE_ENTI_CIVILI', 'EDIT_ENTI_CIVILI',
-                        'VIEW_ENTI_MILITARI', 'CREATE_ENTI_MILITARI', 'EDIT_ENTI_MILITARI',
-                        'VIEW_OPERAZIONI', 'CREATE_OPERAZIONI', 'EDIT_OPERAZIONI',
-                        'VIEW_ATTIVITA', 'CREATE_ATTIVITA', 'EDIT_ATTIVITA']
-            elif role == ROLE_VISUALIZZATORE:
-                return ['VIEW_ENTI_CIVILI', 'VIEW_ENTI_MILITARI', 'VIEW_OPERAZIONI', 'VIEW_ATTIVITA']
-        return []
+def _resolve_accessible_entities(user: Optional[Dict], view_ids=MISSING) -> List[int]:
+    """
+    Cono d'ombra a partire dalla riga utente.
+    `view_ids` permette di passare gli enti della vista già letti (login).
+    """
+    if not user or not _is_true(user.get("attivo", True)):
+        return enti_hierarchy.EMPTY
+
+    # ADMIN ha sempre accesso globale
+    if _user_row_is_admin(user):
+        return enti_hierarchy.get_index().all_ids
+
+    user_ente_id = user.get('ente_militare_id')
+    if not user_ente_id:
+        return enti_hierarchy.EMPTY
+
+    # Prova vista v_enti_accessibili, poi l'indice gerarchico
+    if view_ids is MISSING:
+        view_ids = _query_view_entities(user['id'])
+    if view_ids:
+        return EntitySet(view_ids)
+    return _get_entity_cone_of_shadow(None, user_ente_id)
 
 def get_user_accessible_entities(user_id: int) -> List[int]:
     """Recupera gli enti accessibili dall'utente con cache - implementa il cono d'ombra"""
-    cache_key = f"entities_{user_id}"
-    if cache_key in _entity_cache:
-        cache_data = _entity_cache[cache_key]
-        if datetime.datetime.now() - cache_data['timestamp'] < datetime.timedelta(seconds=_cache_timeout):
-            return cache_data['data']
+    cache_key = ('entities', user_id)
+    cached = _entity_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached
+    version = _entity_cache.version(user_id)
 
     try:
-        conn = get_auth_db_connection()
-        with conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(
-                    'SELECT accesso_globale, ruolo_id, ente_militare_id, attivo FROM utenti WHERE id = %s',
-                    (user_id,)
-                )
-                user = cur.fetchone()
-
-                if not user or not _is_true(user.get("attivo", True)):
-                    return []
-
-                # ADMIN ha sempre accesso globale
-                if _is_true(user.get('accesso_globale')) or is_user_admin_by_id(user_id):
-                    cur.execute('SELECT id FROM enti_militari ORDER BY id')
-                    entities = cur.fetchall()
-                    result = [e['id'] for e in entities]
-                else:
-                    user_ente_id = user.get('ente_militare_id')
-                    if not user_ente_id:
-                        result = []
-                    else:
-                        # Prova vista v_enti_accessibili
-                        try:
-                            cur.execute(
-                                'SELECT DISTINCT ente_id FROM v_enti_accessibili WHERE utente_id = %s',
-                                (user_id,)
-                            )
-                            rows = cur.fetchall()
-                            if rows:
-                                result = [r['ente_id'] for r in rows]
-                            else:
-                                result = _get_entity_cone_of_shadow(conn, user_ente_id)
-                        except psycopg2.Error:
-                            result = _get_entity_cone_of_shadow(conn, user_ente_id)
-
-        _entity_cache[cache_key] = {
-            'data': result,
-            'timestamp': datetime.datetime.now()
-        }
-        return result
+        result = _resolve_accessible_entities(get_user_by_id(user_id))
     except psycopg2.Error as e:
         if hasattr(current_app, 'logger'):
             current_app.logger.error(f"Errore nel recupero enti accessibili: {e}")
         return []
 
+    _entity_cache.set(cache_key, result, user_id=user_id, version=version)
+    return result
+
+def get_user_for_login(username: str, include_view: bool = True) -> Optional[Dict]:
+    """
+    Login in un solo round trip: riga utente con ruolo ed ente radice del cono
+    e, se la vista esiste, gli enti di v_enti_accessibili (chiave '_enti_vista').
+    Permessi (matrice) e cono d'ombra (indice) non richiedono altre query.
+    """
+    view_column = ''
+    if include_view and schema_capabilities.get().has_table(VIEW_ENTI_ACCESSIBILI):
+        view_column = (',\n               ARRAY(SELECT DISTINCT v.ente_id FROM v_enti_accessibili v'
+                       ' WHERE v.utente_id = u.id) AS _enti_vista')
+    sql = f'''
+        SELECT u.*, r.nome AS ruolo_nome, r.livello_accesso, em.nome AS ente_nome,
+               r.id AS ruolo_id_real, u.accesso_globale{view_column}
+        FROM utenti u
+        LEFT JOIN ruoli r ON r.id = u.ruolo_id
+        LEFT JOIN enti_militari em ON em.id = u.ente_militare_id
+        WHERE u.username = %s
+          AND (u.attivo IS NULL OR u.attivo = TRUE)
+          AND (u.eliminato IS NULL OR u.eliminato = FALSE)
+    '''
+    try:
+        with db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, (username,))
+                row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        if not view_column:
+            raise
+        # Vista assente: da ora in poi query senza la colonna
+        schema_capabilities.forget(VIEW_ENTI_ACCESSIBILI)
+        return get_user_for_login(username, include_view=False)
+    except psycopg2.Error as e:
+        if hasattr(current_app, 'logger'):
+            current_app.logger.error(f"Errore database get_user_for_login: {e}")
+        return None
+
+    return dict(row) if row else None
+
+def prime_user_caches(user: Dict) -> Dict:
+    """Pre-carica cache utente ed enti accessibili con la riga letta al login."""
+    user = dict(user)
+    view_ids = user.pop('_enti_vista', MISSING)
+    user_id = user['id']
+    clear_user_cache(user_id)
+    _permission_cache.set(('user', user_id), user, user_id=user_id)
+    _entity_cache.set(('entities', user_id), _resolve_accessible_entities(user, view_ids), user_id=user_id)
+    return user
+
 def _get_entity_cone_of_shadow(conn, root_entity_id: int) -> List[int]:
-    """Implementa la logica del cono d'ombra per un ente"""
+    """
+    Implementa la logica del cono d'ombra per un ente.
+    Usa l'indice gerarchico di processo: BFS una sola volta per ente radice,
+    risultato condiviso tra utenti con membership O(1).
+    """
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute('SELECT id, parent_id FROM enti_militari')
-            all_entities = cur.fetchall()
-        entity_map = {e['id']: e['parent_id'] for e in all_entities}
-
-        def get_descendants(entity_id, visited=None):
-            if visited is None:
-                visited = set()
-            if entity_id in visited:
-                return []
-            visited.add(entity_id)
-
-            descendants = [entity_id]
-            for eid, parent_id in entity_map.items():
-                if parent_id == entity_id:
-                    descendants.extend(get_descendants(eid, visited))
-            return descendants
-
-        return get_descendants(root_entity_id)
+        return enti_hierarchy.get_descendants(root_entity_id, conn)
     except Exception:
-        return [root_entity_id]
+        return EntitySet([root_entity_id])
 
 def log_user_action(user_id: int, action: str, details: str = None,
                     resource_type: str = None, resource_id: int = None,
                     ip_address: str = None, result: str = 'SUCCESS'):
-    """Registra azione utente nel log"""
-    sql = '''
-        INSERT INTO log_utenti
-        (utente_id, azione, dettagli, risorsa_tipo, risorsa_id, ip_address, esito, timestamp)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
-    '''
+    """
+    Registra azione utente nel log.
+    La riga viene accodata e scritta a lotti da un thread (audit_log.py):
+    nessuna attesa sul database durante la richiesta.
+    """
+    if ip_address is None and has_request_context():
+        ip_address = request.remote_addr
     try:
-        conn = get_auth_db_connection()
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, (
-                    user_id, action, details, resource_type, resource_id,
-                    ip_address or (request.remote_addr if request else None), result
-                ))
+        audit_log.enqueue(user_id, action, details, resource_type, resource_id,
+                          ip_address, result)
     except psycopg2.Error as e:
         # Il log  "best-effort": non sollevare eccezioni in app
         if hasattr(current_app, 'logger'):
@@ -289,38 +290,49 @@ def log_user_action(user_id: int, action: str, details: str = None,
 def clear_user_cache(user_id: int = None):
     """Cancella cache utente (da chiamare dopo modifiche)"""
     if user_id:
-        keys_to_remove = [k for k in list(_permission_cache.keys()) if k.endswith(f"_{user_id}")]
-        for key in keys_to_remove:
-            _permission_cache.pop(key, None)
-        keys_to_remove = [k for k in list(_entity_cache.keys()) if k.endswith(f"_{user_id}")]
-        for key in keys_to_remove:
-            _entity_cache.pop(key, None)
+        _permission_cache.invalidate_user(user_id)
+        _entity_cache.invalidate_user(user_id)
     else:
         _permission_cache.clear()
         _entity_cache.clear()
 
+def set_cache_ttl(seconds: int):
+    """
+    Imposta il TTL delle cache di autenticazione.
+    Usato quando l'invalidazione via LISTEN/NOTIFY è attiva (cache_invalidation.py).
+    """
+    global _cache_timeout
+    _cache_timeout = int(seconds)
+    _permission_cache.ttl = float(seconds)
+    _entity_cache.ttl = float(seconds)
+    permission_matrix.set_ttl(seconds)
+
 # ===========================================
 # FUNZIONI HELPER PER I RUOLI
 # ===========================================
 
-def is_user_admin_by_id(user_id: int) -> bool:
-    """Verifica se un utente  admin basandosi sull'ID"""
-    user = get_user_by_id(user_id)
+def _user_row_is_admin(user: Optional[Dict]) -> bool:
     if not user:
         return False
-    return ((user.get('ruolo_nome', '').upper() == ROLE_ADMIN) or
+    return (((user.get('ruolo_nome') or '').upper() == ROLE_ADMIN) or
             (int(user.get('livello_accesso') or 0) >= LEVEL_ADMIN) or
             _is_true(user.get('accesso_globale')))
 
-def is_user_operatore_or_above(user_id: int) -> bool:
-    """Verifica se un utente  operatore o superiore"""
-    user = get_user_by_id(user_id)
+def _user_row_is_operatore_or_above(user: Optional[Dict]) -> bool:
     if not user:
         return False
     role = (user.get('ruolo_nome') or '').upper()
     level = int(user.get('livello_accesso') or 0)
     return (role in [ROLE_ADMIN, ROLE_OPERATORE] or level >= LEVEL_OPERATORE or _is_true(user.get('accesso_globale')))
 
+def is_user_admin_by_id(user_id: int) -> bool:
+    """Verifica se un utente  admin basandosi sull'ID"""
+    return _user_row_is_admin(get_user_by_id(user_id))
+
+def is_user_operatore_or_above(user_id: int) -> bool:
+    """Verifica se un utente  operatore o superiore"""
+    return _user_row_is_operatore_or_above(get_user_by_id(user_id))
+
 def is_user_visualizzatore_or_above(user_id: int) -> bool:
     """Verifica se un utente  visualizzatore o superiore"""
     user = get_user_by_id(user_id)
@@ -370,29 +382,134 @@ def get_current_user_session() -> Optional[Dict]:
     return None
 
 def verify_session_token(token: str) -> Optional[Dict]:
-    """Verifica token di sessione con validazione e scadenza"""
+    """
+    Verifica token di sessione: firma, scadenza e revoca senza accessi al DB
+    (api_tokens.py); lo stato utente arriva dalla cache di get_user_by_id.
+    """
     if not token or len(token) < 10:
         return None
 
-    sessions = current_app.config.get('user_sessions', {})
-    session_data = sessions.get(token)
-
+    session_data = api_tokens.verify_token(token)
     if not session_data:
         return None
 
-    # Scadenza
-    if datetime.datetime.now() > session_data.get('expires', datetime.datetime.now()):
-        sessions.pop(token, None)
-        return None
-
     # Utente ancora attivo?
     user = get_user_by_id(session_data['user_id'])
     if not user or not _is_true(user.get('attivo', True)):
-        sessions.pop(token, None)
         return None
 
     return session_data
 
+# ===========================================
+# PRINCIPAL DI RICHIESTA
+# ===========================================
+
+_PRINCIPAL_KEY = '_talon_principal'
+_NOT_LOADED = object()
+
+class Principal:
+    """
+    Utente autenticato risolto una sola volta per richiesta (flask.g):
+    sessione, riga utente, ruolo, livello, permessi e enti accessibili.
+    Immutabile; gli enti accessibili vengono calcolati al primo utilizzo.
+    """
+    __slots__ = ('user_id', 'username', 'session', 'user', 'role', 'level',
+                 'is_admin', 'is_operatore_or_above', 'permission_mask', '_matrix', '_entities')
+
+    def __init__(self, session_data: Dict, user: Optional[Dict], matrix):
+        init = object.__setattr__
+        init(self, 'user_id', session_data['user_id'])
+        init(self, 'username', session_data.get('username'))
+        init(self, 'session', MappingProxyType(dict(session_data)))
+        init(self, 'user', MappingProxyType(dict(user)) if user else None)
+        init(self, 'role', (user.get('ruolo_nome') or '').upper() if user else '')
+        init(self, 'level', int(user.get('livello_accesso') or 0) if user else 0)
+        init(self, 'is_admin', _user_row_is_admin(user))
+        init(self, 'is_operatore_or_above', _user_row_is_operatore_or_above(user))
+        init(self, 'permission_mask', matrix.mask_for_user(user))
+        init(self, '_matrix', matrix)
+        init(self, '_entities', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Principal è immutabile")
+
+    def __repr__(self):
+        return f"<Principal {self.username!r} role={self.role!r}>"
+
+    @property
+    def permissions(self) -> FrozenSet[str]:
+        return self._matrix.names_for(self.permission_mask)
+
+    def has_permission(self, permission_name: str) -> bool:
+        return self._matrix.has(self.permission_mask, permission_name)
+
+    @property
+    def accessible_entities(self) -> List[int]:
+        entities = self._entities
+        if entities is None:
+            entities = get_user_accessible_entities(self.user_id)
+            object.__setattr__(self, '_entities', entities)
+        return entities
+
+    def can_access_entity(self, entity_id: int) -> bool:
+        return entity_id in self.accessible_entities
+
+def _build_principal() -> Optional[Principal]:
+    session_data = get_current_user_session()
+    if not session_data:
+        return None
+    user_id = session_data['user_id']
+    return Principal(session_data, get_user_by_id(user_id), permission_matrix.get_matrix())
+
+def get_principal() -> Optional[Principal]:
+    """Principal della richiesta corrente (None se anonimo o fuori richiesta)."""
+    if not has_request_context():
+        return None
+    principal = g.get(_PRINCIPAL_KEY, _NOT_LOADED)
+    if principal is _NOT_LOADED:
+        principal = _build_principal()
+        setattr(g, _PRINCIPAL_KEY, principal)
+    return principal
+
+def reset_principal():
+    """Da chiamare quando la sessione cambia durante la richiesta (login/logout)."""
+    if has_request_context():
+        g.pop(_PRINCIPAL_KEY, None)
+
+def load_principal():
+    """before_request: risolve l'utente una volta sola (non per i file statici)"""
+    endpoint = request.endpoint or ''
+    if endpoint == 'static' or endpoint.endswith('.static'):
+        return None
+    get_principal()
+    return None
+
+def setup_request_principal(app):
+    """Registra la risoluzione del Principal all'inizio di ogni richiesta"""
+    app.before_request(load_principal)
+
+class LazyAccessibleEntities:
+    """Accesso pigro agli enti accessibili per i template (calcolati solo se usati)."""
+    __slots__ = ('_principal',)
+
+    def __init__(self, principal: Optional[Principal]):
+        self._principal = principal
+
+    def _items(self):
+        return self._principal.accessible_entities if self._principal else []
+
+    def __contains__(self, entity_id) -> bool:
+        return entity_id in self._items()
+
+    def __iter__(self):
+        return iter(self._items())
+
+    def __len__(self) -> int:
+        return len(self._items())
+
+    def __bool__(self) -> bool:
+        return bool(self._items())
+
 # ===========================================
 # DECORATORI DI AUTENTICAZIONE
 # ===========================================
@@ -401,9 +518,9 @@ def login_required(f):
     """Decoratore base per richiedere login"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        session_data = get_current_user_session()
+        principal = get_principal()
 
-        if not session_data:
+        if principal is None:
             if hasattr(current_app, 'logger'):
                 current_app.logger.warning(f"Accesso non autorizzato a {request.path} da {request.remote_addr}")
             if request.path.startswith('/api/'):
@@ -412,12 +529,12 @@ def login_required(f):
             return redirect(url_for('show_login', next=request.url))
 
         # Imposta utente corrente nella richiesta
-        request.current_user = session_data
+        request.current_user = principal.session
 
         # Log accesso (solo mutazioni)
         if request.method in ['POST', 'PUT', 'DELETE']:
             log_user_action(
-                user_id=session_data['user_id'],
+                user_id=principal.user_id,
                 action=f"{request.method} {request.endpoint}",
                 details=f"Path: {request.path}",
                 ip_address=request.remote_addr
@@ -431,8 +548,9 @@ def admin_required(f):
     @wraps(f)
     @login_required
     def decorated_function(*args, **kwargs):
-        user_id = request.current_user['user_id']
-        if not is_user_admin_by_id(user_id):
+        principal = get_principal()
+        user_id = principal.user_id
+        if not principal.is_admin:
             log_user_action(
                 user_id=user_id,
                 action='ACCESS_DENIED_ADMIN',
@@ -451,9 +569,10 @@ def operatore_or_admin_required(f):
     @wraps(f)
     @login_required
     def decorated_function(*args, **kwargs):
-        user_id = request.current_user['user_id']
-        if not is_user_operatore_or_above(user_id):
-            user_role = get_user_role_name(user_id)
+        principal = get_principal()
+        user_id = principal.user_id
+        if not principal.is_operatore_or_above:
+            user_role = principal.role
             log_user_action(
                 user_id=user_id,
                 action='ACCESS_DENIED_OPERATORE',
@@ -472,8 +591,7 @@ def cono_ombra_required(f):
     @wraps(f)
     @login_required
     def decorated_function(*args, **kwargs):
-        user_id = request.current_user['user_id']
-        if is_user_admin_by_id(user_id):
+        if get_principal().is_admin:
             return f(*args, **kwargs)
         # (Logica specifica aggiuntiva se necessario)
         return f(*args, **kwargs)
@@ -485,9 +603,9 @@ def permission_required(permission_name: str):
         @wraps(f)
         @login_required
         def decorated_function(*args, **kwargs):
-            user_id = request.current_user['user_id']
-            user_permissions = get_user_permissions(user_id)
-            if permission_name not in user_permissions:
+            principal = get_principal()
+            user_id = principal.user_id
+            if not principal.has_permission(permission_name):
                 log_user_action(
                     user_id=user_id,
                     action='ACCESS_DENIED_PERMISSION',
@@ -512,9 +630,10 @@ def entity_access_required(entity_param_name: str = 'id'):
         @wraps(f)
         @login_required
         def decorated_function(*args, **kwargs):
-            user_id = request.current_user['user_id']
+            principal = get_principal()
+            user_id = principal.user_id
 
-            if is_user_admin_by_id(user_id):
+            if principal.is_admin:
                 return f(*args, **kwargs)
 
             # Estrai ID ente
@@ -544,8 +663,7 @@ def entity_access_required(entity_param_name: str = 'id'):
                 flash('ID ente non valido.', 'error')
                 return redirect(url_for('main.dashboard'))
 
-            accessible_entities = get_user_accessible_entities(user_id)
-            if entity_id not in accessible_entities:
+            if not principal.can_access_entity(entity_id):
                 log_user_action(
                     user_id=user_id,
                     action='ACCESS_DENIED_ENTITY',
@@ -571,8 +689,9 @@ def role_required(required_role: str):
         @wraps(f)
         @login_required
         def decorated_function(*args, **kwargs):
-            user_id = request.current_user['user_id']
-            user_role = get_user_role_name(user_id)
+            principal = get_principal()
+            user_id = principal.user_id
+            user_role = principal.role
             required_role_upper = required_role.upper()
 
             if user_role == ROLE_ADMIN:
@@ -602,40 +721,35 @@ def role_required(required_role: str):
 
 def get_current_user_info() -> Optional[Dict]:
     """Recupera informazioni complete dell'utente corrente"""
-    session_data = get_current_user_session()
-    if session_data:
-        return get_user_by_id(session_data['user_id'])
+    principal = get_principal()
+    if principal and principal.user is not None:
+        return dict(principal.user)
     return None
 
 def check_permission(permission_name: str) -> bool:
     """Verifica se l'utente corrente ha un permesso specifico"""
-    session_data = get_current_user_session()
-    if session_data:
-        perms = get_user_permissions(session_data['user_id'])
-        return permission_name in perms
-    return False
+    principal = get_principal()
+    return principal.has_permission(permission_name) if principal else False
 
 def get_accessible_entities() -> List[int]:
     """Recupera lista enti accessibili all'utente corrente"""
-    session_data = get_current_user_session()
-    if session_data:
-        return get_user_accessible_entities(session_data['user_id'])
-    return []
+    principal = get_principal()
+    return principal.accessible_entities if principal else []
 
 def is_admin() -> bool:
     """Verifica se l'utente corrente  amministratore"""
-    session_data = get_current_user_session()
-    return is_user_admin_by_id(session_data['user_id']) if session_data else False
+    principal = get_principal()
+    return principal.is_admin if principal else False
 
 def is_operatore_or_above() -> bool:
     """Verifica se l'utente corrente  operatore o superiore"""
-    session_data = get_current_user_session()
-    return is_user_operatore_or_above(session_data['user_id']) if session_data else False
+    principal = get_principal()
+    return principal.is_operatore_or_above if principal else False
 
 def get_user_role() -> str:
     """Recupera il ruolo dell'utente corrente"""
-    session_data = get_current_user_session()
-    return get_user_role_name(session_data['user_id']) if session_data else ''
+    principal = get_principal()
+    return principal.role if principal else ''
 
 # ===========================================
 # DECORATORI SEMPLIFICATI PER I BLUEPRINT
@@ -678,14 +792,14 @@ def simple_operatore_or_admin_required(f):
 
 def inject_user_context():
     """Inietta informazioni utente nel contesto dei template"""
-    user_info = get_current_user_info()
-    if user_info:
+    principal = get_principal()
+    if principal and principal.user is not None:
         return {
-            'current_user': user_info,
-            'user_role': user_info.get('ruolo_nome', ''),
-            'is_admin': is_admin(),
-            'is_operatore_or_above': is_operatore_or_above(),
-            'accessible_entities': get_accessible_entities()
+            'current_user': principal.user,
+            'user_role': principal.user.get('ruolo_nome', ''),
+            'is_admin': principal.is_admin,
+            'is_operatore_or_above': principal.is_operatore_or_above,
+            'accessible_entities': LazyAccessibleEntities(principal)
         }
     return {
         'current_user': None,
@@ -705,23 +819,32 @@ def setup_auth_context_processor(app):
 # FUNZIONI DI MIGRAZIONE E SETUP
 # ===========================================
 
-def update_session_with_role_info(user_id: int):
-    """Aggiorna la sessione Flask con le informazioni del ruolo"""
-    user = get_user_by_id(user_id)
+def update_session_with_role_info(user_id: int, user: Optional[Dict] = None):
+    """
+    Aggiorna la sessione Flask con le informazioni del ruolo.
+    Se `user` è la riga appena letta (get_user_for_login) le cache vengono
+    pre-caricate con essa, senza altre query.
+    """
+    if user is not None:
+        user = prime_user_caches(user)
+    else:
+        # Dati freschi: invalida prima di leggere, così la cache resta calda
+        clear_user_cache(user_id)
+        user = get_user_by_id(user_id)
     if user and 'user_id' in session:
         session['ruolo_nome'] = user.get('ruolo_nome', '')
         session['livello_accesso'] = user.get('livello_accesso', 0)
         session['ente_militare_id'] = user.get('ente_militare_id')
         session['accesso_globale'] = _is_true(user.get('accesso_globale'))
-        session['is_admin'] = is_user_admin_by_id(user_id)
-        session['is_operatore_or_above'] = is_user_operatore_or_above(user_id)
-        clear_user_cache(user_id)
+        session['is_admin'] = _user_row_is_admin(user)
+        session['is_operatore_or_above'] = _user_row_is_operatore_or_above(user)
+    # La sessione è cambiata: il Principal va ricalcolato
+    reset_principal()
 
 def validate_user_role_consistency():
     """Valida la consistenza dei ruoli nel database"""
     try:
-        conn = get_auth_db_connection()
-        with conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Utenti con ruoli non validi
                 cur.execute('''
@@ -781,8 +904,7 @@ def debug_user_permissions(user_id: int) -> Dict:
 def get_system_auth_stats() -> Dict:
     """Statistiche del sistema di autenticazione"""
     try:
-        conn = get_auth_db_connection()
-        with conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 stats = {}
 
@@ -799,26 +921,27 @@ def get_system_auth_stats() -> Dict:
                 rows = cur.fetchall()
                 stats['users_by_role'] = {row['ruolo']: int(row['count']) for row in rows}
 
-                # Permessi per ruolo
-                cur.execute('''
-                    SELECT r.nome AS ruolo, COUNT(DISTINCT p.id) AS count
-                    FROM ruoli r
-                    LEFT JOIN ruoli_permessi rp ON r.id = rp.ruolo_id
-                    LEFT JOIN permessi p ON p.id = rp.permesso_id
-                      AND (p.attivo IS NULL OR p.attivo = TRUE OR p.attivo = TRUE)
-                    WHERE (r.attivo IS NULL OR r.attivo = TRUE OR r.attivo = TRUE)
-                    GROUP BY r.id, r.nome
-                    ORDER BY r.livello_accesso DESC
-                ''')
-                rows = cur.fetchall()
-                stats['permissions_by_role'] = {row['ruolo']: int(row['count']) for row in rows}
+                # Permessi per ruolo (dalla matrice compilata)
+                matrix = permission_matrix.get_matrix()
+                stats['permissions_by_role'] = matrix.permissions_by_role()
+                stats['permission_matrix'] = matrix.info()
 
                 # Cache
                 stats['cache_info'] = {
                     'permission_cache_size': len(_permission_cache),
                     'entity_cache_size': len(_entity_cache),
-                    'cache_timeout': _cache_timeout
+                    'cache_timeout': _cache_timeout,
+                    'cache_max_size': _cache_max_size,
+                    'permission_cache': _permission_cache.stats(),
+                    'entity_cache': _entity_cache.stats(),
+                    'enti_index': enti_hierarchy.get_index_info()
                 }
+
+                # Writer asincrono di log_utenti
+                stats['audit_log'] = audit_log.get_audit_info()
+
+                # Token API
+                stats['api_tokens'] = api_tokens.get_token_info()
                 return stats
     except psycopg2.Error as e:
         return {'error': str(e)}
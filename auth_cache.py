@@ -0,0 +1,149 @@
+# auth_cache.py - Cache LRU con scadenza (TTL) per le lookup di autenticazione
+"""
+Cache in memoria limitata in dimensione, con TTL su orologio monotono e indice
+per utente: `invalidate_user()` rimuove tutte le voci di un utente in O(k)
+(k = voci dell'utente) senza scandire l'intera cache.
+
+Thread-safe: tutte le operazioni avvengono sotto un unico lock, adeguato ai
+thread di waitress (le sezioni critiche sono solo operazioni su dict).
+
+Lettura dal database e memorizzazione non sono atomiche: un'invalidazione
+arrivata nel frattempo (es. NOTIFY) verrebbe annullata dal `set()` del
+valore letto prima. Per evitarlo si legge `version(user_id)` prima della
+query e la si passa a `set()`, che non memorizza se nel frattempo sono
+stati chiamati `invalidate_user()` o `clear()`.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+# Valore sentinella: distingue "non in cache" da un valore None memorizzato
+MISSING = object()
+
+class TTLCache:
+    """Cache LRU + TTL con indice per utente e contatori hit/miss/eviction."""
+
+    def __init__(self, name: str, maxsize: int = 2048, ttl: float = 300):
+        self.name = name
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = float(ttl)
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any, Optional[int]]]' = OrderedDict()
+        self._by_user: Dict[int, set] = {}
+        self._lock = threading.Lock()
+        # Generazioni: globale (clear) e per utente (invalidate_user)
+        self._generation = 0
+        self._user_generations: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    # --- operazioni interne (chiamate con il lock acquisito) ---
+
+    def _unlink(self, key, user_id):
+        if user_id is None:
+            return
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._unlink(key, entry[2])
+        return entry
+
+    # --- API pubblica ---
+
+    def get(self, key, default=MISSING):
+        """Restituisce il valore o `default` (MISSING) se assente o scaduto."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[0] <= now:
+                self._pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def version(self, user_id: Optional[int] = None) -> Tuple[int, int]:
+        """Generazione corrente da passare a `set()` (letta prima della query)."""
+        with self._lock:
+            return self._generation, self._user_generations.get(user_id, 0)
+
+    def set(self, key, value, user_id: Optional[int] = None, ttl: Optional[float] = None,
+            version: Optional[Tuple[int, int]] = None) -> bool:
+        """
+        Memorizza `value`; `user_id` lo registra nell'indice per utente.
+        Con `version` non memorizza (e restituisce False) se la cache o
+        l'utente sono stati invalidati dopo la lettura della versione.
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if version is not None and version != (
+                self._generation, self._user_generations.get(user_id, 0)
+            ):
+                return False
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (expires, value, user_id)
+            if user_id is not None:
+                self._by_user.setdefault(user_id, set()).add(key)
+            while len(self._data) > self.maxsize:
+                old_key, old_entry = self._data.popitem(last=False)
+                self._unlink(old_key, old_entry[2])
+                self.evictions += 1
+            return True
+
+    def delete(self, key) -> bool:
+        with self._lock:
+            return self._pop(key) is not None
+
+    def invalidate_user(self, user_id: int) -> int:
+        """Rimuove tutte le voci di un utente; restituisce quante ne ha rimosse."""
+        with self._lock:
+            self._user_generations[user_id] = self._user_generations.get(user_id, 0) + 1
+            keys = self._by_user.pop(user_id, None)
+            if not keys:
+                return 0
+            for key in keys:
+                self._data.pop(key, None)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._data)
+            self._data.clear()
+            self._by_user.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'users': len(self._by_user),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
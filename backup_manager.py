@@ -11,8 +11,10 @@ import shutil
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import sqlite3
+from contextlib import closing
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_connection
 import threading
 import time
 from pathlib import Path
@@ -200,13 +202,7 @@ class TalonBackupManager:
     def _get_db_connection(self):
         """Ottiene connessione al database TALON"""
         try:
-            return psycopg2.connect(
-                host=self.db_host,
-                port=self.db_port,
-                database=self.db_name,
-                user=self.db_user,
-                password=self.db_password
-            )
+            return get_connection()
         except Exception as e:
             logger.error(f"Errore connessione database: {e}")
             raise
@@ -215,7 +211,7 @@ class TalonBackupManager:
         """Ottiene statistiche del database"""
         try:
             conn = self._get_db_connection()
-            with conn:
+            with closing(conn), conn:
                 with conn.cursor(cursor_factory=RealDictCursor) as cur:
                     # Dimensione database
                     cur.execute("SELECT pg_size_pretty(pg_database_size('talon')) as size")
@@ -3,8 +3,10 @@
 Blueprint per geocoding interattivo TALON
 """
 from flask import Blueprint, render_template, request, jsonify
+from contextlib import closing
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from db import get_connection
 import sys
 import os
 
@@ -27,17 +29,8 @@ DB_CONFIG = {
 }
 
 def get_db_connection():
-    """Ottiene connessione database"""
-    conn = psycopg2.connect(
-        host=DB_CONFIG.get('host', 'localhost'),
-        port=DB_CONFIG.get('port', 5432),
-        database=DB_CONFIG.get('database', 'talon'),
-        user=DB_CONFIG.get('user', 'talon'),
-        password=DB_CONFIG.get('password', 'TalonDB!2025'),
-        cursor_factory=RealDictCursor
-    )
-    conn.autocommit = True
-    return conn
+    """Ottiene connessione database dal pool condiviso"""
+    return get_connection(cursor_factory=RealDictCursor, autocommit=True)
 
 @geocoding_bp.route('/geocoding')
 @login_required
@@ -52,7 +45,7 @@ def geocoding_interattivo():
 def tutti_gli_enti():
     """API per ottenere tutti gli enti (civili e militari) con informazioni sulle coordinate"""
     try:
-        with get_db_connection() as conn:
+        with closing(get_db_connection()) as conn:
             with conn.cursor() as cur:
                 # Query per enti militari
                 cur.execute("""
@@ -154,7 +147,7 @@ def tutti_gli_enti():
 def enti_senza_coordinate():
     """API per ottenere enti senza coordinate"""
     try:
-        with get_db_connection() as conn:
+        with closing(get_db_connection()) as conn:
             with conn.cursor() as cur:
                 # Query per enti militari senza coordinate
                 cur.execute("""
@@ -273,7 +266,7 @@ def salva_coordinate():
         
         # Salva coordinate direttamente per operazioni o usa GeoManager per enti
         if tipo == 'operazione':
-            with get_db_connection() as conn:
+            with closing(get_db_connection()) as conn:
                 with conn.cursor() as cur:
                     # Verifica che l'operazione esista
                     cur.execute("SELECT nome_missione FROM operazioni WHERE id = %s", (ente_id,))
@@ -300,7 +293,7 @@ def salva_coordinate():
             if success:
                 # Ottieni nome ente per conferma
                 table = 'enti_militari' if tipo == 'militare' else 'enti_civili'
-                with get_db_connection() as conn:
+                with closing(get_db_connection()) as conn:
                     with conn.cursor() as cur:
                         cur.execute(f"SELECT nome FROM {table} WHERE id = %s", (ente_id,))
                         result = cur.fetchone()
@@ -421,7 +414,7 @@ def aggiorna_indirizzo():
         
         table = 'enti_militari' if tipo == 'militare' else 'enti_civili'
         
-        with get_db_connection() as conn:
+        with closing(get_db_connection()) as conn:
             with conn.cursor() as cur:
                 # Verifica che l'ente esista
                 cur.execute(f"SELECT nome FROM {table} WHERE id = %s", (ente_id,))
@@ -493,7 +486,7 @@ def reset_coordinate():
         
         table = 'operazioni' if tipo == 'operazione' else ('enti_militari' if tipo == 'militare' else 'enti_civili')
         
-        with get_db_connection() as conn:
+        with closing(get_db_connection()) as conn:
             with conn.cursor() as cur:
                 cur.execute(f"""
                     UPDATE {table} 
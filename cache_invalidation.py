@@ -0,0 +1,255 @@
+# cache_invalidation.py - Invalidazione cache tra processi via PostgreSQL LISTEN/NOTIFY
+"""
+Ogni processo avvia un thread che ascolta il canale `talon_cache_invalidate`
+su una connessione dedicata (fuori dal pool). I trigger installati da
+migrations/add_cache_invalidation_notify.sql notificano le modifiche a utenti,
+ruoli, permessi, ruoli_permessi ed enti_militari; il thread rimuove le voci interessate
+dalle cache di auth.py e dall'indice gerarchico degli enti. Lo stesso canale
+trasporta le revoche dei token API (api_tokens.py) e le scritture su eventi e
+attivita che invalidano le risposte dei grafici (response_cache.py).
+
+Se la connessione cade, alla riconnessione le cache vengono svuotate per
+intero (le notifiche perse nel frattempo non sono recuperabili).
+Con i trigger presenti il TTL delle cache può salire a ore senza rischi di
+dati obsoleti (TALON_AUTH_CACHE_TTL_LISTEN, default 4 ore).
+"""
+import os
+import json
+import time
+import select
+import logging
+import threading
+from typing import Dict, Optional
+
+import psycopg2
+
+import db
+import auth
+import api_tokens
+import enti_hierarchy
+import permission_matrix
+import response_cache
+import schema_capabilities
+
+# ===========================================
+# CONFIGURAZIONE
+# ===========================================
+
+CHANNEL = 'talon_cache_invalidate'
+
+# Abilita il listener (0 per disattivarlo, es. script batch)
+LISTEN_ENABLED = os.environ.get('TALON_CACHE_LISTEN', '1') == '1'
+
+# TTL delle cache quando l'invalidazione è attiva
+LISTEN_CACHE_TTL = int(os.environ.get('TALON_AUTH_CACHE_TTL_LISTEN', str(4 * 3600)))
+
+# Secondi di attesa su select() prima di ricontrollare lo stop
+POLL_SECONDS = 5.0
+
+# Attesa massima tra tentativi di riconnessione
+MAX_BACKOFF_SECONDS = 60.0
+
+# Trigger attesi (vedi migrazione)
+REQUIRED_TRIGGERS = (
+    'trg_talon_cache_utenti',
+    'trg_talon_cache_utenti_upd',
+    'trg_talon_cache_ruoli',
+    'trg_talon_cache_ruoli_permessi',
+    'trg_talon_cache_enti_militari',
+)
+
+logger = logging.getLogger(__name__)
+
+# ===========================================
+# GESTIONE NOTIFICHE
+# ===========================================
+
+def _clear_all():
+    enti_hierarchy.invalidate()
+    permission_matrix.invalidate()
+    auth.clear_user_cache()
+    response_cache.invalidate()
+
+def _clear_role(conn, ruolo_id):
+    """Invalida gli utenti di un ruolo (indice per utente: O(utenti del ruolo))"""
+    if ruolo_id is None:
+        auth.clear_user_cache()
+        return
+    with conn.cursor() as cur:
+        cur.execute('SELECT id FROM utenti WHERE ruolo_id = %s', (ruolo_id,))
+        for (user_id,) in cur.fetchall():
+            auth.clear_user_cache(user_id)
+
+def handle_notification(conn, payload: str):
+    """Applica una notifica; payload non riconosciuti svuotano tutte le cache."""
+    try:
+        data = json.loads(payload)
+        table = data.get('table')
+    except (TypeError, ValueError):
+        data, table = {}, None
+
+    if table == 'utenti' and data.get('utente_id') is not None:
+        auth.clear_user_cache(data['utente_id'])
+    elif table in ('ruoli', 'ruoli_permessi'):
+        permission_matrix.invalidate()
+        _clear_role(conn, data.get('ruolo_id'))
+    elif table == 'permessi':
+        permission_matrix.invalidate()
+    elif table == 'api_token_revocati':
+        # Revoca di un token API da un altro processo
+        api_tokens.mark_revoked(data.get('jti'), data.get('scadenza') or 0)
+    elif table in response_cache.DOMAINS:
+        # Nuovi dati per i grafici (eventi o attivita)
+        response_cache.invalidate(table)
+    elif table == 'enti_militari':
+        # Cambia la gerarchia: coni d'ombra e nomi ente nei dati utente
+        _clear_all()
+    else:
+        _clear_all()
+    return table
+
+class CacheInvalidationListener(threading.Thread):
+    """Thread daemon che esegue LISTEN e smista le notifiche."""
+
+    def __init__(self):
+        super().__init__(name='talon-cache-listener', daemon=True)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.connected = False
+        self.received = 0
+        self.reconnects = 0
+        self.last_notification: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        backoff = 1.0
+        first = True
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = db.open_dedicated_connection(autocommit=True)
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN {CHANNEL}')
+                with self._lock:
+                    self.connected = True
+                if not first:
+                    # Notifiche perse durante la disconnessione: ripartenza da zero
+                    self.reconnects += 1
+                    _clear_all()
+                    logger.warning("Listener cache riconnesso: cache svuotate")
+                first = False
+                backoff = 1.0
+                self._listen(conn)
+            except psycopg2.Error as e:
+                with self._lock:
+                    self.last_error = str(e)
+                logger.warning(f"Listener cache: connessione persa ({e}), nuovo tentativo tra {backoff:.0f}s")
+            except Exception:
+                logger.exception("Listener cache: errore inatteso")
+            finally:
+                with self._lock:
+                    self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except psycopg2.Error:
+                        pass
+            if self._stop_event.wait(backoff):
+                break
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    def _listen(self, conn):
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([conn], [], [], POLL_SECONDS)
+            if not ready:
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                try:
+                    handle_notification(conn, notify.payload)
+                except psycopg2.Error:
+                    raise
+                except Exception:
+                    logger.exception("Listener cache: notifica non gestita, svuoto le cache")
+                    _clear_all()
+                with self._lock:
+                    self.received += 1
+                    self.last_notification = time.time()
+
+    def info(self) -> Dict:
+        with self._lock:
+            return {
+                'running': self.is_alive(),
+                'connected': self.connected,
+                'received': self.received,
+                'reconnects': self.reconnects,
+                'last_notification': self.last_notification,
+                'last_error': self.last_error,
+            }
+
+# ===========================================
+# AVVIO
+# ===========================================
+
+_listener: Optional[CacheInvalidationListener] = None
+_listener_lock = threading.Lock()
+
+def triggers_installed() -> bool:
+    """Verifica che i trigger di notifica siano presenti nel database."""
+    capabilities = schema_capabilities.get()
+    return capabilities.probed and capabilities.has_triggers(*REQUIRED_TRIGGERS)
+
+def _apply_listen_ttl(log=None):
+    """TTL lungo solo con listener e trigger attivi (TALON_AUTH_CACHE_TTL ha la precedenza)."""
+    log = log or logger
+    if triggers_installed():
+        if 'TALON_AUTH_CACHE_TTL' not in os.environ:
+            auth.set_cache_ttl(LISTEN_CACHE_TTL)
+        log.info(f"Invalidazione cache via LISTEN/NOTIFY attiva (TTL {auth._cache_timeout}s)")
+    else:
+        if 'TALON_AUTH_CACHE_TTL' not in os.environ:
+            auth.set_cache_ttl(auth.DEFAULT_CACHE_TTL)
+        log.warning("Trigger di invalidazione cache assenti: applicare "
+                    f"migrations/add_cache_invalidation_notify.sql (TTL {auth._cache_timeout}s)")
+
+def _on_schema_refresh(capabilities):
+    if _listener is not None and _listener.is_alive():
+        _apply_listen_ttl()
+
+schema_capabilities.on_refresh(_on_schema_refresh)
+
+def start_listener(app=None) -> Optional[CacheInvalidationListener]:
+    """
+    Avvia (una sola volta per processo) il thread di invalidazione.
+    Se i trigger sono installati e TALON_AUTH_CACHE_TTL non è impostato,
+    alza il TTL delle cache a LISTEN_CACHE_TTL.
+    """
+    global _listener
+    if not LISTEN_ENABLED:
+        return None
+
+    with _listener_lock:
+        if _listener is not None and _listener.is_alive():
+            return _listener
+        _listener = CacheInvalidationListener()
+        _listener.start()
+
+    _apply_listen_ttl(app.logger if app is not None else None)
+    return _listener
+
+def stop_listener():
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+
+def get_listener_info() -> Dict:
+    listener = _listener
+    if listener is None:
+        return {'running': False, 'enabled': LISTEN_ENABLED}
+    info = listener.info()
+    info['enabled'] = LISTEN_ENABLED
+    return info
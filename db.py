@@ -0,0 +1,537 @@
+# db.py - Pool di connessioni PostgreSQL condiviso da tutti i moduli (thread-safe)
+import os
+import time
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from typing import Optional, Dict, List
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import pool
+from flask import g, has_request_context
+
+# ===========================================
+# CONFIGURAZIONE
+# ===========================================
+
+PG_HOST = os.environ.get("TALON_PG_HOST", "127.0.0.1")
+PG_PORT = int(os.environ.get("TALON_PG_PORT", "5432"))
+PG_DB   = os.environ.get("TALON_PG_DB", "talon")
+PG_USER = os.environ.get("TALON_PG_USER", "talon")
+PG_PASS = os.environ.get("TALON_PG_PASSWORD", os.environ.get("TALON_PG_PASS", "TalonDB!2025"))
+
+# Thread del server (waitress) - il pool viene dimensionato di conseguenza
+SERVER_THREADS = int(os.environ.get("TALON_SERVER_THREADS", "16"))
+
+# Connessioni mantenute aperte nel pool / massimo contemporanee
+POOL_MIN_CONN = int(os.environ.get("TALON_PG_POOL_MIN", str(SERVER_THREADS)))
+POOL_MAX_CONN = int(os.environ.get("TALON_PG_POOL_MAX", str(SERVER_THREADS + 4)))
+
+# Secondi di attesa massima per una connessione libera
+POOL_TIMEOUT = float(os.environ.get("TALON_PG_POOL_TIMEOUT", "10"))
+
+# Connessioni inattive da piu' di N secondi vengono verificate prima dell'uso
+POOL_VALIDATE_AFTER = float(os.environ.get("TALON_PG_POOL_VALIDATE_AFTER", "30"))
+
+# Connessioni trattenute oltre N secondi vengono segnalate come sospette
+POOL_LEAK_SECONDS = float(os.environ.get("TALON_PG_LEAK_SECONDS", "30"))
+
+# Registra lo stack di chi prende la connessione (diagnostica dei leak):
+# costa un traceback per ogni get_connection(), da attivare solo per cercare un leak
+POOL_TRACE_STACKS = os.environ.get("TALON_PG_TRACE_STACKS", "0") == "1"
+
+# Limiti (ms) dell'istogramma dei tempi di attesa
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_pool: Optional[pool.ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+_slots: Optional[threading.BoundedSemaphore] = None
+_pool_params: Dict = {}
+
+logger = logging.getLogger(__name__)
+
+# ===========================================
+# TELEMETRIA DEL POOL
+# ===========================================
+
+class PoolStats:
+    """Contatori, istogramma attese e registro delle connessioni in uso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.returns = 0
+            self.timeouts = 0
+            self.errors = 0
+            self.discarded = 0
+            self.validated = 0
+            self.leaked = 0
+            self.request_leases = 0
+            self.request_fallbacks = 0
+            self.wait_total_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+            self.long_held = 0
+            self._active: Dict[int, Dict] = {}
+
+    def record_wait(self, wait_ms: float):
+        bucket = len(WAIT_BUCKETS_MS)
+        for i, limit in enumerate(WAIT_BUCKETS_MS):
+            if wait_ms <= limit:
+                bucket = i
+                break
+        with self._lock:
+            self.wait_histogram[bucket] += 1
+            self.wait_total_ms += wait_ms
+            if wait_ms > self.wait_max_ms:
+                self.wait_max_ms = wait_ms
+
+    def record_checkout(self, raw_conn, stack=None):
+        with self._lock:
+            self.checkouts += 1
+            self._active[id(raw_conn)] = {
+                'since': time.monotonic(),
+                'thread': threading.current_thread().name,
+                'stack': stack,
+            }
+
+    def record_return(self, raw_conn) -> Optional[Dict]:
+        with self._lock:
+            self.returns += 1
+            info = self._active.pop(id(raw_conn), None)
+        if info is not None:
+            held = time.monotonic() - info['since']
+            if held > POOL_LEAK_SECONDS:
+                with self._lock:
+                    self.long_held += 1
+                logger.warning(
+                    "Connessione DB trattenuta per %.1fs (thread %s)\n%s",
+                    held, info['thread'], _format_stack(info['stack'])
+                )
+        return info
+
+    def increment(self, counter: str, amount: int = 1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def held_connections(self, min_seconds: float = 0) -> List[Dict]:
+        """Connessioni attualmente in uso, dalla piu' vecchia"""
+        now = time.monotonic()
+        with self._lock:
+            active = list(self._active.values())
+        held = []
+        for info in active:
+            seconds = now - info['since']
+            if seconds >= min_seconds:
+                held.append({
+                    'held_seconds': round(seconds, 3),
+                    'thread': info['thread'],
+                    'stack': info['stack'],
+                })
+        held.sort(key=lambda h: h['held_seconds'], reverse=True)
+        return held
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            bounds = list(WAIT_BUCKETS_MS) + [None]
+            waits = self.checkouts + self.timeouts
+            return {
+                'checkouts': self.checkouts,
+                'returns': self.returns,
+                'in_use': len(self._active),
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'discarded': self.discarded,
+                'validated': self.validated,
+                'leaked': self.leaked,
+                'long_held': self.long_held,
+                'request_leases': self.request_leases,
+                'request_fallbacks': self.request_fallbacks,
+                'wait_ms': {
+                    'avg': round(self.wait_total_ms / waits, 3) if waits else 0.0,
+                    'max': round(self.wait_max_ms, 3),
+                    'histogram': [
+                        {'le_ms': bound, 'count': count}
+                        for bound, count in zip(bounds, self.wait_histogram)
+                    ],
+                },
+            }
+
+pool_stats = PoolStats()
+
+# Ultimo rilascio di ogni connessione fisica (per la verifica delle inattive)
+_idle_since: Dict[int, float] = {}
+
+def _capture_stack():
+    if not POOL_TRACE_STACKS:
+        return None
+    # Esclude i frame interni di db.py
+    return traceback.format_stack(limit=16)[:-2]
+
+def _format_stack(stack) -> str:
+    if stack is None:
+        return "(stack non registrato: impostare TALON_PG_TRACE_STACKS=1)"
+    return ''.join(stack)
+
+# ===========================================
+# GESTIONE POOL
+# ===========================================
+
+def configure_pool(config: Optional[Dict] = None, minconn: int = None, maxconn: int = None):
+    """
+    Imposta i parametri del pool condiviso (creato alla prima richiesta).
+    `config` accetta le stesse chiavi di app.config['POSTGRES'].
+    """
+    global _pool_params
+
+    cfg = config or {}
+    minconn = POOL_MIN_CONN if minconn is None else minconn
+    maxconn = POOL_MAX_CONN if maxconn is None else maxconn
+    params = {
+        "host": cfg.get("host", PG_HOST),
+        "port": cfg.get("port", PG_PORT),
+        "dbname": cfg.get("dbname", cfg.get("database", PG_DB)),
+        "user": cfg.get("user", PG_USER),
+        "password": cfg.get("password", PG_PASS),
+        "minconn": min(minconn, maxconn),
+        "maxconn": maxconn,
+    }
+    with _pool_lock:
+        _close_pool_locked()
+        _pool_params = params
+
+def _get_pool() -> pool.ThreadedConnectionPool:
+    """Restituisce il pool, creandolo alla prima richiesta"""
+    global _pool, _slots
+    conn_pool = _pool
+    if conn_pool is not None:
+        return conn_pool
+    with _pool_lock:
+        if _pool is None:
+            if not _pool_params:
+                _pool_params.update(
+                    host=PG_HOST, port=PG_PORT, dbname=PG_DB, user=PG_USER, password=PG_PASS,
+                    minconn=min(POOL_MIN_CONN, POOL_MAX_CONN), maxconn=POOL_MAX_CONN
+                )
+            params = dict(_pool_params)
+            minconn = params.pop('minconn')
+            maxconn = params.pop('maxconn')
+            _slots = threading.BoundedSemaphore(maxconn)
+            _pool = pool.ThreadedConnectionPool(minconn, maxconn, **params)
+        return _pool
+
+def _close_pool_locked():
+    global _pool
+    if _pool is not None and not _pool.closed:
+        _pool.closeall()
+    _pool = None
+
+def close_pool():
+    """Chiude tutte le connessioni del pool (shutdown)"""
+    with _pool_lock:
+        _close_pool_locked()
+
+def _reset_connection(raw_conn) -> bool:
+    """
+    Chiude la transazione pendente e ripristina le impostazioni di default.
+    Restituisce False se la connessione non e' piu' utilizzabile.
+    """
+    if raw_conn.closed:
+        return False
+    try:
+        status = raw_conn.info.transaction_status
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            raw_conn.rollback()
+        raw_conn.autocommit = False
+        raw_conn.cursor_factory = None
+        return True
+    except psycopg2.Error:
+        return False
+
+def _is_alive(raw_conn) -> bool:
+    """Verifica una connessione rimasta a lungo inattiva nel pool"""
+    if raw_conn.closed:
+        return False
+    last_used = _idle_since.get(id(raw_conn))
+    if last_used is None or time.monotonic() - last_used < POOL_VALIDATE_AFTER:
+        return True
+    pool_stats.increment('validated')
+    try:
+        with raw_conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        raw_conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _checkout(stack=None):
+    """Prende una connessione fisica dal pool (attende fino a POOL_TIMEOUT)"""
+    conn_pool = _get_pool()
+    slots = _slots
+    started = time.monotonic()
+    if not slots.acquire(timeout=POOL_TIMEOUT):
+        pool_stats.increment('timeouts')
+        pool_stats.record_wait((time.monotonic() - started) * 1000)
+        logger.error("Pool DB esaurito: nessuna connessione entro %ss", POOL_TIMEOUT)
+        raise pool.PoolError(f"Nessuna connessione disponibile entro {POOL_TIMEOUT}s")
+    try:
+        while True:
+            raw_conn = conn_pool.getconn()
+            if _is_alive(raw_conn):
+                break
+            # Connessione caduta: scartata e sostituita
+            pool_stats.increment('discarded')
+            _idle_since.pop(id(raw_conn), None)
+            conn_pool.putconn(raw_conn, close=True)
+    except Exception:
+        pool_stats.increment('errors')
+        slots.release()
+        raise
+    pool_stats.record_wait((time.monotonic() - started) * 1000)
+    pool_stats.record_checkout(raw_conn, stack if stack is not None else _capture_stack())
+    return raw_conn, conn_pool, slots
+
+def _release(raw_conn, conn_pool, slots):
+    """Riporta una connessione nel pool in stato pulito"""
+    try:
+        pool_stats.record_return(raw_conn)
+        broken = not _reset_connection(raw_conn)
+        if broken:
+            pool_stats.increment('discarded')
+            _idle_since.pop(id(raw_conn), None)
+        else:
+            _idle_since[id(raw_conn)] = time.monotonic()
+        if not conn_pool.closed:
+            conn_pool.putconn(raw_conn, close=broken)
+        elif not raw_conn.closed:
+            raw_conn.close()
+    finally:
+        slots.release()
+
+# ===========================================
+# CONNESSIONE DEL POOL
+# ===========================================
+
+class PooledConnection:
+    """
+    Connessione presa dal pool.
+    Si comporta come una connessione psycopg2: `with conn:` gestisce la
+    transazione, `close()` restituisce la connessione al pool invece di chiuderla.
+    """
+
+    def __init__(self, raw_conn, on_close, stack=None):
+        object.__setattr__(self, '_conn', raw_conn)
+        object.__setattr__(self, '_on_close', on_close)
+        object.__setattr__(self, '_stack', stack)
+
+    def __getattr__(self, name):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise psycopg2.InterfaceError('connection already closed')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise psycopg2.InterfaceError('connection already closed')
+        setattr(conn, name, value)
+
+    @property
+    def closed(self):
+        conn = object.__getattribute__(self, '_conn')
+        return 1 if conn is None else conn.closed
+
+    def __enter__(self):
+        self.__getattr__('__enter__')()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.__getattr__('__exit__')(exc_type, exc_value, traceback)
+
+    def close(self):
+        """Restituisce la connessione al pool (idempotente)"""
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+        self._on_close(conn)
+
+    def __del__(self):
+        # Rete di sicurezza: connessione mai chiusa esplicitamente
+        try:
+            if object.__getattribute__(self, '_conn') is None:
+                return
+            pool_stats.increment('leaked')
+            logger.warning(
+                "Connessione DB non chiusa, recuperata dal garbage collector\n%s",
+                _format_stack(self._stack)
+            )
+            self.close()
+        except Exception:
+            pass
+
+# ===========================================
+# CONNESSIONE PER RICHIESTA (flask.g)
+# ===========================================
+
+class _RequestConnection:
+    """
+    Connessione fisica riservata alla richiesta HTTP corrente.
+    Viene prestata in modo esclusivo: finche' un chiamante la usa, gli altri
+    ricevono una connessione separata dal pool (le transazioni non si mescolano).
+    """
+
+    def __init__(self, raw_conn, conn_pool, slots):
+        self.raw_conn = raw_conn
+        self.conn_pool = conn_pool
+        self.slots = slots
+        self.in_use = False
+        self.detached = False
+        self.leases = 0
+
+    @property
+    def usable(self):
+        return self.raw_conn is not None and not self.detached
+
+    def lease(self):
+        self.in_use = True
+        self.leases += 1
+        return self.raw_conn
+
+    def end_lease(self, raw_conn):
+        if raw_conn is not self.raw_conn:
+            return
+        self.in_use = False
+        if self.detached or not _reset_connection(raw_conn):
+            self._give_back()
+
+    def release(self):
+        """Fine richiesta: se la connessione e' ancora prestata, verra' resa alla chiusura"""
+        self.detached = True
+        if not self.in_use:
+            self._give_back()
+
+    def _give_back(self):
+        raw_conn, self.raw_conn = self.raw_conn, None
+        if raw_conn is not None:
+            _release(raw_conn, self.conn_pool, self.slots)
+
+_REQUEST_CONN_KEY = '_talon_db_conn'
+
+def _lease_request_connection(stack=None):
+    """Connessione della richiesta corrente, o None se gia' in uso"""
+    shared = g.get(_REQUEST_CONN_KEY)
+    if shared is None or not shared.usable:
+        shared = _RequestConnection(*_checkout(stack))
+        setattr(g, _REQUEST_CONN_KEY, shared)
+    elif shared.in_use:
+        pool_stats.increment('request_fallbacks')
+        return None
+    pool_stats.increment('request_leases')
+    return PooledConnection(shared.lease(), shared.end_lease, stack)
+
+def release_request_connection(exc=None):
+    """Restituisce al pool la connessione della richiesta (teardown_request)"""
+    if not has_request_context():
+        return
+    shared = g.pop(_REQUEST_CONN_KEY, None)
+    if shared is not None:
+        shared.release()
+
+def setup_request_connection(app):
+    """Registra il rilascio automatico della connessione a fine richiesta"""
+    app.teardown_request(release_request_connection)
+
+# ===========================================
+# API PUBBLICA
+# ===========================================
+
+def get_connection(cursor_factory=None, autocommit: bool = False) -> PooledConnection:
+    """
+    Prende una connessione dal pool condiviso.
+    Durante una richiesta HTTP riusa la connessione della richiesta (flask.g);
+    fuori richiesta, o se e' gia' in uso, ne prende una dal pool.
+    Attende fino a POOL_TIMEOUT secondi se tutte le connessioni sono in uso.
+    """
+    stack = _capture_stack()
+    conn = _lease_request_connection(stack) if has_request_context() else None
+    if conn is None:
+        raw_conn, conn_pool, slots = _checkout(stack)
+        conn = PooledConnection(raw_conn, lambda c: _release(c, conn_pool, slots), stack)
+
+    try:
+        if cursor_factory is not None:
+            conn.cursor_factory = cursor_factory
+        if autocommit:
+            conn.autocommit = True
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+@contextmanager
+def db_connection(cursor_factory=None, autocommit: bool = False):
+    """
+    Context manager per l'uso standard:
+        with db_connection() as conn:
+            ...
+    Commit a fine blocco, rollback in caso di eccezione, connessione sempre restituita al pool.
+    """
+    conn = get_connection(cursor_factory=cursor_factory, autocommit=autocommit)
+    try:
+        yield conn
+        if not conn.closed and not conn.autocommit:
+            conn.commit()
+    except Exception:
+        if not conn.closed and not conn.autocommit:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+        raise
+    finally:
+        conn.close()
+
+def open_dedicated_connection(autocommit: bool = True):
+    """
+    Connessione fisica fuori dal pool, per thread di lunga durata (es. LISTEN).
+    Usa gli stessi parametri del pool; va chiusa dal chiamante.
+    """
+    params = dict(_pool_params) or dict(
+        host=PG_HOST, port=PG_PORT, dbname=PG_DB, user=PG_USER, password=PG_PASS
+    )
+    params.pop('minconn', None)
+    params.pop('maxconn', None)
+    conn = psycopg2.connect(**params)
+    conn.autocommit = autocommit
+    return conn
+
+def get_pool_info() -> Dict:
+    """Informazioni sintetiche sul pool (per diagnostica)"""
+    conn_pool = _pool
+    return {
+        'initialized': conn_pool is not None and not conn_pool.closed,
+        'minconn': _pool_params.get('minconn', POOL_MIN_CONN),
+        'maxconn': _pool_params.get('maxconn', POOL_MAX_CONN),
+        'idle': len(conn_pool._pool) if conn_pool is not None and not conn_pool.closed else 0,
+        'server_threads': SERVER_THREADS,
+        'timeout': POOL_TIMEOUT,
+        'leak_threshold_seconds': POOL_LEAK_SECONDS,
+    }
+
+def get_pool_telemetry(min_held_seconds: float = None) -> Dict:
+    """Telemetria completa: configurazione, contatori e connessioni trattenute"""
+    threshold = POOL_LEAK_SECONDS if min_held_seconds is None else min_held_seconds
+    return {
+        'pool': get_pool_info(),
+        'stats': pool_stats.snapshot(),
+        'held_connections': pool_stats.held_connections(threshold),
+    }
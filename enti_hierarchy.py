@@ -0,0 +1,329 @@
+# enti_hierarchy.py - Albero in memoria della gerarchia enti_militari (EntiTree, coni d'ombra)
+"""
+Albero di `enti_militari` (EntiTree), condiviso da tutto il processo.
+
+L'albero viene costruito una sola volta (una query su id, parent_id, nome, codice)
+e ricostruito in modo pigro dopo `invalidate()`, da chiamare dopo ogni scrittura
+su enti_militari (lo fa anche il listener di cache_invalidation.py). Oltre a
+parent -> figli tiene nome -> id, profondità e intervalli di Euler tour, così
+"X è sotto Y", "antenato di livello k di X" e "figlio di Y che contiene X"
+sono O(1) e le route possono raggruppare per qualsiasi livello senza
+self-join su enti_militari. I coni d'ombra sono memorizzati per ente radice:
+tutti gli utenti dello stesso ente condividono lo stesso oggetto.
+
+I risultati sono `EntitySet`: liste immutabili (quindi ancora utilizzabili come
+parametro ARRAY di psycopg2, in `_build_in_clause` e in `jsonify`) con verifica
+di appartenenza O(1) tramite un frozenset interno.
+"""
+import hashlib
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+from db import db_connection
+
+# ===========================================
+# INSIEME DI ENTI (lista immutabile, membership O(1))
+# ===========================================
+
+def entities_fingerprint(ids: Iterable[int]) -> str:
+    return hashlib.sha1(','.join(map(str, sorted(ids))).encode()).hexdigest()
+
+def _immutable(*_args, **_kwargs):
+    raise TypeError("EntitySet è immutabile: è condiviso tra utenti")
+
+class EntitySet(list):
+    """
+    Lista di ID enti in sola lettura con `in` O(1).
+    Resta una `list` per compatibilità con psycopg2 (ARRAY) e con il JSON.
+    """
+    __slots__ = ('_members', '_fingerprint')
+
+    def __init__(self, ids: Iterable[int] = ()):
+        super().__init__(ids)
+        self._members = frozenset(self)
+        self._fingerprint = None
+
+    @property
+    def members(self) -> frozenset:
+        return self._members
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash degli ID (indipendente dall'ordine), calcolato una volta per insieme."""
+        fingerprint = self._fingerprint
+        if fingerprint is None:
+            fingerprint = entities_fingerprint(self._members)
+            self._fingerprint = fingerprint
+        return fingerprint
+
+    def __contains__(self, item) -> bool:
+        return item in self._members
+
+    append = extend = insert = remove = pop = clear = sort = reverse = _immutable
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+
+    # Immutabile: copie condivise; pickle (sessione, cache) ricostruisce dal costruttore
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (EntitySet, (list(self),))
+
+EMPTY = EntitySet()
+
+# ===========================================
+# ALBERO DEGLI ENTI (Euler tour)
+# ===========================================
+
+class EntiTree:
+    """
+    Snapshot immutabile della gerarchia in array compatti.
+
+    I nodi sono numerati in pre-ordine (DFS, figli per nome): la posizione di
+    un ente è il suo `tin`, `tout` è l'ultima posizione del suo sottoalbero.
+    Ne segue che:
+      - "X è sotto Y" è `tin[Y] <= tin[X] <= tout[Y]`, O(1);
+      - il sottoalbero di Y è la fetta contigua `ids[tin[Y]:tout[Y] + 1]`;
+      - l'antenato di livello k di X è letto dal percorso radice -> X,
+        salvato per ogni nodo in un unico array piatto, O(1).
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, Optional[int], Optional[str], Optional[str]]],
+                 version: int = 0):
+        children: Dict[int, list] = {}
+        parents: Dict[int, Optional[int]] = {}
+        names: Dict[int, str] = {}
+        codes: Dict[int, str] = {}
+        for ente_id, parent_id, nome, codice in rows:
+            parents[ente_id] = parent_id
+            names[ente_id] = nome or ''
+            codes[ente_id] = codice or ''
+            if parent_id is not None:
+                children.setdefault(parent_id, []).append(ente_id)
+
+        def by_name(ente_id):
+            return (names.get(ente_id, ''), ente_id)
+
+        self.version = version
+        self.parents = parents
+        self.names = names
+        self.codes = codes
+        self.children: Dict[int, Tuple[int, ...]] = {
+            k: tuple(sorted(v, key=by_name)) for k, v in children.items()
+        }
+        self.all_ids = EntitySet(sorted(parents))
+
+        # Nome -> id (nomi duplicati: vince l'id più basso, come una SELECT ... LIMIT 1 su PK)
+        self.name_to_id: Dict[str, int] = {}
+        for ente_id in self.all_ids:
+            self.name_to_id.setdefault(names[ente_id], ente_id)
+
+        self._pos: Dict[int, int] = {}
+        self._ids = array('i')
+        self._parent = array('i')
+        self._depth = array('i')
+        self._tout = array('i')
+        self._path_start = array('i')
+        self._paths = array('i')
+
+        # Radici: parent_id nullo o non presente in tabella; poi eventuali
+        # nodi rimasti fuori (cicli nei dati) come radici aggiuntive
+        roots = sorted((i for i, p in parents.items() if p is None or p not in parents), key=by_name)
+        for root in roots:
+            self._walk(root)
+        for ente_id in sorted(parents, key=by_name):
+            if ente_id not in self._pos:
+                self._walk(ente_id)
+
+        self._descendants: Dict[int, EntitySet] = {}
+        self._member_positions: Dict[frozenset, array] = {}
+        self._lock = threading.Lock()
+
+    def _walk(self, root: int):
+        """DFS iterativa: assegna tin/tout, profondità e percorso dalla radice."""
+        path = []
+        stack = [(root, -1)]
+        while stack:
+            ente_id, parent_pos = stack.pop()
+            if ente_id is None:
+                # Uscita dal nodo `parent_pos`: chiude l'intervallo
+                self._tout[parent_pos] = len(self._ids) - 1
+                path.pop()
+                continue
+            if ente_id in self._pos:
+                continue
+            pos = len(self._ids)
+            self._pos[ente_id] = pos
+            self._ids.append(ente_id)
+            self._parent.append(parent_pos)
+            self._depth.append(len(path))
+            self._tout.append(pos)
+            path.append(pos)
+            self._path_start.append(len(self._paths))
+            self._paths.extend(path)
+            stack.append((None, pos))
+            for child in reversed(self.children.get(ente_id, ())):
+                stack.append((child, pos))
+
+    def __contains__(self, ente_id) -> bool:
+        return ente_id in self._pos
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def name(self, ente_id: int) -> Optional[str]:
+        return self.names.get(ente_id)
+
+    def id_for_name(self, nome: str) -> Optional[int]:
+        return self.name_to_id.get(nome)
+
+    def depth(self, ente_id: int) -> Optional[int]:
+        """Livello assoluto (radice = 0), None se l'ente non esiste."""
+        pos = self._pos.get(ente_id)
+        return None if pos is None else self._depth[pos]
+
+    def is_under(self, ente_id: int, ancestor_id: int) -> bool:
+        """True se `ente_id` appartiene al sottoalbero di `ancestor_id` (compreso)."""
+        pos = self._pos.get(ente_id)
+        anc = self._pos.get(ancestor_id)
+        if pos is None or anc is None:
+            return False
+        return anc <= pos <= self._tout[anc]
+
+    def ancestor_at(self, ente_id: int, level: int) -> Optional[int]:
+        """Antenato di livello assoluto `level` (l'ente stesso se è a quel livello)."""
+        pos = self._pos.get(ente_id)
+        if pos is None or level < 0 or level > self._depth[pos]:
+            return None
+        return self._ids[self._paths[self._path_start[pos] + level]]
+
+    def bucket(self, ente_id: int, root_id: int, depth: int = 1) -> Optional[int]:
+        """
+        Discendente di `root_id` a `depth` livelli sotto di esso che contiene
+        `ente_id` (con depth=1 il figlio diretto). Gli enti a meno di `depth`
+        livelli dalla radice, radice compresa, sono il proprio contenitore.
+        None se `ente_id` è fuori dal sottoalbero.
+        """
+        if ente_id == root_id:
+            return root_id if root_id in self._pos else None
+        if not self.is_under(ente_id, root_id):
+            return None
+        level = self._depth[self._pos[root_id]] + depth
+        if self._depth[self._pos[ente_id]] <= level:
+            return ente_id
+        return self.ancestor_at(ente_id, level)
+
+    def subtree_size(self, ente_id: int) -> int:
+        """Numero di enti del sottoalbero (ente compreso)."""
+        pos = self._pos.get(ente_id)
+        return 0 if pos is None else self._tout[pos] - pos + 1
+
+    def count_in_subtree(self, ente_id: int, members: EntitySet) -> int:
+        """
+        Enti di `members` nel sottoalbero di `ente_id` (ente compreso):
+        due ricerche binarie sulle posizioni ordinate di `members`,
+        calcolate una volta per insieme (i coni d'ombra sono condivisi).
+        """
+        pos = self._pos.get(ente_id)
+        if pos is None:
+            return 0
+        key = members.members if isinstance(members, EntitySet) else frozenset(members)
+        positions = self._member_positions.get(key)
+        if positions is None:
+            positions = array('i', sorted(self._pos[i] for i in key if i in self._pos))
+            with self._lock:
+                positions = self._member_positions.setdefault(key, positions)
+        return bisect_right(positions, self._tout[pos]) - bisect_left(positions, pos)
+
+    def descendants(self, root_id: int) -> EntitySet:
+        """Cono d'ombra di `root_id` (ente incluso), calcolato una volta per radice."""
+        cached = self._descendants.get(root_id)
+        if cached is not None:
+            return cached
+
+        pos = self._pos.get(root_id)
+        if pos is None:
+            # Ente sconosciuto all'indice: come il vecchio fallback, solo se stesso
+            return EntitySet([root_id])
+
+        result = EntitySet(self._ids[pos:self._tout[pos] + 1])
+        with self._lock:
+            return self._descendants.setdefault(root_id, result)
+
+    def cache_size(self) -> int:
+        return len(self._descendants)
+
+# ===========================================
+# INDICE DI PROCESSO
+# ===========================================
+
+_index: Optional[EntiTree] = None
+_index_lock = threading.Lock()
+_version = 0
+
+def _load_rows(conn):
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute('SELECT id, parent_id, nome, codice FROM enti_militari')
+        return [(r['id'], r['parent_id'], r['nome'], r['codice']) for r in cur.fetchall()]
+
+def get_index(conn=None) -> EntiTree:
+    """
+    Restituisce l'indice corrente, costruendolo se necessario.
+    `conn` (opzionale) permette di riusare una connessione già aperta.
+    """
+    index = _index
+    if index is not None:
+        return index
+
+    with _index_lock:
+        if _index is not None:
+            return _index
+        version = _version
+
+    # La query gira fuori dal lock: un'invalidazione concorrente fa scartare il risultato
+    if conn is not None:
+        rows = _load_rows(conn)
+    else:
+        with db_connection() as own_conn:
+            rows = _load_rows(own_conn)
+    built = EntiTree(rows, version)
+
+    return _publish(built)
+
+def _publish(built: EntiTree) -> EntiTree:
+    global _index
+    with _index_lock:
+        if built.version != _version:
+            # Invalidato durante la costruzione: usalo per questa chiamata, non salvarlo
+            return built
+        if _index is None:
+            _index = built
+        return _index
+
+def invalidate():
+    """Da chiamare dopo INSERT/UPDATE/DELETE su enti_militari."""
+    global _index, _version
+    with _index_lock:
+        _version += 1
+        _index = None
+
+def get_descendants(root_id: int, conn=None) -> EntitySet:
+    """Scorciatoia: cono d'ombra di un ente dall'indice di processo."""
+    return get_index(conn).descendants(root_id)
+
+def get_index_info() -> Dict:
+    """Stato dell'indice per le statistiche di sistema."""
+    index = _index
+    return {
+        'built': index is not None,
+        'version': _version,
+        'entities': len(index) if index is not None else 0,
+        'cached_roots': index.cache_size() if index is not None else 0,
+    }
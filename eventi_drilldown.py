@@ -0,0 +1,85 @@
+# eventi_drilldown.py - Drill-down gerarchico degli eventi a profondità arbitraria
+"""
+Dato un ente radice (per id), una profondità e i filtri del rollup, restituisce
+i totali di ogni sottoalbero a `depth` livelli sotto la radice, suddivisi per
+tipo_evento e carattere:
+
+  - una sola query: conteggi per ente/tipo/carattere dal rollup giornaliero
+    (eventi_rollup.py) limitati al sottoalbero con la closure table;
+  - l'attribuzione di ogni ente al proprio contenitore avviene sull'albero in
+    memoria (enti_hierarchy.EntiTree.bucket), a qualsiasi profondità.
+
+Gli enti a meno di `depth` livelli dalla radice (radice compresa) compaiono
+con i soli eventi propri (`diretti`); gli altri nodi con il totale del loro
+sottoalbero. Scendere di un livello significa richiamare `aggrega()` con l'id
+di uno dei nodi restituiti: una query per livello, nessuna risoluzione di nomi.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+import enti_hierarchy
+
+# Profondità massima richiedibile (la gerarchia reale ha pochi livelli)
+MAX_DEPTH = 10
+
+def raggruppa(tree, rows: Iterable[Dict], root_id: int, depth: int = 1) -> List[Dict]:
+    """
+    Attribuisce le righe (`ente_id`, `count`, facoltativi `tipo_evento` e
+    `carattere`) ai nodi a `depth` livelli sotto `root_id`.
+    Restituisce i nodi con eventi, ordinati per livello e nome.
+    """
+    base = tree.depth(root_id)
+    nodes: Dict[int, Dict] = {}
+    for row in rows:
+        bucket = tree.bucket(row['ente_id'], root_id, depth)
+        if bucket is None:
+            continue
+        node = nodes.get(bucket)
+        if node is None:
+            livello = tree.depth(bucket) - base
+            node = nodes[bucket] = {
+                'id': bucket,
+                'nome': tree.name(bucket),
+                'parent_id': tree.parents.get(bucket),
+                'livello': livello,
+                'diretti': livello < depth,
+                'figli': bool(tree.children.get(bucket)),
+                'totale': 0,
+                'per_tipo': {},
+                'per_carattere': {},
+            }
+        count = row['count']
+        node['totale'] += count
+        tipo = row.get('tipo_evento')
+        if tipo is not None:
+            node['per_tipo'][tipo] = node['per_tipo'].get(tipo, 0) + count
+        carattere = row.get('carattere')
+        if carattere is not None:
+            node['per_carattere'][carattere] = node['per_carattere'].get(carattere, 0) + count
+    return sorted(nodes.values(), key=lambda n: (n['livello'], n['nome'] or '', n['id']))
+
+def aggrega(conn, root_id: int, where_rollup: str, params: List,
+            depth: int = 1) -> Optional[List[Dict]]:
+    """
+    Totali per sottoalbero a `depth` livelli sotto `root_id` con i filtri
+    `where_rollup` (vedi eventi_rollup.build_filters, alias `r`).
+    None se l'ente non esiste.
+    """
+    tree = enti_hierarchy.get_index(conn)
+    if root_id not in tree:
+        return None
+    depth = max(1, min(int(depth), MAX_DEPTH))
+
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(f"""
+            SELECT r.ente_id, r.tipo_evento, r.carattere, SUM(r.count) as count
+            FROM eventi_daily_rollup r
+            INNER JOIN enti_militari_closure g
+                ON g.descendant_id = r.ente_id
+               AND g.ancestor_id = %s
+            WHERE {where_rollup}
+            GROUP BY r.ente_id, r.tipo_evento, r.carattere
+        """, [root_id] + params)
+        rows = cur.fetchall()
+    return raggruppa(tree, rows, root_id, depth)
@@ -0,0 +1,111 @@
+# eventi_rollup.py - Rollup giornaliero degli eventi per i grafici di /eventi/api
+"""
+La tabella `eventi_daily_rollup(day, ente_id, tipo_evento, carattere, count)`
+contiene il numero di eventi per giorno (data_msg_evento), ente, tipo e
+carattere. È mantenuta dal trigger installato da
+migrations/add_eventi_daily_rollup.sql nella stessa transazione di ogni
+scrittura su eventi; i grafici la leggono al posto della tabella eventi.
+
+Questo modulo fornisce i filtri per periodo/carattere/tipo sulla tabella di
+rollup e il comando di ricostruzione:
+
+    python eventi_rollup.py [--dal AAAA-MM-GG] [--al AAAA-MM-GG]
+"""
+import argparse
+import logging
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = 'eventi_daily_rollup'
+
+# Giorni per i periodi predefiniti dei grafici
+PERIOD_DAYS = {'week': 7, 'month': 30, 'quarter': 90, 'year': 365}
+
+# ===========================================
+# FILTRI
+# ===========================================
+
+def _parse_date(value: str) -> date:
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def resolve_period(period: str, start_date: str = None, end_date: str = None,
+                   default: str = 'year') -> Tuple[date, Optional[date]]:
+    """
+    Intervallo concreto di giorni: (dal, al) con `al` None per "fino ad oggi".
+    `custom` usa start_date/end_date (AAAA-MM-GG, estremi inclusi).
+    """
+    if period == 'custom' and start_date and end_date:
+        return _parse_date(start_date), _parse_date(end_date)
+    days = PERIOD_DAYS.get(period, PERIOD_DAYS.get(default, 365))
+    return date.today() - timedelta(days=days), None
+
+def build_filters(period: str, start_date: str = None, end_date: str = None,
+                  carattere: str = None, tipo_evento: str = None,
+                  default_period: str = 'year', alias: str = 'r') -> Tuple[str, List]:
+    """Condizione WHERE parametrizzata sulla tabella di rollup (alias `alias`)."""
+    dal, al = resolve_period(period, start_date, end_date, default_period)
+    conditions = [f'{alias}.day >= %s']
+    params: List = [dal]
+    if al is not None:
+        conditions.append(f'{alias}.day <= %s')
+        params.append(al)
+    if carattere:
+        conditions.append(f'{alias}.carattere = %s')
+        params.append(carattere)
+    if tipo_evento:
+        conditions.append(f'{alias}.tipo_evento = %s')
+        params.append(tipo_evento)
+    return ' AND '.join(conditions), params
+
+# ===========================================
+# RICOSTRUZIONE
+# ===========================================
+
+def backfill(dal: date = None, al: date = None) -> int:
+    """
+    Ricostruisce il rollup (tutto o solo l'intervallo di giorni indicato)
+    in un'unica transazione. Le scritture su eventi restano in attesa fino
+    al commit (LOCK ... IN SHARE MODE), le letture no.
+    Restituisce il numero di righe di rollup scritte.
+    """
+    conditions = ['data_msg_evento IS NOT NULL', 'ente_id IS NOT NULL']
+    rollup_conditions = ['TRUE']
+    params: List = []
+    if dal is not None:
+        conditions.append('data_msg_evento::date >= %s')
+        rollup_conditions.append('day >= %s')
+        params.append(dal)
+    if al is not None:
+        conditions.append('data_msg_evento::date <= %s')
+        rollup_conditions.append('day <= %s')
+        params.append(al)
+
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('LOCK TABLE eventi IN SHARE MODE')
+            cur.execute(f'DELETE FROM {ROLLUP_TABLE} WHERE {" AND ".join(rollup_conditions)}', params)
+            cur.execute(
+                f'''
+                INSERT INTO {ROLLUP_TABLE} (day, ente_id, tipo_evento, carattere, count)
+                SELECT data_msg_evento::date, ente_id, tipo_evento, carattere, COUNT(*)
+                FROM eventi
+                WHERE {" AND ".join(conditions)}
+                GROUP BY data_msg_evento::date, ente_id, tipo_evento, carattere
+                ''',
+                params
+            )
+            written = cur.rowcount
+    logger.info(f"Rollup eventi ricostruito ({dal or 'inizio'} - {al or 'oggi'}): {written} righe")
+    return written
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ricostruisce eventi_daily_rollup dalla tabella eventi')
+    parser.add_argument('--dal', type=_parse_date, help='primo giorno (AAAA-MM-GG)')
+    parser.add_argument('--al', type=_parse_date, help='ultimo giorno (AAAA-MM-GG)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print(f"Righe di rollup scritte: {backfill(args.dal, args.al)}")
@@ -0,0 +1,257 @@
+# log_pipeline.py - Logging asincrono con id di correlazione e campionamento del DEBUG
+"""
+Tutti i logger scrivono su un unico QueueHandler collegato al root logger:
+il thread della richiesta accoda il record e ritorna subito, mentre la
+formattazione e la scrittura (stderr ed eventuale file) avvengono nel
+thread del QueueListener.
+
+- Formattazione differita: usare lo stile `logger.debug("... %s", valore)`.
+  Il messaggio viene composto solo se il record supera i livelli (al
+  momento dell'accodamento, così gli argomenti mutabili non cambiano
+  prima della scrittura); i log di diagnostica disattivati costano un
+  confronto di livello. Data, formato e scrittura restano al listener.
+- Livelli per modulo: TALON_LOG_LEVEL (default INFO) per il root e
+  TALON_LOG_LEVELS per i singoli logger,
+  es. "routes.eventi=DEBUG,db=WARNING".
+- Id di correlazione: ogni richiesta riceve un id (header X-Request-ID del
+  client se presente e valido, altrimenti generato), riportato in ogni
+  record emesso durante la richiesta e nell'header X-Request-ID della
+  risposta.
+- Campionamento: dei record DEBUG viene tenuto uno ogni
+  TALON_LOG_DEBUG_SAMPLE per punto di chiamata (il primo sempre); 1 li
+  tiene tutti.
+
+Se la coda è piena il record viene scartato e conteggiato: il logging non
+rallenta mai le richieste. Allo shutdown (atexit) la coda viene svuotata.
+"""
+import os
+import re
+import copy
+import uuid
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional
+
+from flask import g, has_request_context, request
+
+# ===========================================
+# CONFIGURAZIONE
+# ===========================================
+
+LOG_LEVEL = os.environ.get('TALON_LOG_LEVEL', 'INFO').upper()
+
+# Livelli per logger: "nome=LIVELLO,nome=LIVELLO"
+LOG_LEVELS = os.environ.get('TALON_LOG_LEVELS', '')
+
+# Un record DEBUG ogni N per punto di chiamata
+LOG_DEBUG_SAMPLE = max(1, int(os.environ.get('TALON_LOG_DEBUG_SAMPLE', '10')))
+
+# Record massimi in attesa di scrittura
+LOG_QUEUE_SIZE = int(os.environ.get('TALON_LOG_QUEUE_SIZE', '10000'))
+
+# File di log opzionale (rotazione a 10 MB, 10 file)
+LOG_FILE = os.environ.get('TALON_LOG_FILE', '')
+
+# Secondi massimi di attesa per lo svuotamento allo shutdown
+LOG_SHUTDOWN_SECONDS = float(os.environ.get('TALON_LOG_SHUTDOWN_SECONDS', '5'))
+
+LOG_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s [%(request_id)s]: %(message)s'
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Id accettati dal client (altrimenti se ne genera uno nuovo)
+_REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+logger = logging.getLogger(__name__)
+
+_listener: Optional[QueueListener] = None
+_handler: Optional['_AsyncHandler'] = None
+_lock = threading.Lock()
+
+# ===========================================
+# FILTRI
+# ===========================================
+
+def current_request_id() -> str:
+    """Id di correlazione della richiesta corrente ('-' fuori richiesta)."""
+    if has_request_context():
+        return g.get('request_id', '-')
+    return '-'
+
+class RequestIdFilter(logging.Filter):
+    """Aggiunge `request_id` al record nel thread che lo emette."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id()
+        return True
+
+class DebugSamplingFilter(logging.Filter):
+    """Tiene un record DEBUG ogni `rate` per punto di chiamata (file, riga)."""
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = rate
+        self._counters: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno != logging.DEBUG or self.rate <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            seen = self._counters.get(key, 0)
+            self._counters[key] = seen + 1
+            if seen % self.rate == 0:
+                return True
+            self.sampled_out += 1
+            return False
+
+# ===========================================
+# HANDLER
+# ===========================================
+
+# Solo per rendere i traceback nel thread chiamante
+_exc_formatter = logging.Formatter()
+
+class _AsyncHandler(QueueHandler):
+    """QueueHandler con istantanea leggera del record; scarta a coda piena."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Istantanea del record prima del passaggio al listener: messaggio
+        composto ora (gli argomenti mutabili potrebbero cambiare dopo) e
+        traceback reso testo, senza riferimenti a righe, dict o frame.
+        Avviene solo per i record che hanno superato i livelli: il DEBUG
+        disattivato non arriva fin qui.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _Listener(QueueListener):
+    """QueueListener che a coda piena attende spazio per la sentinella di stop."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel, timeout=LOG_SHUTDOWN_SECONDS)
+
+def _parse_levels(spec: str) -> Dict[str, int]:
+    levels = {}
+    for item in spec.split(','):
+        name, sep, level = item.partition('=')
+        if not sep or not name.strip():
+            continue
+        value = logging.getLevelName(level.strip().upper())
+        if isinstance(value, int):
+            levels[name.strip()] = value
+    return levels
+
+def _output_handlers():
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if LOG_FILE:
+        os.makedirs(os.path.dirname(os.path.abspath(LOG_FILE)), exist_ok=True)
+        handlers.append(RotatingFileHandler(LOG_FILE, maxBytes=10240000, backupCount=10,
+                                            encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+# ===========================================
+# API PUBBLICA
+# ===========================================
+
+def configure(app=None):
+    """
+    Installa la pipeline sul root logger (una volta per processo) e, se
+    indicata, registra sull'app gli hook dell'id di correlazione.
+    """
+    global _listener, _handler
+    with _lock:
+        if _listener is None:
+            root = logging.getLogger()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+
+            _handler = _AsyncHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+            _handler.addFilter(DebugSamplingFilter(LOG_DEBUG_SAMPLE))
+            _handler.addFilter(RequestIdFilter())
+            root.addHandler(_handler)
+            root.setLevel(LOG_LEVEL)
+            for name, level in _parse_levels(LOG_LEVELS).items():
+                logging.getLogger(name).setLevel(level)
+
+            _listener = _Listener(_handler.queue, *_output_handlers(),
+                              respect_handler_level=True)
+            _listener.start()
+            atexit.register(shutdown)
+
+    if app is not None:
+        _setup_request_id(app)
+
+def _setup_request_id(app):
+    @app.before_request
+    def _assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex[:12]
+
+    @app.after_request
+    def _expose_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+def shutdown():
+    """
+    Riporta il root logger alla scrittura diretta (i log degli altri hook
+    atexit non finiscono in una coda che nessuno legge), poi svuota la coda
+    e ferma il listener.
+    """
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(_handler)
+        for handler in _listener.handlers:
+            handler.addFilter(RequestIdFilter())
+            root.addHandler(handler)
+        try:
+            _listener.stop()
+        except queue.Full:
+            # Listener bloccato: i record ancora in coda vanno persi
+            logger.warning("Coda di log piena allo shutdown: record in coda non scritti")
+        _listener = None
+
+def stats() -> Dict:
+    """Telemetria della pipeline (per /health/db-pool)."""
+    if _handler is None:
+        return {'configured': False}
+    sampling = next((f for f in _handler.filters if isinstance(f, DebugSamplingFilter)), None)
+    return {
+        'configured': _listener is not None,
+        'level': LOG_LEVEL,
+        'queued': _handler.queue.qsize(),
+        'dropped': _handler.dropped,
+        'debug_sample': LOG_DEBUG_SAMPLE,
+        'sampled_out': sampling.sampled_out if sampling else 0,
+    }
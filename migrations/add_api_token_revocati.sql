@@ -0,0 +1,46 @@
+-- ==============================================
+-- Migrazione Database: Revoca dei token API
+-- Data: 2026-10-17
+-- Descrizione: Tabella dei token API revocati (logout) condivisa tra i processi.
+--              I token sono firmati (api_tokens.py): qui si salvano solo le
+--              revoche, fino alla scadenza naturale del token.
+--              Ogni revoca viene notificata sul canale 'talon_cache_invalidate'.
+-- ==============================================
+
+-- Passo 1: Tabella delle revoche
+CREATE TABLE IF NOT EXISTS api_token_revocati (
+    jti         TEXT PRIMARY KEY,
+    utente_id   INTEGER,
+    scadenza    TIMESTAMPTZ NOT NULL,
+    revocato_il TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Passo 2: Indice per la pulizia periodica dei token scaduti
+CREATE INDEX IF NOT EXISTS idx_api_token_revocati_scadenza
+    ON api_token_revocati (scadenza);
+
+-- Passo 3: Notifica della revoca agli altri processi
+CREATE OR REPLACE FUNCTION talon_notify_token_revocato()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('talon_cache_invalidate', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'jti', NEW.jti,
+        'scadenza', EXTRACT(EPOCH FROM NEW.scadenza)::bigint
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_talon_token_revocato ON api_token_revocati;
+CREATE TRIGGER trg_talon_token_revocato
+    AFTER INSERT ON api_token_revocati
+    FOR EACH ROW EXECUTE FUNCTION talon_notify_token_revocato();
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP TRIGGER IF EXISTS trg_talon_token_revocato ON api_token_revocati;
+-- DROP FUNCTION IF EXISTS talon_notify_token_revocato();
+-- DROP TABLE IF EXISTS api_token_revocati;
+-- ==============================================
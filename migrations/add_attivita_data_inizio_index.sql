@@ -0,0 +1,17 @@
+-- ==============================================
+-- Migrazione Database: Indice attivita per data di inizio
+-- Data: 2026-10-17
+-- Descrizione: I grafici drill-down e la serie temporale delle attività
+--              (/drill-down/api/serie, vedi serie_temporali.py) filtrano
+--              tutte le attività per intervallo su data_inizio; l'indice
+--              esistente (ente_svolgimento_id, data_inizio) serve solo le
+--              ricerche per ente.
+-- ==============================================
+
+CREATE INDEX IF NOT EXISTS idx_attivita_data_inizio
+    ON attivita (data_inizio);
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP INDEX IF EXISTS idx_attivita_data_inizio;
+-- ==============================================
@@ -0,0 +1,83 @@
+-- ==============================================
+-- Migrazione Database: Notifiche di invalidazione cache (LISTEN/NOTIFY)
+-- Data: 2026-10-17
+-- Descrizione: Trigger che inviano pg_notify sul canale 'talon_cache_invalidate'
+--              quando cambiano utenti, ruoli, ruoli_permessi o la gerarchia
+--              enti_militari. Ogni processo dell'applicazione ascolta il canale
+--              (cache_invalidation.py) e rimuove le voci di cache interessate.
+-- ==============================================
+
+-- Passo 1: Funzione trigger comune
+-- Il payload è un JSON con tabella, operazione e chiave interessata.
+-- Notifiche identiche nella stessa transazione vengono accorpate da PostgreSQL.
+CREATE OR REPLACE FUNCTION talon_notify_cache_invalidate()
+RETURNS trigger AS $$
+DECLARE
+    rec RECORD;
+    payload JSON;
+BEGIN
+    IF TG_LEVEL = 'STATEMENT' THEN
+        -- enti_militari: l'indice gerarchico viene ricostruito per intero
+        payload := json_build_object('table', TG_TABLE_NAME, 'op', TG_OP);
+    ELSE
+        IF TG_OP = 'DELETE' THEN
+            rec := OLD;
+        ELSE
+            rec := NEW;
+        END IF;
+
+        IF TG_TABLE_NAME = 'utenti' THEN
+            payload := json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'utente_id', rec.id);
+        ELSIF TG_TABLE_NAME = 'ruoli' THEN
+            payload := json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'ruolo_id', rec.id);
+        ELSE
+            payload := json_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'ruolo_id', rec.ruolo_id);
+        END IF;
+    END IF;
+
+    PERFORM pg_notify('talon_cache_invalidate', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Passo 2: utenti
+-- L'aggiornamento di ultimo_accesso (ad ogni login) non invalida la cache
+DROP TRIGGER IF EXISTS trg_talon_cache_utenti ON utenti;
+DROP TRIGGER IF EXISTS trg_talon_cache_utenti_upd ON utenti;
+CREATE TRIGGER trg_talon_cache_utenti
+    AFTER INSERT OR DELETE ON utenti
+    FOR EACH ROW EXECUTE FUNCTION talon_notify_cache_invalidate();
+CREATE TRIGGER trg_talon_cache_utenti_upd
+    AFTER UPDATE ON utenti
+    FOR EACH ROW
+    WHEN ((to_jsonb(OLD) - 'ultimo_accesso') IS DISTINCT FROM (to_jsonb(NEW) - 'ultimo_accesso'))
+    EXECUTE FUNCTION talon_notify_cache_invalidate();
+
+-- Passo 3: ruoli e ruoli_permessi
+DROP TRIGGER IF EXISTS trg_talon_cache_ruoli ON ruoli;
+CREATE TRIGGER trg_talon_cache_ruoli
+    AFTER INSERT OR UPDATE OR DELETE ON ruoli
+    FOR EACH ROW EXECUTE FUNCTION talon_notify_cache_invalidate();
+
+DROP TRIGGER IF EXISTS trg_talon_cache_ruoli_permessi ON ruoli_permessi;
+CREATE TRIGGER trg_talon_cache_ruoli_permessi
+    AFTER INSERT OR UPDATE OR DELETE ON ruoli_permessi
+    FOR EACH ROW EXECUTE FUNCTION talon_notify_cache_invalidate();
+
+-- Passo 4: enti_militari (una notifica per statement)
+-- La notifica svuota tutte le cache: negli UPDATE solo le colonne che le cache
+-- contengono (gerarchia, nome e codice), non indirizzo, coordinate o note
+DROP TRIGGER IF EXISTS trg_talon_cache_enti_militari ON enti_militari;
+CREATE TRIGGER trg_talon_cache_enti_militari
+    AFTER INSERT OR UPDATE OF id, parent_id, nome, codice OR DELETE OR TRUNCATE ON enti_militari
+    FOR EACH STATEMENT EXECUTE FUNCTION talon_notify_cache_invalidate();
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP TRIGGER IF EXISTS trg_talon_cache_utenti ON utenti;
+-- DROP TRIGGER IF EXISTS trg_talon_cache_utenti_upd ON utenti;
+-- DROP TRIGGER IF EXISTS trg_talon_cache_ruoli ON ruoli;
+-- DROP TRIGGER IF EXISTS trg_talon_cache_ruoli_permessi ON ruoli_permessi;
+-- DROP TRIGGER IF EXISTS trg_talon_cache_enti_militari ON enti_militari;
+-- DROP FUNCTION IF EXISTS talon_notify_cache_invalidate();
+-- ==============================================
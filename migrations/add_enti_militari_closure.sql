@@ -0,0 +1,145 @@
+-- ==============================================
+-- Migrazione Database: Closure table della gerarchia enti_militari
+-- Data: 2026-10-17
+-- Descrizione: Tabella enti_militari_closure(ancestor_id, descendant_id, depth)
+--              con una riga per ogni coppia antenato -> discendente (compresa
+--              la coppia ente -> se stesso con depth 0). Le query che
+--              risalivano o discendevano la gerarchia con WITH RECURSIVE
+--              diventano join indicizzate su questa tabella.
+--              La tabella è mantenuta dai trigger su enti_militari:
+--                - INSERT: nuove coppie dagli antenati del padre
+--                - UPDATE di parent_id (aggiorna_militare): spostamento
+--                  del sottoalbero sotto il nuovo padre
+--                - DELETE: rimozione delle coppie dell'ente
+-- ==============================================
+
+-- Passo 1: Tabella
+CREATE TABLE IF NOT EXISTS enti_militari_closure (
+    ancestor_id   INTEGER NOT NULL,
+    descendant_id INTEGER NOT NULL,
+    depth         INTEGER NOT NULL,
+    PRIMARY KEY (ancestor_id, descendant_id)
+);
+
+-- Passo 2: Indice per la risalita (antenati di un ente, per distanza)
+CREATE INDEX IF NOT EXISTS idx_enti_militari_closure_descendant
+    ON enti_militari_closure (descendant_id, depth);
+
+-- Passo 3: Popolamento iniziale
+TRUNCATE enti_militari_closure;
+
+INSERT INTO enti_militari_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE coppie AS (
+    SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth
+    FROM enti_militari
+    UNION ALL
+    SELECT c.ancestor_id, e.id, c.depth + 1
+    FROM coppie c
+    JOIN enti_militari e ON e.parent_id = c.descendant_id
+)
+SELECT ancestor_id, descendant_id, depth FROM coppie;
+
+-- Passo 4: Inserimento di un ente
+CREATE OR REPLACE FUNCTION talon_enti_closure_insert()
+RETURNS trigger AS $$
+BEGIN
+    INSERT INTO enti_militari_closure (ancestor_id, descendant_id, depth)
+    SELECT ancestor_id, NEW.id, depth + 1
+    FROM enti_militari_closure
+    WHERE descendant_id = NEW.parent_id
+    UNION ALL
+    SELECT NEW.id, NEW.id, 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_enti_closure_insert ON enti_militari;
+CREATE TRIGGER trg_enti_closure_insert
+    AFTER INSERT ON enti_militari
+    FOR EACH ROW EXECUTE FUNCTION talon_enti_closure_insert();
+
+-- Passo 5: Cambio del padre (blocca i cicli, poi sposta il sottoalbero)
+CREATE OR REPLACE FUNCTION talon_enti_closure_check_cycle()
+RETURNS trigger AS $$
+BEGIN
+    IF NEW.parent_id IS NOT NULL AND EXISTS (
+        SELECT 1 FROM enti_militari_closure
+        WHERE ancestor_id = NEW.id AND descendant_id = NEW.parent_id
+    ) THEN
+        RAISE EXCEPTION 'Ente % non può essere spostato sotto un proprio discendente (%)',
+            NEW.id, NEW.parent_id
+            USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION talon_enti_closure_move()
+RETURNS trigger AS $$
+BEGIN
+    -- Scollega il sottoalbero dai vecchi antenati
+    DELETE FROM enti_militari_closure c
+    USING enti_militari_closure sotto, enti_militari_closure sopra
+    WHERE sotto.ancestor_id = NEW.id
+      AND sopra.descendant_id = NEW.id
+      AND sopra.ancestor_id <> NEW.id
+      AND c.ancestor_id = sopra.ancestor_id
+      AND c.descendant_id = sotto.descendant_id;
+
+    -- Collega il sottoalbero agli antenati del nuovo padre
+    INSERT INTO enti_militari_closure (ancestor_id, descendant_id, depth)
+    SELECT sopra.ancestor_id, sotto.descendant_id, sopra.depth + sotto.depth + 1
+    FROM enti_militari_closure sopra
+    CROSS JOIN enti_militari_closure sotto
+    WHERE sopra.descendant_id = NEW.parent_id
+      AND sotto.ancestor_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_enti_closure_check_cycle ON enti_militari;
+CREATE TRIGGER trg_enti_closure_check_cycle
+    BEFORE UPDATE OF parent_id ON enti_militari
+    FOR EACH ROW
+    WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+    EXECUTE FUNCTION talon_enti_closure_check_cycle();
+
+DROP TRIGGER IF EXISTS trg_enti_closure_move ON enti_militari;
+CREATE TRIGGER trg_enti_closure_move
+    AFTER UPDATE OF parent_id ON enti_militari
+    FOR EACH ROW
+    WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+    EXECUTE FUNCTION talon_enti_closure_move();
+
+-- Passo 6: Eliminazione di un ente (i figli sono già bloccati dalla FK parent_id)
+CREATE OR REPLACE FUNCTION talon_enti_closure_delete()
+RETURNS trigger AS $$
+BEGIN
+    DELETE FROM enti_militari_closure
+    WHERE descendant_id = OLD.id OR ancestor_id = OLD.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_enti_closure_delete ON enti_militari;
+CREATE TRIGGER trg_enti_closure_delete
+    AFTER DELETE ON enti_militari
+    FOR EACH ROW EXECUTE FUNCTION talon_enti_closure_delete();
+
+-- Passo 7: Verifica (deve restituire 0 righe)
+-- SELECT e.id FROM enti_militari e
+-- LEFT JOIN enti_militari_closure c ON c.ancestor_id = e.id AND c.descendant_id = e.id
+-- WHERE c.ancestor_id IS NULL;
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP TRIGGER IF EXISTS trg_enti_closure_delete ON enti_militari;
+-- DROP TRIGGER IF EXISTS trg_enti_closure_move ON enti_militari;
+-- DROP TRIGGER IF EXISTS trg_enti_closure_check_cycle ON enti_militari;
+-- DROP TRIGGER IF EXISTS trg_enti_closure_insert ON enti_militari;
+-- DROP FUNCTION IF EXISTS talon_enti_closure_delete();
+-- DROP FUNCTION IF EXISTS talon_enti_closure_move();
+-- DROP FUNCTION IF EXISTS talon_enti_closure_check_cycle();
+-- DROP FUNCTION IF EXISTS talon_enti_closure_insert();
+-- DROP TABLE IF EXISTS enti_militari_closure;
+-- ==============================================
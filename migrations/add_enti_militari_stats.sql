@@ -0,0 +1,187 @@
+-- ==============================================
+-- Migrazione Database: Statistiche per ente militare
+-- Data: 2026-10-17
+-- Descrizione: Tabella enti_militari_stats con, per ogni ente:
+--                - discendenti: enti del sottoalbero (ente escluso)
+--                - utenti: utenti assegnati all'ente
+--                - attivita: attività svolte dall'ente
+--                - ultima_attivita: data_inizio più recente
+--              mantenuta in modo incrementale dai trigger su enti_militari,
+--              utenti e attivita. La pagina di dettaglio dell'ente la legge
+--              con una join sulla chiave primaria invece di contare ogni volta.
+-- Richiede: add_enti_militari_closure.sql (antenati di un ente)
+-- ==============================================
+
+-- Passo 1: Tabella
+CREATE TABLE IF NOT EXISTS enti_militari_stats (
+    ente_id         INTEGER PRIMARY KEY REFERENCES enti_militari(id) ON DELETE CASCADE,
+    discendenti     INTEGER NOT NULL DEFAULT 0,
+    utenti          INTEGER NOT NULL DEFAULT 0,
+    attivita        INTEGER NOT NULL DEFAULT 0,
+    ultima_attivita DATE
+);
+
+-- Passo 2: Indice per ultima attività e ultime attività dell'ente
+CREATE INDEX IF NOT EXISTS idx_attivita_ente_svolgimento_data
+    ON attivita (ente_svolgimento_id, data_inizio DESC);
+
+-- Passo 3: Popolamento iniziale
+TRUNCATE enti_militari_stats;
+
+INSERT INTO enti_militari_stats (ente_id, discendenti, utenti, attivita, ultima_attivita)
+SELECT em.id,
+       COALESCE(d.n, 0),
+       COALESCE(u.n, 0),
+       COALESCE(a.n, 0),
+       a.ultima
+FROM enti_militari em
+LEFT JOIN (
+    SELECT ancestor_id, COUNT(*) - 1 AS n
+    FROM enti_militari_closure
+    GROUP BY ancestor_id
+) d ON d.ancestor_id = em.id
+LEFT JOIN (
+    SELECT ente_militare_id, COUNT(*) AS n
+    FROM utenti
+    GROUP BY ente_militare_id
+) u ON u.ente_militare_id = em.id
+LEFT JOIN (
+    SELECT ente_svolgimento_id, COUNT(*) AS n, MAX(data_inizio) AS ultima
+    FROM attivita
+    GROUP BY ente_svolgimento_id
+) a ON a.ente_svolgimento_id = em.id;
+
+-- Passo 4: Enti (nuovo ente, eliminazione, cambio del padre)
+-- Gli antenati del padre non cambiano in nessuno dei tre casi, quindi
+-- l'ordine rispetto ai trigger della closure table è indifferente.
+CREATE OR REPLACE FUNCTION talon_enti_stats_enti()
+RETURNS trigger AS $$
+DECLARE
+    dimensione INTEGER;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO enti_militari_stats (ente_id) VALUES (NEW.id)
+        ON CONFLICT (ente_id) DO NOTHING;
+        UPDATE enti_militari_stats SET discendenti = discendenti + 1
+        WHERE ente_id IN (SELECT ancestor_id FROM enti_militari_closure
+                          WHERE descendant_id = NEW.parent_id);
+    ELSIF TG_OP = 'DELETE' THEN
+        -- Solo foglie: i figli sono bloccati dalla FK parent_id
+        UPDATE enti_militari_stats SET discendenti = discendenti - 1
+        WHERE ente_id IN (SELECT ancestor_id FROM enti_militari_closure
+                          WHERE descendant_id = OLD.parent_id);
+    ELSE
+        SELECT discendenti + 1 INTO dimensione
+        FROM enti_militari_stats WHERE ente_id = NEW.id;
+        dimensione := COALESCE(dimensione, 1);
+        UPDATE enti_militari_stats SET discendenti = discendenti - dimensione
+        WHERE ente_id IN (SELECT ancestor_id FROM enti_militari_closure
+                          WHERE descendant_id = OLD.parent_id);
+        UPDATE enti_militari_stats SET discendenti = discendenti + dimensione
+        WHERE ente_id IN (SELECT ancestor_id FROM enti_militari_closure
+                          WHERE descendant_id = NEW.parent_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_enti_stats_insert_delete ON enti_militari;
+CREATE TRIGGER trg_enti_stats_insert_delete
+    AFTER INSERT OR DELETE ON enti_militari
+    FOR EACH ROW EXECUTE FUNCTION talon_enti_stats_enti();
+
+DROP TRIGGER IF EXISTS trg_enti_stats_move ON enti_militari;
+CREATE TRIGGER trg_enti_stats_move
+    AFTER UPDATE OF parent_id ON enti_militari
+    FOR EACH ROW
+    WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+    EXECUTE FUNCTION talon_enti_stats_enti();
+
+-- Passo 5: Utenti assegnati
+CREATE OR REPLACE FUNCTION talon_enti_stats_utenti()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.ente_militare_id IS NOT NULL THEN
+        UPDATE enti_militari_stats SET utenti = utenti - 1
+        WHERE ente_id = OLD.ente_militare_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.ente_militare_id IS NOT NULL THEN
+        UPDATE enti_militari_stats SET utenti = utenti + 1
+        WHERE ente_id = NEW.ente_militare_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_enti_stats_utenti ON utenti;
+CREATE TRIGGER trg_enti_stats_utenti
+    AFTER INSERT OR DELETE ON utenti
+    FOR EACH ROW EXECUTE FUNCTION talon_enti_stats_utenti();
+
+DROP TRIGGER IF EXISTS trg_enti_stats_utenti_upd ON utenti;
+CREATE TRIGGER trg_enti_stats_utenti_upd
+    AFTER UPDATE OF ente_militare_id ON utenti
+    FOR EACH ROW
+    WHEN (OLD.ente_militare_id IS DISTINCT FROM NEW.ente_militare_id)
+    EXECUTE FUNCTION talon_enti_stats_utenti();
+
+-- Passo 6: Attività svolte
+CREATE OR REPLACE FUNCTION talon_enti_stats_attivita()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.ente_svolgimento_id IS NOT NULL THEN
+        -- Ricalcolo del massimo solo se la riga rimossa poteva esserlo (indice)
+        UPDATE enti_militari_stats s
+        SET attivita = s.attivita - 1,
+            ultima_attivita = CASE
+                WHEN OLD.data_inizio IS NOT NULL AND OLD.data_inizio >= s.ultima_attivita THEN (
+                    SELECT MAX(a.data_inizio) FROM attivita a
+                    WHERE a.ente_svolgimento_id = OLD.ente_svolgimento_id
+                )
+                ELSE s.ultima_attivita
+            END
+        WHERE s.ente_id = OLD.ente_svolgimento_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.ente_svolgimento_id IS NOT NULL THEN
+        UPDATE enti_militari_stats
+        SET attivita = attivita + 1,
+            ultima_attivita = GREATEST(ultima_attivita, NEW.data_inizio)
+        WHERE ente_id = NEW.ente_svolgimento_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_enti_stats_attivita ON attivita;
+CREATE TRIGGER trg_enti_stats_attivita
+    AFTER INSERT OR DELETE ON attivita
+    FOR EACH ROW EXECUTE FUNCTION talon_enti_stats_attivita();
+
+DROP TRIGGER IF EXISTS trg_enti_stats_attivita_upd ON attivita;
+CREATE TRIGGER trg_enti_stats_attivita_upd
+    AFTER UPDATE OF ente_svolgimento_id, data_inizio ON attivita
+    FOR EACH ROW
+    WHEN (OLD.ente_svolgimento_id IS DISTINCT FROM NEW.ente_svolgimento_id
+          OR OLD.data_inizio IS DISTINCT FROM NEW.data_inizio)
+    EXECUTE FUNCTION talon_enti_stats_attivita();
+
+-- Passo 7: Verifica (deve restituire 0 righe)
+-- SELECT s.ente_id FROM enti_militari_stats s
+-- WHERE s.attivita <> (SELECT COUNT(*) FROM attivita a WHERE a.ente_svolgimento_id = s.ente_id)
+--    OR s.utenti <> (SELECT COUNT(*) FROM utenti u WHERE u.ente_militare_id = s.ente_id)
+--    OR s.discendenti <> (SELECT COUNT(*) - 1 FROM enti_militari_closure c WHERE c.ancestor_id = s.ente_id);
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP TRIGGER IF EXISTS trg_enti_stats_attivita_upd ON attivita;
+-- DROP TRIGGER IF EXISTS trg_enti_stats_attivita ON attivita;
+-- DROP TRIGGER IF EXISTS trg_enti_stats_utenti_upd ON utenti;
+-- DROP TRIGGER IF EXISTS trg_enti_stats_utenti ON utenti;
+-- DROP TRIGGER IF EXISTS trg_enti_stats_move ON enti_militari;
+-- DROP TRIGGER IF EXISTS trg_enti_stats_insert_delete ON enti_militari;
+-- DROP FUNCTION IF EXISTS talon_enti_stats_attivita();
+-- DROP FUNCTION IF EXISTS talon_enti_stats_utenti();
+-- DROP FUNCTION IF EXISTS talon_enti_stats_enti();
+-- DROP TABLE IF EXISTS enti_militari_stats;
+-- DROP INDEX IF EXISTS idx_attivita_ente_svolgimento_data;
+-- ==============================================
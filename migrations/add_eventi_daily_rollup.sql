@@ -0,0 +1,110 @@
+-- ==============================================
+-- Migrazione Database: Rollup giornaliero degli eventi
+-- Data: 2026-10-17
+-- Descrizione: Tabella eventi_daily_rollup(day, ente_id, tipo_evento,
+--              carattere, count) con il numero di eventi per giorno
+--              (data_msg_evento), ente, tipo e carattere.
+--              È mantenuta nella stessa transazione delle scritture su eventi
+--              (salva_evento, aggiorna_evento, elimina_evento) da un trigger;
+--              i grafici di /eventi/api la leggono al posto di eventi, con un
+--              costo proporzionale a giorni x enti e non al numero di eventi.
+--              Per ricostruirla: python eventi_rollup.py [--dal AAAA-MM-GG] [--al AAAA-MM-GG]
+-- ==============================================
+
+-- Passo 1: Tabella (tipo_evento e carattere possono essere NULL come in eventi)
+CREATE TABLE IF NOT EXISTS eventi_daily_rollup (
+    day         DATE    NOT NULL,
+    ente_id     INTEGER NOT NULL,
+    tipo_evento TEXT,
+    carattere   TEXT,
+    count       INTEGER NOT NULL
+);
+
+-- Passo 2: Chiave (i NULL di tipo/carattere sono un unico gruppo)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_eventi_daily_rollup
+    ON eventi_daily_rollup (day, ente_id, COALESCE(tipo_evento, ''), COALESCE(carattere, ''));
+
+-- Passo 3: Popolamento iniziale
+TRUNCATE eventi_daily_rollup;
+
+INSERT INTO eventi_daily_rollup (day, ente_id, tipo_evento, carattere, count)
+SELECT data_msg_evento::date, ente_id, tipo_evento, carattere, COUNT(*)
+FROM eventi
+WHERE data_msg_evento IS NOT NULL AND ente_id IS NOT NULL
+GROUP BY data_msg_evento::date, ente_id, tipo_evento, carattere;
+
+-- Passo 4: Manutenzione transazionale
+CREATE OR REPLACE FUNCTION talon_eventi_rollup()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE')
+       AND OLD.data_msg_evento IS NOT NULL AND OLD.ente_id IS NOT NULL THEN
+        UPDATE eventi_daily_rollup SET count = count - 1
+        WHERE day = OLD.data_msg_evento::date
+          AND ente_id = OLD.ente_id
+          AND COALESCE(tipo_evento, '') = COALESCE(OLD.tipo_evento, '')
+          AND COALESCE(carattere, '') = COALESCE(OLD.carattere, '');
+
+        DELETE FROM eventi_daily_rollup
+        WHERE day = OLD.data_msg_evento::date
+          AND ente_id = OLD.ente_id
+          AND COALESCE(tipo_evento, '') = COALESCE(OLD.tipo_evento, '')
+          AND COALESCE(carattere, '') = COALESCE(OLD.carattere, '')
+          AND count <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE')
+       AND NEW.data_msg_evento IS NOT NULL AND NEW.ente_id IS NOT NULL THEN
+        INSERT INTO eventi_daily_rollup (day, ente_id, tipo_evento, carattere, count)
+        VALUES (NEW.data_msg_evento::date, NEW.ente_id, NEW.tipo_evento, NEW.carattere, 1)
+        ON CONFLICT (day, ente_id, COALESCE(tipo_evento, ''), COALESCE(carattere, ''))
+        DO UPDATE SET count = eventi_daily_rollup.count + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_eventi_rollup ON eventi;
+CREATE TRIGGER trg_eventi_rollup
+    AFTER INSERT OR DELETE ON eventi
+    FOR EACH ROW EXECUTE FUNCTION talon_eventi_rollup();
+
+DROP TRIGGER IF EXISTS trg_eventi_rollup_upd ON eventi;
+CREATE TRIGGER trg_eventi_rollup_upd
+    AFTER UPDATE OF data_msg_evento, ente_id, tipo_evento, carattere ON eventi
+    FOR EACH ROW
+    WHEN (OLD.data_msg_evento IS DISTINCT FROM NEW.data_msg_evento
+          OR OLD.ente_id IS DISTINCT FROM NEW.ente_id
+          OR OLD.tipo_evento IS DISTINCT FROM NEW.tipo_evento
+          OR OLD.carattere IS DISTINCT FROM NEW.carattere)
+    EXECUTE FUNCTION talon_eventi_rollup();
+
+CREATE OR REPLACE FUNCTION talon_eventi_rollup_truncate()
+RETURNS trigger AS $$
+BEGIN
+    TRUNCATE eventi_daily_rollup;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_eventi_rollup_truncate ON eventi;
+CREATE TRIGGER trg_eventi_rollup_truncate
+    AFTER TRUNCATE ON eventi
+    FOR EACH STATEMENT EXECUTE FUNCTION talon_eventi_rollup_truncate();
+
+-- Passo 5: Verifica (deve restituire 0 righe)
+-- SELECT data_msg_evento::date, ente_id, tipo_evento, carattere, COUNT(*) FROM eventi
+-- WHERE data_msg_evento IS NOT NULL AND ente_id IS NOT NULL
+-- GROUP BY 1, 2, 3, 4
+-- EXCEPT
+-- SELECT day, ente_id, tipo_evento, carattere, count FROM eventi_daily_rollup;
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP TRIGGER IF EXISTS trg_eventi_rollup_truncate ON eventi;
+-- DROP TRIGGER IF EXISTS trg_eventi_rollup_upd ON eventi;
+-- DROP TRIGGER IF EXISTS trg_eventi_rollup ON eventi;
+-- DROP FUNCTION IF EXISTS talon_eventi_rollup_truncate();
+-- DROP FUNCTION IF EXISTS talon_eventi_rollup();
+-- DROP TABLE IF EXISTS eventi_daily_rollup;
+-- ==============================================
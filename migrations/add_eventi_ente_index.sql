@@ -0,0 +1,19 @@
+-- ==============================================
+-- Migrazione Database: Indice eventi per ente e data messaggio
+-- Data: 2026-10-17
+-- Descrizione: Le query degli eventi filtrano per appartenenza al Comando
+--              Logistico con `e.ente_id = ANY(<id enti>)` (insieme calcolato
+--              una volta per versione della gerarchia, vedi
+--              get_enti_comando_logistico in routes/eventi.py) invece di
+--              valutare check_ente_comando_logistico() per ogni riga.
+--              Questo indice rende il filtro, combinato con l'ordinamento
+--              o l'intervallo su data_msg_evento, un index scan.
+-- ==============================================
+
+CREATE INDEX IF NOT EXISTS idx_eventi_ente_data_msg
+    ON eventi (ente_id, data_msg_evento DESC);
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP INDEX IF EXISTS idx_eventi_ente_data_msg;
+-- ==============================================
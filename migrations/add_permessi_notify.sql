@@ -0,0 +1,19 @@
+-- ==============================================
+-- Migrazione Database: Notifica modifiche alla tabella permessi
+-- Data: 2026-10-17
+-- Descrizione: La matrice ruolo -> permessi (permission_matrix.py) viene
+--              ricompilata quando cambiano permessi, ruoli o ruoli_permessi.
+--              ruoli e ruoli_permessi notificano già (add_cache_invalidation_notify.sql);
+--              qui si aggiunge la tabella permessi, una notifica per statement.
+-- Richiede: add_cache_invalidation_notify.sql
+-- ==============================================
+
+DROP TRIGGER IF EXISTS trg_talon_cache_permessi ON permessi;
+CREATE TRIGGER trg_talon_cache_permessi
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON permessi
+    FOR EACH STATEMENT EXECUTE FUNCTION talon_notify_cache_invalidate();
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP TRIGGER IF EXISTS trg_talon_cache_permessi ON permessi;
+-- ==============================================
@@ -0,0 +1,28 @@
+-- ==============================================
+-- Migrazione Database: Notifiche di invalidazione per la cache delle risposte
+-- Data: 2026-10-17
+-- Descrizione: Trigger (uno per statement) che notificano sul canale
+--              'talon_cache_invalidate' le scritture su eventi e attivita.
+--              Ogni processo (cache_invalidation.py) invalida le risposte
+--              JSON dei grafici memorizzate per quella tabella
+--              (response_cache.py).
+-- Richiede: add_cache_invalidation_notify.sql (funzione talon_notify_cache_invalidate)
+-- ==============================================
+
+-- Passo 1: eventi (grafici di /eventi/api)
+DROP TRIGGER IF EXISTS trg_talon_cache_eventi ON eventi;
+CREATE TRIGGER trg_talon_cache_eventi
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON eventi
+    FOR EACH STATEMENT EXECUTE FUNCTION talon_notify_cache_invalidate();
+
+-- Passo 2: attivita (grafici di /drill-down/api)
+DROP TRIGGER IF EXISTS trg_talon_cache_attivita ON attivita;
+CREATE TRIGGER trg_talon_cache_attivita
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON attivita
+    FOR EACH STATEMENT EXECUTE FUNCTION talon_notify_cache_invalidate();
+
+-- ==============================================
+-- Note per il rollback (se necessario):
+-- DROP TRIGGER IF EXISTS trg_talon_cache_attivita ON attivita;
+-- DROP TRIGGER IF EXISTS trg_talon_cache_eventi ON eventi;
+-- ==============================================
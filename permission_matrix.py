@@ -0,0 +1,212 @@
+# permission_matrix.py - Matrice ruolo -> permessi compilata in bitmask
+"""
+`permessi` e `ruoli_permessi` vengono letti una volta (all'avvio) e compilati
+in una tabella ruolo -> bitmask: ogni permesso attivo ha un bit, ogni ruolo
+l'OR dei bit concessi. Il controllo di un permesso è un AND bit a bit, senza
+accessi al database.
+
+La matrice viene ricostruita in modo pigro dopo `invalidate()`, chiamata dal
+listener di cache_invalidation.py quando cambiano ruoli, permessi o
+ruoli_permessi, e comunque alla scadenza del TTL delle cache di
+autenticazione (auth.set_cache_ttl): senza trigger o listener le modifiche
+fatte direttamente sul database arrivano entro TALON_AUTH_CACHE_TTL. Se le tabelle dei permessi non esistono (schema_capabilities)
+si usa la matrice di fallback per nome ruolo, memorizzata; se invece la
+lettura fallisce per un errore temporaneo il fallback vale solo per quella
+chiamata e la successiva ritenta il database.
+"""
+import time
+import logging
+import threading
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+import psycopg2
+
+from db import db_connection
+import schema_capabilities
+
+logger = logging.getLogger(__name__)
+
+# Tabelle lette per compilare la matrice
+PERMISSION_TABLES = ('permessi', 'ruoli', 'ruoli_permessi')
+
+# ===========================================
+# PERMESSI DI FALLBACK (tabelle non disponibili)
+# ===========================================
+
+FALLBACK_PERMISSIONS = {
+    'ADMIN': ('VIEW_ENTI_CIVILI', 'CREATE_ENTI_CIVILI', 'EDIT_ENTI_CIVILI', 'DELETE_ENTI_CIVILI',
+              'VIEW_ENTI_MILITARI', 'CREATE_ENTI_MILITARI', 'EDIT_ENTI_MILITARI', 'DELETE_ENTI_MILITARI',
+              'VIEW_OPERAZIONI', 'CREATE_OPERAZIONI', 'EDIT_OPERAZIONI', 'DELETE_OPERAZIONI',
+              'VIEW_ATTIVITA', 'CREATE_ATTIVITA', 'EDIT_ATTIVITA', 'DELETE_ATTIVITA'),
+    'OPERATORE': ('VIEW_ENTI_CIVILI', 'CREATE_ENTI_CIVILI', 'EDIT_ENTI_CIVILI',
+                  'VIEW_ENTI_MILITARI', 'CREATE_ENTI_MILITARI', 'EDIT_ENTI_MILITARI',
+                  'VIEW_OPERAZIONI', 'CREATE_OPERAZIONI', 'EDIT_OPERAZIONI',
+                  'VIEW_ATTIVITA', 'CREATE_ATTIVITA', 'EDIT_ATTIVITA'),
+    'VISUALIZZATORE': ('VIEW_ENTI_CIVILI', 'VIEW_ENTI_MILITARI', 'VIEW_OPERAZIONI', 'VIEW_ATTIVITA'),
+}
+
+# ===========================================
+# MATRICE
+# ===========================================
+
+class PermissionMatrix:
+    """Snapshot immutabile: bit per permesso e bitmask per ruolo."""
+
+    def __init__(self, permission_names: Iterable[str],
+                 roles: Iterable[Tuple[Optional[int], str, int, bool]],
+                 grants: Dict[object, Iterable[str]],
+                 source: str = 'database', version: int = 0):
+        self.source = source
+        self.version = version
+        self.names: Tuple[str, ...] = tuple(sorted(set(permission_names)))
+        self.bits: Dict[str, int] = {name: 1 << i for i, name in enumerate(self.names)}
+
+        # Ruoli: id -> (nome, livello, attivo); maschere per id e per nome
+        self.roles: Dict[object, Tuple[str, int, bool]] = {}
+        self.role_masks: Dict[object, int] = {}
+        self.role_name_masks: Dict[str, int] = {}
+        for role_id, nome, livello, attivo in roles:
+            key = role_id if role_id is not None else nome
+            mask = 0
+            for name in grants.get(key, ()):
+                mask |= self.bits.get(name, 0)
+            self.roles[key] = (nome, livello, attivo)
+            self.role_masks[key] = mask
+            self.role_name_masks[(nome or '').upper()] = mask
+
+        self._name_sets: Dict[int, FrozenSet[str]] = {}
+        self._lock = threading.Lock()
+
+    def mask_for_user(self, user: Optional[Dict]) -> int:
+        """Bitmask dell'utente (dalla riga utenti già in cache)."""
+        if not user:
+            return 0
+        if self.source == 'database':
+            role_id = user.get('ruolo_id')
+            if role_id is None:
+                role_id = user.get('ruolo_id_real')
+            return self.role_masks.get(role_id, 0)
+        return self.role_name_masks.get((user.get('ruolo_nome') or '').upper(), 0)
+
+    def has(self, mask: int, permission_name: str) -> bool:
+        return bool(mask & self.bits.get(permission_name, 0))
+
+    def names_for(self, mask: int) -> FrozenSet[str]:
+        """Nomi dei permessi di una bitmask (memorizzati per maschera)."""
+        names = self._name_sets.get(mask)
+        if names is None:
+            names = frozenset(n for n, bit in self.bits.items() if mask & bit)
+            with self._lock:
+                names = self._name_sets.setdefault(mask, names)
+        return names
+
+    def permissions_by_role(self) -> Dict[str, int]:
+        """Numero di permessi per ruolo attivo, per livello decrescente."""
+        active = [(key, info) for key, info in self.roles.items() if info[2]]
+        active.sort(key=lambda item: -(item[1][1] or 0))
+        return {info[0]: bin(self.role_masks[key]).count('1') for key, info in active}
+
+    def info(self) -> Dict:
+        return {
+            'source': self.source,
+            'version': self.version,
+            'permissions': len(self.names),
+            'roles': len(self.roles),
+        }
+
+def _fallback_matrix(version: int = 0) -> PermissionMatrix:
+    names = {n for perms in FALLBACK_PERMISSIONS.values() for n in perms}
+    roles = [(None, nome, 0, True) for nome in FALLBACK_PERMISSIONS]
+    return PermissionMatrix(names, roles, FALLBACK_PERMISSIONS, source='fallback', version=version)
+
+def _load_matrix(version: int) -> PermissionMatrix:
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT id, nome FROM permessi
+                WHERE (attivo IS NULL OR attivo = TRUE)
+            ''')
+            permissions = {pid: nome for pid, nome in cur.fetchall()}
+
+            cur.execute('''
+                SELECT id, nome, livello_accesso, (attivo IS NULL OR attivo = TRUE)
+                FROM ruoli
+            ''')
+            roles = cur.fetchall()
+
+            cur.execute('SELECT ruolo_id, permesso_id FROM ruoli_permessi')
+            grants: Dict[object, list] = {}
+            for ruolo_id, permesso_id in cur.fetchall():
+                name = permissions.get(permesso_id)
+                if name is not None:
+                    grants.setdefault(ruolo_id, []).append(name)
+
+    return PermissionMatrix(permissions.values(), roles, grants, version=version)
+
+# ===========================================
+# MATRICE DI PROCESSO
+# ===========================================
+
+_matrix: Optional[PermissionMatrix] = None
+_matrix_lock = threading.Lock()
+_version = 0
+
+# Durata della matrice compilata (None = fino all'invalidazione)
+_ttl: Optional[float] = None
+_expires_at = 0.0
+
+def set_ttl(seconds: Optional[float]):
+    """Imposta la durata della matrice compilata (chiamata da auth.set_cache_ttl)."""
+    global _ttl
+    _ttl = float(seconds) if seconds is not None else None
+
+def get_matrix() -> PermissionMatrix:
+    """Matrice corrente, compilata alla prima richiesta, dopo un'invalidazione o alla scadenza."""
+    global _matrix, _version, _expires_at
+    matrix = _matrix
+    if matrix is not None and (_ttl is None or time.monotonic() < _expires_at):
+        return matrix
+
+    with _matrix_lock:
+        if _matrix is not None:
+            if _ttl is None or time.monotonic() < _expires_at:
+                return _matrix
+            # Scaduta: come un'invalidazione
+            _version += 1
+            _matrix = None
+        version = _version
+
+    if not schema_capabilities.get().has_table(*PERMISSION_TABLES):
+        # Tabelle assenti nello schema: fallback stabile, memorizzato
+        built = _fallback_matrix(version)
+    else:
+        try:
+            built = _load_matrix(version)
+        except psycopg2.Error as e:
+            # Errore temporaneo (database in riavvio, pool esaurito): il fallback
+            # vale solo per questa chiamata, la prossima ritenta il caricamento
+            logger.warning(f"Tabelle permessi non leggibili, uso permessi per ruolo: {e}")
+            return _fallback_matrix(version)
+
+    with _matrix_lock:
+        if built.version != _version:
+            # Invalidata durante la compilazione: valida solo per questa chiamata
+            return built
+        if _matrix is None:
+            _matrix = built
+            _expires_at = time.monotonic() + (_ttl if _ttl is not None else 0)
+        return _matrix
+
+def invalidate():
+    """Da chiamare dopo modifiche a ruoli, permessi o ruoli_permessi."""
+    global _matrix, _version
+    with _matrix_lock:
+        _version += 1
+        _matrix = None
+
+def load():
+    """Compila la matrice all'avvio dell'applicazione."""
+    return get_matrix()
+
+# Tabelle dei permessi create o rimosse: ricompila alla prossima richiesta
+schema_capabilities.on_refresh(lambda capabilities: invalidate())
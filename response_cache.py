@@ -0,0 +1,201 @@
+# response_cache.py - Cache lato server delle risposte JSON dei grafici
+"""
+Le API dei grafici (eventi e drill-down) restituiscono aggregati uguali per
+tutti gli utenti con lo stesso perimetro di accesso: la prima richiesta
+esegue la query, le successive identiche ricevono il JSON memorizzato.
+
+La chiave è normalizzata:
+  - endpoint e parametri del percorso (es. id dell'ente)
+  - periodo risolto in date concrete (week/month/... -> dal, al), così
+    "period=month" e il custom equivalente coincidono e la chiave cambia da
+    sola a mezzanotte
+  - gli altri parametri della query string (carattere, ente, livello, ...)
+    ordinati, esclusi i parametri anti-cache del client
+  - hash del perimetro dell'utente (permessi ed enti accessibili)
+
+Ogni voce appartiene a un dominio ('eventi', 'attivita'): le scritture sulla
+tabella corrispondente incrementano la generazione del dominio e le voci
+precedenti non vengono più servite. L'invalidazione arriva dalle route che
+scrivono e, tra processi, dal listener di cache_invalidation.py (trigger di
+migrations/add_response_cache_notify.sql). Il TTL limita comunque l'età
+delle risposte se i trigger non sono installati.
+
+Le risposte hanno un ETag forte (hash del corpo): una richiesta con
+If-None-Match uguale riceve 304 senza corpo.
+
+Sui miss, le richieste identiche contemporanee (stessa chiave) attendono
+l'esecuzione già in corso invece di ripetere la query (singleflight.py).
+"""
+import os
+import hashlib
+import threading
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import Response, current_app, jsonify, request
+
+import auth
+import enti_hierarchy
+import eventi_rollup
+from auth_cache import MISSING, TTLCache
+from singleflight import SingleFlight, SingleFlightTimeout
+
+# ===========================================
+# CONFIGURAZIONE
+# ===========================================
+
+# 0 per disattivare la cache (le risposte hanno comunque l'ETag)
+ENABLED = os.environ.get('TALON_RESPONSE_CACHE', '1') == '1'
+
+RESPONSE_CACHE_TTL = int(os.environ.get('TALON_RESPONSE_CACHE_TTL', '300'))
+RESPONSE_CACHE_SIZE = int(os.environ.get('TALON_RESPONSE_CACHE_SIZE', '1024'))
+
+# Domini invalidabili: tabella le cui scritture cambiano le risposte
+DOMAINS = ('eventi', 'attivita')
+
+# Parametri del periodo (sostituiti dalle date risolte)
+PERIOD_ARGS = ('period', 'start_date', 'end_date')
+
+# Parametri anti-cache aggiunti dal client (non cambiano la risposta)
+IGNORED_ARGS = ('_', 't', 'ts', 'timestamp', 'nocache')
+
+_cache = TTLCache('responses', maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+# Richieste identiche in corso (una sola esecuzione della view)
+_in_flight = SingleFlight('responses')
+
+# Generazione per dominio: incrementata ad ogni scrittura sulla tabella
+_generations: Dict[str, int] = {}
+_generations_lock = threading.Lock()
+
+# ===========================================
+# INVALIDAZIONE
+# ===========================================
+
+def generation(domain: str) -> int:
+    with _generations_lock:
+        return _generations.get(domain, 0)
+
+def invalidate(domain: Optional[str] = None):
+    """Invalida le risposte di un dominio (None: tutte)."""
+    with _generations_lock:
+        # Tutti i domini noti, anche mai invalidati: una view in corso non deve
+        # poter memorizzare sotto una chiave ancora valida dopo il clear
+        domains = [domain] if domain is not None else list(set(DOMAINS) | set(_generations))
+        for name in domains:
+            _generations[name] = _generations.get(name, 0) + 1
+    if domain is None:
+        _cache.clear()
+
+def stats() -> Dict:
+    info = _cache.stats()
+    info['enabled'] = ENABLED
+    with _generations_lock:
+        info['generations'] = dict(_generations)
+    info['single_flight'] = _in_flight.stats()
+    return info
+
+# ===========================================
+# CHIAVE E ETAG
+# ===========================================
+
+def _scope_hash() -> str:
+    """
+    Perimetro dell'utente: permessi, livello di ruolo ed enti accessibili.
+    L'hash degli enti è memorizzato sull'EntitySet condiviso (cache enti di
+    auth.py, coni d'ombra e albero): si ricalcola solo quando cambia l'insieme.
+    """
+    principal = auth.get_principal()
+    if principal is None:
+        return 'anon'
+    entities = principal.accessible_entities
+    if isinstance(entities, enti_hierarchy.EntitySet):
+        entities_hash = entities.fingerprint
+    else:
+        entities_hash = enti_hierarchy.entities_fingerprint(entities)
+    return (f"{principal.permission_mask}:{principal.is_admin}:"
+            f"{principal.is_operatore_or_above}:{entities_hash}")
+
+def cache_key(domain: str, default_period: str):
+    args = request.args
+    dal, al = eventi_rollup.resolve_period(
+        args.get('period', default_period), args.get('start_date'), args.get('end_date'), default_period
+    )
+    other = tuple(sorted(
+        (name, tuple(values)) for name, values in args.lists()
+        if name not in PERIOD_ARGS and name not in IGNORED_ARGS
+    ))
+    view_args = tuple(sorted((request.view_args or {}).items()))
+    return (domain, generation(domain), request.endpoint, view_args, dal.isoformat(),
+            al.isoformat() if al else None, other, _scope_hash())
+
+def _etag(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()[:32]
+
+def _respond(body: bytes, etag: str, status: int = 200) -> Response:
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, mimetype='application/json')
+    else:
+        response = Response(body, status=status, mimetype='application/json')
+    response.set_etag(etag)
+    # Il browser può riusare la risposta solo dopo la riconvalida (304)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# ===========================================
+# DECORATORE
+# ===========================================
+
+def cached_json(domain: str, default_period: str = 'year', on_hit=None):
+    """
+    Memorizza le risposte JSON 200 della view per dominio e chiave
+    normalizzata. Va applicato sotto @login_required. `on_hit` viene
+    chiamata quando la risposta arriva dalla cache o da una richiesta
+    identica in corso (es. audit).
+    Le richieste identiche contemporanee eseguono la view una sola volta
+    (singleflight.py); chi attende oltre il timeout riceve 503.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                key = cache_key(domain, default_period)
+            except ValueError:
+                # Date non valide: decide la view (senza cache)
+                return f(*args, **kwargs)
+
+            if ENABLED:
+                cached = _cache.get(key)
+                if cached is not MISSING:
+                    if on_hit is not None:
+                        on_hit()
+                    return _respond(*cached)
+
+            def esegui():
+                response = current_app.make_response(f(*args, **kwargs))
+                body = response.get_data()
+                if response.status_code != 200 or response.mimetype != 'application/json':
+                    return {'response': response, 'status': response.status_code,
+                            'body': body, 'mimetype': response.mimetype}
+                etag = _etag(body)
+                if ENABLED:
+                    _cache.set(key, (body, etag))
+                return {'body': body, 'etag': etag}
+
+            try:
+                outcome, shared = _in_flight.do(key, esegui)
+            except SingleFlightTimeout:
+                response = jsonify({'success': False, 'error': 'Servizio occupato, riprovare'})
+                response.status_code = 503
+                response.headers['Retry-After'] = '5'
+                return response
+
+            if 'etag' in outcome:
+                if shared and on_hit is not None:
+                    on_hit()
+                return _respond(outcome['body'], outcome['etag'])
+            if not shared:
+                return outcome['response']
+            return Response(outcome['body'], status=outcome['status'], mimetype=outcome['mimetype'])
+        return decorated_function
+    return decorator
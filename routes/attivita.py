@@ -4,6 +4,8 @@ from datetime import datetime, date
 from psycopg2.extras import RealDictCursor
 import csv
 import io
+import response_cache
+from singleflight import SingleFlight
 
 # Import dal modulo auth (usa Postgres)
 from auth import (
@@ -756,6 +758,9 @@ def salva_attivita():
                 if tipologia_result:
                     save_activity_details(conn, new_id, tipologia_result['nome'], request.form)
 
+        # Nuovi dati per i grafici drill-down
+        response_cache.invalidate('attivita')
+
         # Log successo
         log_user_action(
             user_id,
@@ -1193,6 +1198,9 @@ def aggiorna_attivita(id):
                 if tipologia_result:
                     save_activity_details(conn, id, tipologia_result['nome'], request.form)
 
+        # Nuovi dati per i grafici drill-down
+        response_cache.invalidate('attivita')
+
         # Log successo
         log_user_action(
             user_id,
@@ -1259,6 +1267,9 @@ def elimina_attivita(id):
                 # Elimina attività principale
                 cur.execute('DELETE FROM attivita WHERE id = %s', (id,))
 
+        # Nuovi dati per i grafici drill-down
+        response_cache.invalidate('attivita')
+
         # Prepara info per il log
         descrizione = (info_attivita['descrizione'][:50] if info_attivita and info_attivita.get('descrizione') else f'ID {id}')
         ente_nome = info_attivita['ente_nome'] if info_attivita and info_attivita.get('ente_nome') else 'N/A'
@@ -1335,6 +1346,9 @@ def api_elimina_attivita(id):
                 # Elimina attività principale
                 cur.execute('DELETE FROM attivita WHERE id = %s', (id,))
 
+        # Nuovi dati per i grafici drill-down
+        response_cache.invalidate('attivita')
+
         # Prepara info per il log
         descrizione = (info_attivita['descrizione'][:50] if info_attivita and info_attivita.get('descrizione') else f'ID {id}')
         ente_nome = info_attivita['ente_nome'] if info_attivita and info_attivita.get('ente_nome') else 'N/A'
@@ -1456,21 +1470,12 @@ def export_attivita():
         headers={'Content-Disposition': f'attachment; filename=attivita_export_{datetime.now().strftime("%Y%m%d_%H%M")}.csv'}
     )
 
-@attivita_bp.route('/attivita/statistiche')
-@permission_required('VIEW_ATTIVITA')
-def statistiche_attivita():
-    """
-    Statistiche attività per l'utente corrente.
-    """
-    user_id = request.current_user['user_id']
-    accessible_entities = get_user_accessible_entities(user_id)
-
-    if not accessible_entities:
-        flash('Nessuna attività accessibile per le statistiche.', 'warning')
-        return redirect(url_for('attivita.lista_attivita'))
+# Statistiche in calcolo, per perimetro di enti accessibili
+_statistiche_in_flight = SingleFlight('statistiche_attivita')
 
+def _carica_statistiche_attivita(accessible_entities):
+    """Query delle statistiche attività per un insieme di enti accessibili."""
     conn = get_db_connection()
-
     try:
         placeholders, params = _build_in_clause(accessible_entities)
         with conn:
@@ -1526,14 +1531,33 @@ def statistiche_attivita():
                     ORDER BY mese DESC
                 """, params)
                 stats_per_mese = cur.fetchall()
+    finally:
+        conn.close()
+    return stats_generali, stats_per_ente, stats_per_tipologia, stats_per_mese
 
+@attivita_bp.route('/attivita/statistiche')
+@permission_required('VIEW_ATTIVITA')
+def statistiche_attivita():
+    """
+    Statistiche attività per l'utente corrente.
+    """
+    user_id = request.current_user['user_id']
+    accessible_entities = get_user_accessible_entities(user_id)
+
+    if not accessible_entities:
+        flash('Nessuna attività accessibile per le statistiche.', 'warning')
+        return redirect(url_for('attivita.lista_attivita'))
+
+    try:
+        # Richieste contemporanee con lo stesso perimetro: una sola esecuzione
+        (stats_generali, stats_per_ente, stats_per_tipologia, stats_per_mese), _ = _statistiche_in_flight.do(
+            (tuple(sorted(accessible_entities)), date.today()),
+            lambda: _carica_statistiche_attivita(accessible_entities)
+        )
     except Exception as e:
         error_msg = f'Errore nel caricamento delle statistiche: {str(e)}'
         flash(error_msg, 'error')
         stats_generali, stats_per_ente, stats_per_tipologia, stats_per_mese = None, [], [], []
-            
-    finally:
-        conn.close()
 
     # Log visualizzazione statistiche
     log_user_action(
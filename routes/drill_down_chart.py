@@ -2,6 +2,11 @@
 from flask import Blueprint, render_template, request, jsonify
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
+import enti_hierarchy
+import eventi_rollup
+import response_cache
+import schema_capabilities
+import serie_temporali
 
 # Import dal modulo auth (usa PostgreSQL)
 from auth import (
@@ -22,6 +27,9 @@ drill_down_bp = Blueprint(
     static_folder='../static'
 )
 
+# Tabelle richieste dai grafici delle attività
+TABELLE_ATTIVITA = ('attivita', 'tipologie_attivita')
+
 # ===========================================
 # HELPERS DATABASE
 # ===========================================
@@ -63,8 +71,17 @@ def test():
 # API ENDPOINTS
 # ===========================================
 
+def _log_vista_categorie():
+    """Audit della vista categorie (anche quando la risposta arriva dalla cache)"""
+    log_user_action(
+        get_current_user_info()['id'], 
+        'drill_down_view',
+        f"Visualizzazione categorie periodo: {request.args.get('period', 'month')}"
+    )
+
 @drill_down_bp.route('/api/categorie')
 @login_required
+@response_cache.cached_json('attivita', default_period='month', on_hit=_log_vista_categorie)
 def api_categorie():
     """API per ottenere le categorie principali di attività"""
     period = request.args.get('period', 'month')
@@ -91,11 +108,8 @@ def api_categorie():
                 date_condition = "a.data_inizio >= CURRENT_DATE - INTERVAL %s"
                 date_params = (interval,)
             
-            # Verifica se le tabelle esistono
-            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-            tables = [row['table_name'] for row in cur.fetchall()]
-            
-            if 'attivita' not in tables or 'tipologie_attivita' not in tables:
+            # Verifica esistenza tabelle (registro rilevato all'avvio)
+            if not schema_capabilities.get().has_table(*TABELLE_ATTIVITA):
                 return jsonify({'success': False, 'error': 'Tabelle database non disponibili'}), 500
             
             # Query per categorie principali - usa le tipologie parent (root)
@@ -122,11 +136,7 @@ def api_categorie():
             values = [r['value'] for r in results]
             
             # Log per audit
-            log_user_action(
-                get_current_user_info()['id'], 
-                'drill_down_view',
-                f'Visualizzazione categorie periodo: {period}'
-            )
+            _log_vista_categorie()
             
             return jsonify({
                 'success': True,
@@ -149,6 +159,7 @@ def api_categorie():
 
 @drill_down_bp.route('/api/sottocategorie')
 @login_required
+@response_cache.cached_json('attivita', default_period='month')
 def api_sottocategorie():
     """API per ottenere le sottocategorie di una categoria"""
     categoria = request.args.get('categoria')
@@ -162,11 +173,8 @@ def api_sottocategorie():
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Verifica esistenza tabelle
-            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-            tables = [row['table_name'] for row in cur.fetchall()]
-            
-            if 'attivita' not in tables or 'tipologie_attivita' not in tables:
+            # Verifica esistenza tabelle (registro rilevato all'avvio)
+            if not schema_capabilities.get().has_table(*TABELLE_ATTIVITA):
                 return jsonify({'success': False, 'error': 'Tabelle database non disponibili'}), 500
             
             # Determina l'intervallo temporale
@@ -229,6 +237,7 @@ def api_sottocategorie():
 
 @drill_down_bp.route('/api/enti')
 @login_required
+@response_cache.cached_json('attivita', default_period='month')
 def api_enti():
     """API per ottenere gli enti che svolgono una sottocategoria di attività"""
     sottocategoria = request.args.get('sottocategoria')
@@ -304,6 +313,7 @@ def api_enti():
 
 @drill_down_bp.route('/api/dettagli')
 @login_required
+@response_cache.cached_json('attivita', default_period='month')
 def api_dettagli():
     """API per ottenere i dettagli delle attività di un ente"""
     ente = request.args.get('ente')
@@ -441,6 +451,7 @@ def api_dettagli():
 
 @drill_down_bp.route('/api/enti-coinvolti')
 @login_required
+@response_cache.cached_json('attivita', default_period='month')
 def api_enti_coinvolti():
     """API per ottenere il numero di enti coinvolti per il livello specifico"""
     level = request.args.get('level', '0')
@@ -525,6 +536,7 @@ def api_enti_coinvolti():
 
 @drill_down_bp.route('/api/statistiche')
 @login_required
+@response_cache.cached_json('attivita', default_period='month')
 def api_statistiche():
     """API per statistiche generali del periodo selezionato"""
     period = request.args.get('period', 'month')
@@ -585,6 +597,65 @@ def api_statistiche():
         if conn:
             conn.close()
 
+@drill_down_bp.route('/api/serie')
+@login_required
+@response_cache.cached_json('attivita', default_period='month')
+def api_serie():
+    """API serie temporale attività per giorno/settimana/mese, per categoria o ente di primo livello"""
+    period = request.args.get('period', 'month')
+    start_date = request.args.get('start_date', '')
+    end_date = request.args.get('end_date', '')
+    granularita = request.args.get('granularita', 'day')
+    group_by = request.args.get('group_by', '')
+    
+    gruppi = {'': None, 'categoria': 'COALESCE(t_parent.nome, t.nome)', 'ente': None}
+    if group_by not in gruppi:
+        return jsonify({'success': False, 'error': f'group_by non supportato: {group_by}'}), 400
+    
+    try:
+        dal, al = eventi_rollup.resolve_period(period, start_date, end_date, default='month')
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Date non valide (formato AAAA-MM-GG)'}), 400
+    al = al or datetime.now().date()
+    
+    tree = enti_hierarchy.get_index()
+    conn = get_db_connection()
+    try:
+        risultato = serie_temporali.serie(
+            conn,
+            sorgente='attivita a '
+                     'LEFT JOIN tipologie_attivita t ON a.tipologia_id = t.id '
+                     'LEFT JOIN tipologie_attivita t_parent ON t.parent_id = t_parent.id',
+            colonna_data='a.data_inizio',
+            misura='COUNT(*)',
+            where='a.data_inizio >= %s AND a.data_inizio <= %s',
+            params=[dal, al],
+            dal=dal, al=al, granularita=granularita,
+            gruppo=gruppi[group_by],
+            colonna_ente='a.ente_svolgimento_id',
+            mappa_enti=serie_temporali.mappa_primo_livello(tree) if group_by == 'ente' else None
+        )
+        
+        for s in risultato['series']:
+            s['label'] = tree.name(s['gruppo']) if group_by == 'ente' else (s['gruppo'] or 'N/D')
+        
+        return jsonify({
+            'success': True,
+            'granularita': granularita,
+            'dal': dal.isoformat(),
+            'al': al.isoformat(),
+            'labels': risultato['labels'],
+            'series': risultato['series']
+        })
+        
+    except serie_temporali.SerieNonValida as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        if conn:
+            conn.close()
+
 @drill_down_bp.route('/api/export')
 @login_required
 @permission_required('export_data')
@@ -16,20 +16,15 @@ from datetime import datetime
 # ===============================
 import psycopg2
 import psycopg2.extras
+from db import get_connection
+import enti_hierarchy
 
 def pg_conn():
     """
-    Connessione Postgres (usa env se presenti).
-    Valori di default allineati alla migrazione.
+    Connessione Postgres presa dal pool condiviso (cursori dict-like).
+    `conn.close()` restituisce la connessione al pool.
     """
-    return psycopg2.connect(
-        host=os.environ.get("TALON_PG_HOST", "127.0.0.1"),
-        port=int(os.environ.get("TALON_PG_PORT", "5432")),
-        dbname=os.environ.get("TALON_PG_DB", "talon"),
-        user=os.environ.get("TALON_PG_USER", "talon"),
-        password=os.environ.get("TALON_PG_PASSWORD", "TalonDB!2025"),
-        cursor_factory=psycopg2.extras.RealDictCursor,
-    )
+    return get_connection(cursor_factory=psycopg2.extras.RealDictCursor)
 
 def query_all(sql, params=None):
     conn = pg_conn()
@@ -80,20 +75,15 @@ ROOT_ENTE_ID = 1
 # ===========================================
 
 def get_all_descendants_conn(conn, parent_id):
-    """Recupera tutti i discendenti di un ente (ricorsivo) usando una CTE."""
+    """Recupera tutti i discendenti di un ente (ente compreso) dalla closure table."""
     with conn.cursor() as cur:
         cur.execute(
             """
-            WITH RECURSIVE tree AS (
-                SELECT *, 0 as level
-                FROM enti_militari
-                WHERE id = %s
-                UNION ALL
-                SELECT e.*, tree.level + 1
-                FROM enti_militari e
-                JOIN tree ON e.parent_id = tree.id
-            )
-            SELECT * FROM tree ORDER BY level, nome;
+            SELECT e.*, c.depth AS level
+            FROM enti_militari_closure c
+            JOIN enti_militari e ON e.id = c.descendant_id
+            WHERE c.ancestor_id = %s
+            ORDER BY c.depth, e.nome;
             """,
             (parent_id,)
         )
@@ -180,27 +170,15 @@ def get_enti_militari_stats(accessible_entities):
             stats['totale'] = r['count'] if r else 0
 
         # Distribuzione per livello gerarchico (partendo dalle radici accessibili)
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                WITH RECURSIVE hierarchy AS (
-                    SELECT id, nome, parent_id, 0 AS level
-                    FROM enti_militari
-                    WHERE parent_id IS NULL AND id = ANY(%s)
-                    UNION ALL
-                    SELECT e.id, e.nome, e.parent_id, h.level + 1
-                    FROM enti_militari e
-                    JOIN hierarchy h ON e.parent_id = h.id
-                    WHERE e.id = ANY(%s)
-                )
-                SELECT level, COUNT(*) AS count
-                FROM hierarchy
-                GROUP BY level
-                ORDER BY level;
-                """,
-                (accessible_entities, accessible_entities)
-            )
-            stats['per_livello'] = cur.fetchall()
+        tree = enti_hierarchy.get_index()
+        per_livello = {}
+        for ente_id in accessible_entities:
+            if tree.ancestor_at(ente_id, 0) in accessible_entities:
+                level = tree.depth(ente_id)
+                per_livello[level] = per_livello.get(level, 0) + 1
+        stats['per_livello'] = [
+            {'level': level, 'count': count} for level, count in sorted(per_livello.items())
+        ]
 
         # Enti creati ultimi 30 giorni
         with conn.cursor() as cur:
@@ -464,6 +442,7 @@ def salva_militare():
         )
 
         # Invalida cache enti per tutti gli utenti dopo creazione
+        enti_hierarchy.invalidate()
         clear_user_cache()
 
         flash(f'Ente militare "{nome}" creato con successo.', 'success')
@@ -503,8 +482,15 @@ def visualizza_ente(id):
                                WHEN em.coordinate IS NOT NULL THEN 
                                    ST_Y(em.coordinate) || ', ' || ST_X(em.coordinate)
                                ELSE NULL
-                           END AS coordinate_formatted
+                           END AS coordinate_formatted,
+                           parent.nome AS parent_nome,
+                           s.discendenti AS stats_discendenti,
+                           s.utenti AS stats_utenti,
+                           s.attivita AS stats_attivita,
+                           s.ultima_attivita AS stats_ultima_attivita
                     FROM enti_militari em
+                    LEFT JOIN enti_militari parent ON parent.id = em.parent_id
+                    LEFT JOIN enti_militari_stats s ON s.ente_id = em.id
                     LEFT JOIN utenti u_creato ON em.creato_da = u_creato.id
                     LEFT JOIN utenti u_modificato ON em.modificato_da = u_modificato.id
                     WHERE em.id = %s
@@ -517,77 +503,50 @@ def visualizza_ente(id):
                 flash('Ente militare non trovato.', 'error')
                 return redirect('/enti_militari/organigramma')
 
-            # Costruisce la catena gerarchica completa verso l'alto (parents)
-            parent_name = None
+            # Catena gerarchica verso l'alto e figli dall'albero in memoria
+            tree = enti_hierarchy.get_index(conn)
+            parent_name = ente['parent_nome']
             hierarchy_chain = []
-            
-            if ente['parent_id']:
-                # Prima costruisce parent_name per retrocompatibilità 
-                r = query_one('SELECT nome FROM enti_militari WHERE id = %s', (ente['parent_id'],))
-                if r:
-                    parent_name = r['nome']
-                
-                # Poi costruisce la catena gerarchica completa con CTE ricorsiva
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        WITH RECURSIVE hierarchy_up AS (
-                            -- Caso base: parent diretto dell'ente corrente
-                            SELECT id, nome, codice, parent_id, 1 AS level
-                            FROM enti_militari 
-                            WHERE id = %s
-                            
-                            UNION ALL
-                            
-                            -- Caso ricorsivo: risali la gerarchia
-                            SELECT e.id, e.nome, e.codice, e.parent_id, h.level + 1
-                            FROM enti_militari e
-                            JOIN hierarchy_up h ON e.id = h.parent_id
-                        )
-                        SELECT id, nome, codice, level
-                        FROM hierarchy_up
-                        WHERE level > 1  -- Escludi l'ente corrente (level 1)
-                        ORDER BY level ASC  -- Dal parent diretto verso il vertice
-                        """,
-                        (id,)
-                    )
-                    hierarchy_chain = cur.fetchall()
-
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT id, nome, codice FROM enti_militari WHERE parent_id = %s ORDER BY nome",
-                    (id,)
-                )
-                children = cur.fetchall()
+            depth = tree.depth(id)
+            if ente['parent_id'] and depth:
+                # Dal parent diretto (level 2) verso il vertice
+                for level, k in enumerate(range(depth - 1, -1, -1), start=2):
+                    ancestor_id = tree.ancestor_at(id, k)
+                    hierarchy_chain.append({
+                        'id': ancestor_id,
+                        'nome': tree.names.get(ancestor_id),
+                        'codice': tree.codes.get(ancestor_id),
+                        'level': level,
+                    })
+
+            children = [
+                {'id': c, 'nome': tree.names.get(c), 'codice': tree.codes.get(c)}
+                for c in tree.children.get(id, ())
+            ]
 
             related_stats = {}
             if is_operatore_or_above():
-                with conn.cursor() as cur:
-                    cur.execute("SELECT COUNT(*) AS count FROM utenti WHERE ente_militare_id = %s", (id,))
-                    c = cur.fetchone()
-                    related_stats['utenti'] = c['count'] if c else 0
-
-                with conn.cursor() as cur:
-                    cur.execute("SELECT COUNT(*) AS count FROM attivita WHERE ente_svolgimento_id = %s", (id,))
-                    c = cur.fetchone()
-                    related_stats['attivita'] = c['count'] if c else 0
-
-                descendants = get_all_descendants_conn(conn, id)
-                related_stats['discendenti'] = max(len(descendants) - 1, 0)
-
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        SELECT a.id, a.descrizione, a.data_inizio, ta.nome AS tipologia
-                        FROM attivita a
-                        JOIN tipologie_attivita ta ON a.tipologia_id = ta.id
-                        WHERE a.ente_svolgimento_id = %s
-                        ORDER BY a.data_inizio DESC
-                        LIMIT 5
-                        """,
-                        (id,)
-                    )
-                    related_stats['ultime_attivita'] = cur.fetchall()
+                # Contatori mantenuti dai trigger (migrations/add_enti_militari_stats.sql)
+                related_stats['utenti'] = ente['stats_utenti'] or 0
+                related_stats['attivita'] = ente['stats_attivita'] or 0
+                related_stats['discendenti'] = ente['stats_discendenti'] or 0
+                related_stats['ultima_attivita'] = ente['stats_ultima_attivita']
+                related_stats['ultime_attivita'] = []
+
+                if related_stats['attivita']:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            """
+                            SELECT a.id, a.descrizione, a.data_inizio, ta.nome AS tipologia
+                            FROM attivita a
+                            JOIN tipologie_attivita ta ON a.tipologia_id = ta.id
+                            WHERE a.ente_svolgimento_id = %s
+                            ORDER BY a.data_inizio DESC
+                            LIMIT 5
+                            """,
+                            (id,)
+                        )
+                        related_stats['ultime_attivita'] = cur.fetchall()
 
         finally:
             conn.close()
@@ -730,6 +689,7 @@ def aggiorna_militare(id):
         )
 
         # Invalida cache enti per tutti gli utenti dopo aggiornamento
+        enti_hierarchy.invalidate()
         clear_user_cache()
 
         flash(f'Ente militare "{nome}" aggiornato con successo.', 'success')
@@ -782,6 +742,7 @@ def elimina_militare(id):
         )
 
         # Invalida cache enti per tutti gli utenti dopo eliminazione
+        enti_hierarchy.invalidate()
         clear_user_cache()
 
         flash(f'Ente militare "{nome_ente}" eliminato con successo.', 'success')
@@ -989,6 +950,132 @@ def api_albero_enti(root_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# ===========================================
+# ORGANIGRAMMA INCREMENTALE (JSON)
+# ===========================================
+
+# Massimo numero di risultati evidenziati dalla ricerca
+ORGANIGRAMMA_SEARCH_LIMIT = 100
+
+def _nodo_organigramma(tree, ente_id, accessible, search_upper=None):
+    """Nodo dell'organigramma: solo i campi usati dall'albero e i conteggi."""
+    child_count = sum(1 for c in tree.children.get(ente_id, ()) if c in accessible)
+    node = {
+        'id': ente_id,
+        'nome': tree.names.get(ente_id, ''),
+        'codice': tree.codes.get(ente_id, ''),
+        'parent_id': tree.parents.get(ente_id),
+        'child_count': child_count,
+        'descendant_count': (tree.count_in_subtree(ente_id, accessible) - 1) if child_count else 0,
+    }
+    if search_upper:
+        pos = node['nome'].upper().find(search_upper)
+        node['match'] = pos >= 0 or search_upper in node['codice'].upper()
+        if pos >= 0:
+            node['highlight'] = [pos, pos + len(search_upper)]
+    return node
+
+def _figli_organigramma(tree, parent_id, accessible, search_upper=None):
+    return [_nodo_organigramma(tree, c, accessible, search_upper)
+            for c in tree.children.get(parent_id, ()) if c in accessible]
+
+def _percorso_visibile(tree, ente_id, accessible):
+    """
+    Antenati accessibili di `ente_id` dalla radice visibile all'ente (compreso).
+    Usa il percorso calcolato dall'albero, finito anche con cicli nei dati.
+    """
+    depth = tree.depth(ente_id)
+    if depth is None:
+        return []
+    path = []
+    for level in range(depth, -1, -1):
+        current = tree.ancestor_at(ente_id, level)
+        if current not in accessible:
+            break
+        path.append(current)
+    path.reverse()
+    return path
+
+@enti_militari_bp.route('/api/enti_militari/organigramma')
+@permission_required('VIEW_ENTI_MILITARI')
+def api_organigramma_nodi():
+    """
+    Organigramma un livello alla volta, senza query: i dati vengono
+    dall'albero degli enti in memoria (enti_hierarchy).
+
+    Parametri (alternativi):
+      parent_id  figli accessibili dell'ente
+      expand     radici e livelli da aprire per mostrare l'ente indicato
+      search     come expand per ogni ente che corrisponde (nome o codice),
+                 con `match`/`highlight` sui nodi
+    Senza parametri restituisce le radici visibili all'utente.
+    Ogni nodo ha `child_count` e `descendant_count` (solo enti accessibili).
+    """
+    try:
+        accessible = get_accessible_entities()
+        if not accessible:
+            return jsonify({'success': True, 'roots': [], 'levels': {}})
+        if not isinstance(accessible, enti_hierarchy.EntitySet):
+            accessible = enti_hierarchy.EntitySet(accessible)
+
+        tree = enti_hierarchy.get_index()
+        search = request.args.get('search', '').strip()
+        search_upper = search.upper() or None
+
+        parent_id = request.args.get('parent_id', type=int)
+        if parent_id is not None:
+            if parent_id not in accessible:
+                return jsonify({'error': 'Accesso negato'}), 403
+            return jsonify({
+                'success': True,
+                'parent_id': parent_id,
+                'nodes': _figli_organigramma(tree, parent_id, accessible, search_upper),
+            })
+
+        # Radici visibili: enti accessibili con padre non accessibile
+        root_ids = sorted(
+            (i for i in accessible if tree.parents.get(i) not in accessible and i in tree),
+            key=lambda i: (tree.names.get(i, ''), i)
+        )
+
+        targets = []
+        expand_id = request.args.get('expand', type=int)
+        if expand_id is not None:
+            if expand_id not in accessible:
+                return jsonify({'error': 'Accesso negato'}), 403
+            targets = [expand_id]
+        elif search_upper:
+            for ente_id in accessible:
+                if (search_upper in tree.names.get(ente_id, '').upper()
+                        or search_upper in tree.codes.get(ente_id, '').upper()):
+                    targets.append(ente_id)
+            targets.sort(key=lambda i: (tree.names.get(i, ''), i))
+
+        truncated = len(targets) > ORGANIGRAMMA_SEARCH_LIMIT
+        targets = targets[:ORGANIGRAMMA_SEARCH_LIMIT]
+
+        # Livelli da aprire: figli di ogni antenato sul percorso verso i target
+        levels = {}
+        paths = {}
+        for target in targets:
+            path = _percorso_visibile(tree, target, accessible)
+            paths[target] = path
+            for ancestor in path[:-1]:
+                if ancestor not in levels:
+                    levels[ancestor] = _figli_organigramma(tree, ancestor, accessible, search_upper)
+
+        return jsonify({
+            'success': True,
+            'roots': [_nodo_organigramma(tree, i, accessible, search_upper) for i in root_ids],
+            'levels': {str(k): v for k, v in levels.items()},
+            'paths': {str(k): v for k, v in paths.items()},
+            'matches': targets if search_upper and expand_id is None else [],
+            'truncated': truncated,
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ===========================================
 # GESTIONE ERRORI
 # ===========================================
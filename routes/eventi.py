@@ -3,15 +3,122 @@ Blueprint per la gestione degli Eventi
 Gestisce dashboard, CRUD e API per eventi del Comando Logistico
 """
 
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, session
-from auth import login_required, get_user_role, is_operatore_or_above, get_auth_db_connection
+from flask import (Blueprint, Response, render_template, request, jsonify, flash, redirect,
+                   url_for, session, stream_with_context)
+from auth import login_required, get_user_role, is_operatore_or_above, get_auth_db_connection, log_user_action
+from db import db_connection
 from datetime import datetime, timedelta
 from psycopg2.extras import RealDictCursor
+import csv
+import io
 import json
+import logging
+import os
+import enti_hierarchy
+import eventi_rollup
+import eventi_drilldown
+import serie_temporali
+import response_cache
 
 # Creazione del blueprint
 eventi = Blueprint('eventi', __name__, url_prefix='/eventi')
 
+logger = logging.getLogger(__name__)
+
+# Radice della gerarchia per le statistiche (COMANDO LOGISTICO DELL'ESERCITO)
+ROOT_ENTE_ID = 1
+
+def _righe_stacked(nodes):
+    """Righe `nome`, `tipo_evento`, `count` dai nodi del drill-down (vedi eventi_drilldown.py)."""
+    return sorted(
+        ({'nome': node['nome'], 'tipo_evento': tipo, 'count': count}
+         for node in nodes for tipo, count in node['per_tipo'].items()),
+        key=lambda r: (r['nome'], r['tipo_evento'] or '')
+    )
+
+# Colori per i tipi evento (allineati al dashboard principale)
+TIPO_EVENTO_COLORS = {
+    'tipo_a': 'rgba(102, 126, 234, 0.8)',
+    'tipo_b': 'rgba(118, 75, 162, 0.8)', 
+    'tipo_c': 'rgba(240, 147, 251, 0.8)',
+    'tipo_d': 'rgba(245, 87, 108, 0.8)',
+    'tipo_e': 'rgba(79, 172, 254, 0.8)'
+}
+
+# Colori per gli enti del grafico stacked
+ENTE_COLORS = [
+    'rgba(54, 162, 235, 0.8)',   # Blu
+    'rgba(255, 99, 132, 0.8)',   # Rosa
+    'rgba(255, 205, 86, 0.8)',   # Giallo
+    'rgba(75, 192, 192, 0.8)',   # Verde acqua
+    'rgba(153, 102, 255, 0.8)',  # Viola
+    'rgba(255, 159, 64, 0.8)',   # Arancione
+    'rgba(199, 199, 199, 0.8)',  # Grigio
+    'rgba(83, 102, 255, 0.8)'    # Blu scuro
+]
+
+def _formatta_chart_tipi(rows):
+    """Grafico livello 0 (Chart.js) da righe `tipo_evento`, `count`: (labels, data, colors)."""
+    labels = []
+    data = []
+    colors = []
+    for row in rows:
+        # Formatta il tipo evento sostituendo _ con spazio
+        labels.append(row['tipo_evento'].upper().replace('_', ' '))
+        data.append(row['count'])
+        colors.append(TIPO_EVENTO_COLORS.get(row['tipo_evento'], 'rgba(100, 100, 100, 0.8)'))
+    return labels, data, colors
+
+def _formatta_stacked_enti(stacked_data):
+    """
+    Grafico stacked per ente da righe `nome`, `tipo_evento`, `count`:
+    (labels, totals, backgroundColor, breakdown, tipi_evento).
+    """
+    # Tipi evento trovati nei dati invece di hardcode
+    tipi_evento = list({row['tipo_evento'] for row in stacked_data}) or ['TIPO A', 'TIPO B', 'TIPO C', 'TIPO D', 'TIPO E']
+    
+    # Tutti gli enti con tutti i tipi evento a 0, poi i conteggi
+    enti_map = {}
+    for row in stacked_data:
+        enti_map.setdefault(row['nome'], {tipo: 0 for tipo in tipi_evento})
+    for row in stacked_data:
+        enti_map[row['nome']][row['tipo_evento']] = row['count']
+    
+    labels = list(enti_map.keys())
+    totals = [sum(tipo_counts.values()) for tipo_counts in enti_map.values()]
+    backgroundColor = [ENTE_COLORS[i % len(ENTE_COLORS)] for i in range(len(labels))]
+    return labels, totals, backgroundColor, enti_map, tipi_evento
+
+# Enti del Comando Logistico: (albero di riferimento, id)
+_comando_logistico = (None, enti_hierarchy.EMPTY)
+
+def get_enti_comando_logistico(conn=None):
+    """
+    Id degli enti per cui `check_ente_comando_logistico()` è vera.
+    La funzione viene valutata una sola volta per ente e per versione
+    dell'albero degli enti (l'albero viene ricostruito ad ogni modifica di
+    enti_militari): le query filtrano poi con `ente_id = ANY(%s)`.
+    """
+    global _comando_logistico
+    tree = enti_hierarchy.get_index(conn)
+    cached_tree, ids = _comando_logistico
+    if cached_tree is tree:
+        return ids
+
+    sql = 'SELECT id FROM enti_militari WHERE check_ente_comando_logistico(id) = true ORDER BY id'
+    if conn is not None:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(sql)
+            rows = cur.fetchall()
+    else:
+        with db_connection() as own_conn:
+            with own_conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql)
+                rows = cur.fetchall()
+    ids = enti_hierarchy.EntitySet(r['id'] for r in rows)
+    _comando_logistico = (tree, ids)
+    return ids
+
 @eventi.route('/dashboard')
 @login_required
 def dashboard_eventi():
@@ -30,6 +137,7 @@ def dashboard_eventi():
 
 @eventi.route('/api/dashboard-data')
 @login_required
+@response_cache.cached_json('eventi')
 def api_dashboard_data():
     """API per dati dashboard eventi (per Chart.js)"""
     
@@ -42,22 +150,10 @@ def api_dashboard_data():
         end_date = request.args.get('end_date')
         carattere_filtro = request.args.get('carattere_filtro', '')
         
-        # Calcola il periodo - AGGIORNATO per usare data_msg_evento
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"data_msg_evento BETWEEN '{start_date}' AND '{end_date}'"
-        else:
-            days_map = {
-                'week': 7,
-                'month': 30,
-                'quarter': 90,
-                'year': 365
-            }
-            days = days_map.get(period, 365)
-            date_filter = f"data_msg_evento >= CURRENT_DATE - INTERVAL '{days} days'"
-        
-        # Aggiungi filtro carattere se presente
-        if carattere_filtro:
-            date_filter += f" AND e.carattere = '{carattere_filtro}'"
+        # Filtri sul rollup giornaliero (periodo su data_msg_evento)
+        where_rollup, params = eventi_rollup.build_filters(
+            period, start_date, end_date, carattere=carattere_filtro
+        )
         
         conn = get_auth_db_connection()
         try:
@@ -65,76 +161,39 @@ def api_dashboard_data():
                 # Query per dati eventi solo del Comando Logistico e suoi figli
                 # Livello 0: raggruppa per tipo_evento
                 cur.execute(f"""
-                    WITH RECURSIVE gerarchia_logistico AS (
-                        SELECT id, nome, parent_id, 0 as livello
-                        FROM enti_militari 
-                        WHERE id = 1  -- COMANDO LOGISTICO DELL'ESERCITO
-                        
-                        UNION ALL
-                        
-                        SELECT e.id, e.nome, e.parent_id, g.livello + 1
-                        FROM enti_militari e
-                        INNER JOIN gerarchia_logistico g ON e.parent_id = g.id
-                    )
                     SELECT 
-                        e.tipo_evento,
-                        COUNT(*) as count
-                    FROM eventi e
-                    INNER JOIN gerarchia_logistico g ON e.ente_id = g.id
-                    WHERE {date_filter}
-                    GROUP BY e.tipo_evento
-                    ORDER BY e.tipo_evento
-                """)
+                        r.tipo_evento,
+                        SUM(r.count) as count
+                    FROM eventi_daily_rollup r
+                    INNER JOIN enti_militari_closure g
+                        ON g.descendant_id = r.ente_id
+                       AND g.ancestor_id = %s  -- COMANDO LOGISTICO DELL'ESERCITO
+                    WHERE {where_rollup}
+                    GROUP BY r.tipo_evento
+                    ORDER BY r.tipo_evento
+                """, [ROOT_ENTE_ID] + params)
                 chart_data = cur.fetchall()
                 
                 # Statistiche aggregate solo per Comando Logistico
                 cur.execute(f"""
-                    WITH RECURSIVE gerarchia_logistico AS (
-                        SELECT id, nome, parent_id, 0 as livello
-                        FROM enti_militari 
-                        WHERE id = 1
-                        
-                        UNION ALL
-                        
-                        SELECT e.id, e.nome, e.parent_id, g.livello + 1
-                        FROM enti_militari e
-                        INNER JOIN gerarchia_logistico g ON e.parent_id = g.id
-                    )
                     SELECT 
-                        COUNT(*) as totale,
-                        COUNT(CASE WHEN e.carattere = 'positivo' THEN 1 END) as positivi,
-                        COUNT(CASE WHEN e.carattere = 'negativo' THEN 1 END) as negativi,
-                        COUNT(DISTINCT e.ente_id) as enti_coinvolti,
-                        COUNT(DISTINCT e.tipo_evento) as tipologie
-                    FROM eventi e
-                    INNER JOIN gerarchia_logistico g ON e.ente_id = g.id
-                    WHERE {date_filter}
-                """)
+                        COALESCE(SUM(r.count), 0) as totale,
+                        COALESCE(SUM(r.count) FILTER (WHERE r.carattere = 'positivo'), 0) as positivi,
+                        COALESCE(SUM(r.count) FILTER (WHERE r.carattere = 'negativo'), 0) as negativi,
+                        COUNT(DISTINCT r.ente_id) as enti_coinvolti,
+                        COUNT(DISTINCT r.tipo_evento) as tipologie
+                    FROM eventi_daily_rollup r
+                    INNER JOIN enti_militari_closure g
+                        ON g.descendant_id = r.ente_id
+                       AND g.ancestor_id = %s
+                    WHERE {where_rollup}
+                """, [ROOT_ENTE_ID] + params)
                 stats = cur.fetchone()
                 
         finally:
             conn.close()
             
-        # Formatta i dati per Chart.js - livello 0 (tipi evento)
-        labels = []
-        data = []
-        colors = []
-        
-        # Colori per i tipi evento (allineati al dashboard principale)
-        tipo_colors = {
-            'tipo_a': 'rgba(102, 126, 234, 0.8)',
-            'tipo_b': 'rgba(118, 75, 162, 0.8)', 
-            'tipo_c': 'rgba(240, 147, 251, 0.8)',
-            'tipo_d': 'rgba(245, 87, 108, 0.8)',
-            'tipo_e': 'rgba(79, 172, 254, 0.8)'
-        }
-        
-        for row in chart_data:
-            # Formatta il tipo evento sostituendo _ con spazio
-            tipo_formatted = row['tipo_evento'].upper().replace('_', ' ')
-            labels.append(tipo_formatted)
-            data.append(row['count'])
-            colors.append(tipo_colors.get(row['tipo_evento'], 'rgba(100, 100, 100, 0.8)'))
+        labels, data, colors = _formatta_chart_tipi(chart_data)
         
         return jsonify({
             'success': True,
@@ -153,7 +212,102 @@ def api_dashboard_data():
         })
         
     except Exception as e:
-        print(f"[EVENTI] Errore API dashboard: {e}")
+        logger.error("[EVENTI] Errore API dashboard: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@eventi.route('/api/dashboard-bundle')
+@login_required
+@response_cache.cached_json('eventi')
+def api_dashboard_bundle():
+    """
+    API unica per il caricamento del dashboard eventi: grafico livello 0
+    (come dashboard-data), statistiche del periodo e grafico stacked per ente
+    di livello 0 (come enti-stacked) calcolati con una sola query
+    (GROUPING SETS sul rollup giornaliero del Comando Logistico).
+    """
+    
+    if not is_operatore_or_above():
+        return jsonify({'error': 'Accesso negato'}), 403
+    
+    try:
+        period = request.args.get('period', 'year')
+        start_date = request.args.get('start_date')
+        end_date = request.args.get('end_date')
+        carattere_filtro = request.args.get('carattere_filtro', '')
+        
+        # Il periodo filtra tutte le righe; il carattere solo i conteggi dei
+        # grafici, così positivi/negativi restano quelli dell'intero periodo
+        where_periodo, params_periodo = eventi_rollup.build_filters(period, start_date, end_date)
+        if carattere_filtro:
+            filtro_carattere, params_carattere = 'r.carattere = %s', [carattere_filtro]
+        else:
+            filtro_carattere, params_carattere = 'TRUE', []
+        
+        conn = get_auth_db_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # gruppo: 0 = ente x tipo (stacked), 2 = tipo (livello 0), 3 = totale
+                cur.execute(f"""
+                    SELECT 
+                        GROUPING(r.ente_id, r.tipo_evento) as gruppo,
+                        r.ente_id,
+                        r.tipo_evento,
+                        COALESCE(SUM(r.count) FILTER (WHERE {filtro_carattere}), 0) as count,
+                        COALESCE(SUM(r.count) FILTER (WHERE r.carattere = 'positivo'), 0) as positivi,
+                        COALESCE(SUM(r.count) FILTER (WHERE r.carattere = 'negativo'), 0) as negativi,
+                        COUNT(DISTINCT r.ente_id) FILTER (WHERE {filtro_carattere}) as enti_coinvolti,
+                        COUNT(DISTINCT r.tipo_evento) FILTER (WHERE {filtro_carattere}) as tipologie
+                    FROM eventi_daily_rollup r
+                    INNER JOIN enti_militari_closure g
+                        ON g.descendant_id = r.ente_id
+                       AND g.ancestor_id = %s  -- COMANDO LOGISTICO DELL'ESERCITO
+                    WHERE {where_periodo}
+                    GROUP BY GROUPING SETS ((r.ente_id, r.tipo_evento), (r.tipo_evento), ())
+                """, params_carattere * 3 + [ROOT_ENTE_ID] + params_periodo)
+                rows = cur.fetchall()
+                
+        finally:
+            conn.close()
+        
+        chart_data = sorted(
+            (row for row in rows if row['gruppo'] == 2 and row['count']),
+            key=lambda r: r['tipo_evento'] or ''
+        )
+        per_ente = [row for row in rows if row['gruppo'] == 0 and row['count']]
+        totale = next((row for row in rows if row['gruppo'] == 3), None)
+        
+        labels, data, colors = _formatta_chart_tipi(chart_data)
+        
+        # Stacked livello 0: conteggi riportati ai figli diretti del Comando
+        stacked_data = _righe_stacked(
+            eventi_drilldown.raggruppa(enti_hierarchy.get_index(), per_ente, ROOT_ENTE_ID)
+        )
+        stacked_labels, stacked_totals, stacked_colors, breakdown, _ = _formatta_stacked_enti(stacked_data)
+        
+        return jsonify({
+            'success': True,
+            'chart': {
+                'labels': labels,
+                'data': data,
+                'backgroundColor': colors
+            },
+            'stats': {
+                'totale': totale['count'] if totale else 0,
+                'positivi': totale['positivi'] if totale else 0,
+                'negativi': totale['negativi'] if totale else 0,
+                'enti_coinvolti': totale['enti_coinvolti'] if totale else 0,
+                'tipologie': totale['tipologie'] if totale else 0
+            },
+            'stackedData': {
+                'labels': stacked_labels,
+                'totals': stacked_totals,
+                'backgroundColor': stacked_colors,
+                'breakdown': breakdown
+            }
+        })
+        
+    except Exception as e:
+        logger.error("[EVENTI] Errore API dashboard bundle: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @eventi.route('/lista')
@@ -188,23 +342,23 @@ def lista_eventi():
                     JOIN enti_militari em ON e.ente_id = em.id
                     LEFT JOIN tipologia_evento te ON e.tipologia_evento_id = te.id
                     LEFT JOIN utenti u ON e.creato_da = u.id
-                    WHERE check_ente_comando_logistico(em.id) = true
+                    WHERE e.ente_id = ANY(%s)
                     ORDER BY e.data_msg_evento DESC, e.creato_il DESC
                     LIMIT 1000
-                """)
+                """, (get_enti_comando_logistico(conn),))
                 eventi_data = cur.fetchall()
                 
         finally:
             conn.close()
             
-        print(f"[EVENTI] Lista eventi caricata: {len(eventi_data)} eventi trovati")
+        logger.debug("[EVENTI] Lista eventi caricata: %s eventi trovati", len(eventi_data))
         
         return render_template('eventi/lista_eventi.html',
                              eventi_list=eventi_data,
                              user_role=get_user_role())
                              
     except Exception as e:
-        print(f"[EVENTI] Errore caricamento lista eventi: {e}")
+        logger.error("[EVENTI] Errore caricamento lista eventi: %s", e)
         flash('Errore durante il caricamento degli eventi.', 'error')
         return render_template('eventi/lista_eventi.html',
                              eventi_list=[],
@@ -238,15 +392,15 @@ def visualizza_evento(id):
                     LEFT JOIN tipologia_evento te ON e.tipologia_evento_id = te.id
                     LEFT JOIN utenti u_creato ON e.creato_da = u_creato.id
                     LEFT JOIN utenti u_modificato ON e.modificato_da = u_modificato.id
-                    WHERE e.id = %s AND check_ente_comando_logistico(em.id) = true
-                """, (id,))
+                    WHERE e.id = %s AND e.ente_id = ANY(%s)
+                """, (id, get_enti_comando_logistico(conn)))
                 evento_data = cur.fetchone()
                 
                 if not evento_data:
                     flash('Evento non trovato o non autorizzato.', 'error')
                     return redirect(url_for('eventi.lista_eventi'))
                     
-                print(f"[EVENTI] Evento {id} caricato: {evento_data['tipo_evento']} - {evento_data['ente_nome']}")
+                logger.debug("[EVENTI] Evento %s caricato: %s - %s", id, evento_data['tipo_evento'], evento_data['ente_nome'])
                 
                 # Prepara dati protocollo per il template - parsing JSONB con arricchimento dati
                 rife_evento_raw = evento_data.get('rife_evento')
@@ -259,20 +413,20 @@ def visualizza_evento(id):
                         elif isinstance(rife_evento_raw, dict):
                             prot_data = rife_evento_raw
                         else:
-                            print(f"[EVENTI] Formato rife_evento non riconosciuto: {type(rife_evento_raw)}")
+                            logger.debug("[EVENTI] Formato rife_evento non riconosciuto: %s", type(rife_evento_raw))
                             prot_data = {}
                     except json.JSONDecodeError as e:
-                        print(f"[EVENTI] Errore parsing JSON rife_evento: {e}")
+                        logger.error("[EVENTI] Errore parsing JSON rife_evento: %s", e)
                         prot_data = {}
                     
                     # Arricchisci i dati dei seguiti con informazioni complete dall'evento
                     if prot_data and 'seguiti_eventi' in prot_data:
-                        print(f"[EVENTI] Elaborazione {len(prot_data['seguiti_eventi'])} seguiti eventi")
+                        logger.debug("[EVENTI] Elaborazione %s seguiti eventi", len(prot_data['seguiti_eventi']))
                         for seguito in prot_data['seguiti_eventi']:
                             if 'evento_id' in seguito:
                                 try:
-                                    print(f"[EVENTI] Processing seguito evento_id: {seguito['evento_id']}")
-                                    print(f"[EVENTI] Dati seguiti originali: {seguito}")
+                                    logger.debug("[EVENTI] Processing seguito evento_id: %s", seguito['evento_id'])
+                                    logger.debug("[EVENTI] Dati seguiti originali: %s", seguito)
                                     
                                     # Recupera i dati completi dell'evento seguito usando il cursor esistente
                                     cur.execute("""
@@ -290,7 +444,7 @@ def visualizza_evento(id):
                                     """, (seguito['evento_id'],))
                                     
                                     evento_seguito_data = cur.fetchone()
-                                    print(f"[EVENTI] Dati recuperati dal DB per evento {seguito['evento_id']}: {evento_seguito_data}")
+                                    logger.debug("[EVENTI] Dati recuperati dal DB per evento %s: %s", seguito['evento_id'], evento_seguito_data)
                                     
                                     if evento_seguito_data:
                                         # Forza l'aggiornamento con i dati dal database (non usare i dati JSONB)
@@ -303,7 +457,7 @@ def visualizza_evento(id):
                                             else:
                                                 seguito['data_msg_evento'] = 'N/D'
                                         except Exception as date_err:
-                                            print(f"[EVENTI] Errore formattazione data per evento {seguito['evento_id']}: {date_err}")
+                                            logger.error("[EVENTI] Errore formattazione data per evento %s: %s", seguito['evento_id'], date_err)
                                             seguito['data_msg_evento'] = 'N/D'
                                         
                                         seguito['dettagli_evento'] = str(evento_seguito_data['dettagli_evento']) if evento_seguito_data['dettagli_evento'] else 'N/D'
@@ -313,30 +467,30 @@ def visualizza_evento(id):
                                         seguito['tipologia_descrizione'] = str(evento_seguito_data['tipologia_descrizione']) if evento_seguito_data['tipologia_descrizione'] else 'N/D'
                                         
                                         # Debug per tipologie
-                                        print(f"[EVENTI] Debug tipologia per evento {seguito['evento_id']}:")
-                                        print(f"  - tipologia_nome recuperato: '{evento_seguito_data['tipologia_nome']}'")
-                                        print(f"  - tipologia_descrizione recuperata: '{evento_seguito_data['tipologia_descrizione']}'")
-                                        print(f"  - tipologia_nome impostata: '{seguito['tipologia_nome']}'")
-                                        print(f"  - tipologia_descrizione impostata: '{seguito['tipologia_descrizione']}')")
+                                        logger.debug("[EVENTI] Debug tipologia per evento %s:", seguito['evento_id'])
+                                        logger.debug("  - tipologia_nome recuperato: '%s'", evento_seguito_data['tipologia_nome'])
+                                        logger.debug("  - tipologia_descrizione recuperata: '%s'", evento_seguito_data['tipologia_descrizione'])
+                                        logger.debug("  - tipologia_nome impostata: '%s'", seguito['tipologia_nome'])
+                                        logger.debug("  - tipologia_descrizione impostata: '%s')", seguito['tipologia_descrizione'])
                                         
-                                        print(f"[EVENTI] Evento seguito {seguito['evento_id']} AGGIORNATO:")
-                                        print(f"  - Protocollo: {seguito['prot_msg_evento']}")
-                                        print(f"  - Data: {seguito['data_msg_evento']}")
-                                        print(f"  - Dettagli: {seguito['dettagli_evento'][:50]}{'...' if len(seguito['dettagli_evento']) > 50 else ''}")
+                                        logger.debug("[EVENTI] Evento seguito %s AGGIORNATO:", seguito['evento_id'])
+                                        logger.debug("  - Protocollo: %s", seguito['prot_msg_evento'])
+                                        logger.debug("  - Data: %s", seguito['data_msg_evento'])
+                                        logger.debug("  - Dettagli: %s%s", seguito['dettagli_evento'][:50], '...' if len(seguito['dettagli_evento']) > 50 else '')
                                     else:
-                                        print(f"[EVENTI] ATTENZIONE: Evento seguito {seguito['evento_id']} non trovato nel database!")
+                                        logger.warning("[EVENTI] ATTENZIONE: Evento seguito %s non trovato nel database!", seguito['evento_id'])
                                         # Se l'evento non esiste, imposta valori di default
                                         seguito['prot_msg_evento'] = 'EVENTO NON TROVATO'
                                         seguito['data_msg_evento'] = 'N/D'
                                         seguito['dettagli_evento'] = 'Evento collegato non più presente nel sistema'
                                 except Exception as e:
-                                    print(f"[EVENTI] ERRORE recupero dati evento seguito {seguito.get('evento_id')}: {e}")
+                                    logger.error("[EVENTI] ERRORE recupero dati evento seguito %s: %s", seguito.get('evento_id'), e)
                                     # In caso di errore, imposta valori di fallback
                                     seguito['prot_msg_evento'] = 'ERRORE'
                                     seguito['data_msg_evento'] = 'N/D'
                                     seguito['dettagli_evento'] = f'Errore recupero dati: {str(e)}'
                 
-                print(f"[EVENTI] prot_data parsato e arricchito: {prot_data}")
+                logger.debug("[EVENTI] prot_data parsato e arricchito: %s", prot_data)
                 
         finally:
             conn.close()
@@ -347,7 +501,7 @@ def visualizza_evento(id):
                              user_role=get_user_role())
                              
     except Exception as e:
-        print(f"[EVENTI] Errore caricamento evento {id}: {e}")
+        logger.error("[EVENTI] Errore caricamento evento %s: %s", id, e)
         flash('Errore durante il caricamento dell\'evento.', 'error')
         return redirect(url_for('eventi.lista_eventi'))
 
@@ -356,35 +510,35 @@ def visualizza_evento(id):
 def inserisci_evento_form():
     """Form per inserimento nuovo evento"""
     
-    print("[EVENTI] Accesso a /inserimento")
-    print(f"[EVENTI] User role: {get_user_role()}")
-    print(f"[EVENTI] Is operatore or above: {is_operatore_or_above()}")
+    logger.debug("[EVENTI] Accesso a /inserimento")
+    logger.debug("[EVENTI] User role: %s", get_user_role())
+    logger.debug("[EVENTI] Is operatore or above: %s", is_operatore_or_above())
     
     if not is_operatore_or_above():
-        print("[EVENTI] Accesso negato - privilegi insufficienti")
+        logger.warning("[EVENTI] Accesso negato - privilegi insufficienti")
         flash('Accesso negato. Privilegi insufficienti.', 'error')
         return redirect(url_for('main.dashboard'))
     
     try:
-        print("[EVENTI] Tentativo connessione database")
+        logger.debug("[EVENTI] Tentativo connessione database")
         conn = get_auth_db_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                print("[EVENTI] Caricamento enti militari del Comando Logistico")
+                logger.debug("[EVENTI] Caricamento enti militari del Comando Logistico")
                 # Query semplice per tutti gli enti del Comando Logistico
                 cur.execute("""
                     SELECT DISTINCT e.id, e.nome, e.codice, e.indirizzo
                     FROM enti_militari e
-                    WHERE check_ente_comando_logistico(e.id) = true
+                    WHERE e.id = ANY(%s)
                       AND e.nome IS NOT NULL 
                       AND e.nome != ''
                     ORDER BY e.nome
-                """)
+                """, (get_enti_comando_logistico(conn),))
                 enti_militari = cur.fetchall()
-                print(f"[EVENTI] Query completata - {len(enti_militari)} enti trovati")
+                logger.debug("[EVENTI] Query completata - %s enti trovati", len(enti_militari))
                 
                 # Query per tipologie evento - AGGIUNTO per uniformità con modifica_evento
-                print("[EVENTI] Caricamento tipologie evento")
+                logger.debug("[EVENTI] Caricamento tipologie evento")
                 cur.execute("""
                     SELECT id, nome, descrizione
                     FROM tipologia_evento 
@@ -392,12 +546,12 @@ def inserisci_evento_form():
                     ORDER BY nome
                 """)
                 tipologie_evento = cur.fetchall()
-                print(f"[EVENTI] Query tipologie completata - {len(tipologie_evento)} tipologie trovate")
+                logger.debug("[EVENTI] Query tipologie completata - %s tipologie trovate", len(tipologie_evento))
                 
         finally:
             conn.close()
             
-        print(f"[EVENTI] Rendering template con {len(enti_militari)} enti e {len(tipologie_evento)} tipologie")
+        logger.debug("[EVENTI] Rendering template con %s enti e %s tipologie", len(enti_militari), len(tipologie_evento))
         
         return render_template('eventi/inserisci_evento.html',
                              enti_militari=enti_militari,
@@ -405,10 +559,7 @@ def inserisci_evento_form():
                              user_role=get_user_role())
                              
     except Exception as e:
-        print(f"[EVENTI] ERRORE caricamento form inserimento: {e}")
-        print(f"[EVENTI] Tipo errore: {type(e)}")
-        import traceback
-        print(f"[EVENTI] Traceback: {traceback.format_exc()}")
+        logger.exception("[EVENTI] ERRORE caricamento form inserimento: %s", e)
         flash('Errore durante il caricamento del form.', 'error')
         return redirect(url_for('eventi.lista_eventi'))
 
@@ -421,8 +572,8 @@ def salva_evento():
         flash('Accesso negato. Privilegi insufficienti.', 'error')
         return redirect(url_for('main.dashboard'))
     
-    print("[EVENTI] Richiesta salvataggio nuovo evento")
-    print(f"[EVENTI] Dati ricevuti: {dict(request.form)}")
+    logger.debug("[EVENTI] Richiesta salvataggio nuovo evento")
+    logger.debug("[EVENTI] Dati ricevuti: %s", request.form)
     
     try:
         # Estrai dati dal form
@@ -437,43 +588,43 @@ def salva_evento():
         # Validazione e formattazione protocollo a 7 cifre
         prot_msg_evento_clean = ''.join(filter(str.isdigit, prot_msg_evento))
         if not prot_msg_evento_clean.isdigit():
-            print(f"[EVENTI] Errore validazione protocollo: '{prot_msg_evento}' non è numerico")
+            logger.error("[EVENTI] Errore validazione protocollo: '%s' non è numerico", prot_msg_evento)
             flash('Il protocollo messaggio evento deve contenere solo numeri.', 'error')
             return redirect(url_for('eventi.inserisci_evento_form'))
         
         prot_msg_evento = prot_msg_evento_clean.zfill(7)  # Applica padding a 7 cifre
-        print(f"[EVENTI] Protocollo formattato: '{prot_msg_evento}'")
+        logger.debug("[EVENTI] Protocollo formattato: '%s'", prot_msg_evento)
         
         data_msg_evento = request.form.get('data_msg_evento')
         seguiti_eventi = request.form.get('seguiti_eventi', '').strip()
         
-        print(f"[EVENTI] Campi estratti:")
-        print(f"  - ente_id: '{ente_id}' ({'OK' if ente_id else 'VUOTO'})")
-        print(f"  - carattere: '{carattere}' ({'OK' if carattere else 'VUOTO'})")
-        print(f"  - tipo_evento: '{tipo_evento}' ({'OK' if tipo_evento else 'VUOTO'})")
-        print(f"  - data_evento: '{data_evento}' ({'OK' if data_evento else 'VUOTO'})")
-        print(f"  - tipologia_evento_id: '{tipologia_evento_id}' ({'OK' if tipologia_evento_id else 'VUOTO'})")
-        print(f"  - prot_msg_evento: '{prot_msg_evento}' ({'OK' if prot_msg_evento else 'VUOTO'})")
-        print(f"  - data_msg_evento: '{data_msg_evento}' ({'OK' if data_msg_evento else 'VUOTO'})")
-        print(f"  - seguiti_eventi: '{seguiti_eventi[:100]}...' ({'OK' if seguiti_eventi else 'VUOTO'})")
-        print(f"  - user_id: '{session.get('user_id')}' ({'OK' if session.get('user_id') else 'VUOTO'})")
+        logger.debug("[EVENTI] Campi estratti:")
+        logger.debug("  - ente_id: '%s' (%s)", ente_id, 'OK' if ente_id else 'VUOTO')
+        logger.debug("  - carattere: '%s' (%s)", carattere, 'OK' if carattere else 'VUOTO')
+        logger.debug("  - tipo_evento: '%s' (%s)", tipo_evento, 'OK' if tipo_evento else 'VUOTO')
+        logger.debug("  - data_evento: '%s' (%s)", data_evento, 'OK' if data_evento else 'VUOTO')
+        logger.debug("  - tipologia_evento_id: '%s' (%s)", tipologia_evento_id, 'OK' if tipologia_evento_id else 'VUOTO')
+        logger.debug("  - prot_msg_evento: '%s' (%s)", prot_msg_evento, 'OK' if prot_msg_evento else 'VUOTO')
+        logger.debug("  - data_msg_evento: '%s' (%s)", data_msg_evento, 'OK' if data_msg_evento else 'VUOTO')
+        logger.debug("  - seguiti_eventi: '%s...' (%s)", seguiti_eventi[:100], 'OK' if seguiti_eventi else 'VUOTO')
+        logger.debug("  - user_id: '%s' (%s)", session.get('user_id'), 'OK' if session.get('user_id') else 'VUOTO')
         
         # Validazione (data_evento è ora opzionale)
         campi_obbligatori = [ente_id, carattere, tipo_evento, tipologia_evento_id, prot_msg_evento, data_msg_evento]
         if not all(campi_obbligatori):
-            print(f"[EVENTI] VALIDAZIONE FALLITA - campi mancanti:")
+            logger.warning("[EVENTI] VALIDAZIONE FALLITA - campi mancanti:")
             for i, campo in enumerate(['ente_id', 'carattere', 'tipo_evento', 'tipologia_evento_id', 'prot_msg_evento', 'data_msg_evento']):
                 if not campi_obbligatori[i]:
-                    print(f"  - {campo}: MANCANTE")
+                    logger.warning("  - %s: MANCANTE", campo)
             flash('Tutti i campi obbligatori devono essere compilati.', 'error')
             return redirect(url_for('eventi.inserisci_evento_form'))
         
-        print("[EVENTI] Validazione superata, procedo con l'inserimento database")
+        logger.debug("[EVENTI] Validazione superata, procedo con l'inserimento database")
         
         # Salva nel database
-        print(f"[EVENTI] Tentativo connessione database...")
-        with get_auth_db_connection() as conn:
-            print(f"[EVENTI] Connessione database riuscita")
+        logger.debug("[EVENTI] Tentativo connessione database...")
+        with db_connection() as conn:
+            logger.debug("[EVENTI] Connessione database riuscita")
             with conn.cursor() as cur:
                 # Processa i dati JSONB dei seguiti
                 rife_data = None
@@ -481,12 +632,12 @@ def salva_evento():
                     try:
                         import json
                         rife_data = json.loads(seguiti_eventi)
-                        print(f"[EVENTI] Dati seguiti JSONB: {rife_data}")
+                        logger.debug("[EVENTI] Dati seguiti JSONB: %s", rife_data)
                     except json.JSONDecodeError:
-                        print(f"[EVENTI] Errore parsing JSON seguiti: {seguiti_eventi}")
+                        logger.error("[EVENTI] Errore parsing JSON seguiti: %s", seguiti_eventi)
                         rife_data = None
                 
-                print(f"[EVENTI] Esecuzione query INSERT...")
+                logger.debug("[EVENTI] Esecuzione query INSERT...")
                 cur.execute("""
                     INSERT INTO eventi (
                         ente_id, carattere, tipo_evento, data_evento, 
@@ -498,16 +649,17 @@ def salva_evento():
                     tipologia_evento_id, note, prot_msg_evento, data_msg_evento,
                     json.dumps(rife_data) if rife_data else None, session.get('user_id')
                 ))
-                print(f"[EVENTI] Query INSERT eseguita, commit...")
+                logger.debug("[EVENTI] Query INSERT eseguita, commit...")
                 conn.commit()
-                print(f"[EVENTI] Commit completato")
+                logger.debug("[EVENTI] Commit completato")
+                response_cache.invalidate('eventi')
                 
-        print("[EVENTI] Evento salvato con successo")
+        logger.info("[EVENTI] Evento salvato con successo")
         flash('Evento salvato con successo.', 'success')
         return redirect(url_for('eventi.lista_eventi'))
         
     except Exception as e:
-        print(f"[EVENTI] Errore durante il salvataggio: {e}")
+        logger.error("[EVENTI] Errore durante il salvataggio: %s", e)
         flash('Errore durante il salvataggio dell\'evento.', 'error')
         return redirect(url_for('eventi.inserisci_evento_form'))
 
@@ -516,18 +668,18 @@ def salva_evento():
 def modifica_evento_form(id):
     """Mostra il form per modificare un evento"""
     
-    print(f'[EVENTI DEBUG] ===== ROUTE MODIFICA CHIAMATA ID={id} =====')
-    print(f'[EVENTI] Accesso a /modifica/{id}')
-    print(f'[EVENTI] User role: {get_user_role()}')
-    print(f'[EVENTI] Is operatore or above: {is_operatore_or_above()}')
+    logger.debug("[EVENTI DEBUG] ===== ROUTE MODIFICA CHIAMATA ID=%s =====", id)
+    logger.debug("[EVENTI] Accesso a /modifica/%s", id)
+    logger.debug("[EVENTI] User role: %s", get_user_role())
+    logger.debug("[EVENTI] Is operatore or above: %s", is_operatore_or_above())
     
     if not is_operatore_or_above():
         flash('Accesso negato. Privilegi insufficienti.', 'error')
-        print('[EVENTI] Accesso negato - privilegi insufficienti')
+        logger.warning("[EVENTI] Accesso negato - privilegi insufficienti")
         return redirect(url_for('main.dashboard'))
     
     try:
-        with get_auth_db_connection() as conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Query per ottenere l'evento da modificare con tipologia_evento
                 cur.execute("""
@@ -551,11 +703,11 @@ def modifica_evento_form(id):
                 cur.execute("""
                     SELECT DISTINCT e.id, e.nome, e.codice, e.indirizzo
                     FROM enti_militari e
-                    WHERE check_ente_comando_logistico(e.id) = true
+                    WHERE e.id = ANY(%s)
                       AND e.nome IS NOT NULL 
                       AND e.nome != ''
                     ORDER BY e.nome
-                """)
+                """, (get_enti_comando_logistico(conn),))
                 enti_militari = cur.fetchall()
                 
                 # Query per tipologie evento
@@ -567,8 +719,8 @@ def modifica_evento_form(id):
                 """)
                 tipologie_evento = cur.fetchall()
                 
-                print(f'[EVENTI] Caricato evento ID {id} per modifica')
-                print(f'[EVENTI] Caricati {len(enti_militari)} enti militari per dropdown')
+                logger.debug("[EVENTI] Caricato evento ID %s per modifica", id)
+                logger.debug("[EVENTI] Caricati %s enti militari per dropdown", len(enti_militari))
                 
                 # Prepara dati protocollo per il template - parsing JSONB con arricchimento dati
                 rife_evento_raw = evento.get('rife_evento')
@@ -582,19 +734,19 @@ def modifica_evento_form(id):
                         elif isinstance(rife_evento_raw, dict):
                             prot_data = rife_evento_raw
                         else:
-                            print(f"[EVENTI] Formato rife_evento non riconosciuto: {type(rife_evento_raw)}")
+                            logger.debug("[EVENTI] Formato rife_evento non riconosciuto: %s", type(rife_evento_raw))
                             prot_data = {}
                     except json.JSONDecodeError as e:
-                        print(f"[EVENTI] Errore parsing JSON rife_evento: {e}")
+                        logger.error("[EVENTI] Errore parsing JSON rife_evento: %s", e)
                         prot_data = {}
                     
                     # Arricchisci i dati dei seguiti con informazioni complete dall'evento
                     if prot_data and 'seguiti_eventi' in prot_data:
-                        print(f"[EVENTI] Elaborazione {len(prot_data['seguiti_eventi'])} seguiti eventi per modifica")
+                        logger.debug("[EVENTI] Elaborazione %s seguiti eventi per modifica", len(prot_data['seguiti_eventi']))
                         for seguito in prot_data['seguiti_eventi']:
                             if 'evento_id' in seguito:
                                 try:
-                                    print(f"[EVENTI] Processing seguito evento_id: {seguito['evento_id']}")
+                                    logger.debug("[EVENTI] Processing seguito evento_id: %s", seguito['evento_id'])
                                     
                                     # Recupera i dati completi dell'evento seguito usando il cursor esistente
                                     cur.execute("""
@@ -612,7 +764,7 @@ def modifica_evento_form(id):
                                     """, (seguito['evento_id'],))
                                     
                                     evento_seguito_data = cur.fetchone()
-                                    print(f"[EVENTI] Dati recuperati dal DB per evento {seguito['evento_id']}: {evento_seguito_data}")
+                                    logger.debug("[EVENTI] Dati recuperati dal DB per evento %s: %s", seguito['evento_id'], evento_seguito_data)
                                     
                                     if evento_seguito_data:
                                         # Arricchisci con i dati dal database
@@ -625,7 +777,7 @@ def modifica_evento_form(id):
                                             else:
                                                 seguito['data_msg_evento'] = 'N/D'
                                         except Exception as date_err:
-                                            print(f"[EVENTI] Errore formattazione data per evento {seguito['evento_id']}: {date_err}")
+                                            logger.error("[EVENTI] Errore formattazione data per evento %s: %s", seguito['evento_id'], date_err)
                                             seguito['data_msg_evento'] = 'N/D'
                                         
                                         seguito['dettagli_evento'] = str(evento_seguito_data['dettagli_evento']) if evento_seguito_data['dettagli_evento'] else 'N/D'
@@ -635,21 +787,21 @@ def modifica_evento_form(id):
                                         seguito['tipologia_descrizione'] = str(evento_seguito_data['tipologia_descrizione']) if evento_seguito_data['tipologia_descrizione'] else 'N/D'
                                         
                                         # Debug per tipologie
-                                        print(f"[EVENTI] Debug tipologia per evento {seguito['evento_id']}:")
-                                        print(f"  - tipologia_nome recuperato: '{evento_seguito_data['tipologia_nome']}'")
-                                        print(f"  - tipologia_descrizione recuperata: '{evento_seguito_data['tipologia_descrizione']}'")
-                                        print(f"  - tipologia_nome impostata: '{seguito['tipologia_nome']}'")
-                                        print(f"  - tipologia_descrizione impostata: '{seguito['tipologia_descrizione']}')")
+                                        logger.debug("[EVENTI] Debug tipologia per evento %s:", seguito['evento_id'])
+                                        logger.debug("  - tipologia_nome recuperato: '%s'", evento_seguito_data['tipologia_nome'])
+                                        logger.debug("  - tipologia_descrizione recuperata: '%s'", evento_seguito_data['tipologia_descrizione'])
+                                        logger.debug("  - tipologia_nome impostata: '%s'", seguito['tipologia_nome'])
+                                        logger.debug("  - tipologia_descrizione impostata: '%s')", seguito['tipologia_descrizione'])
                                         
-                                        print(f"[EVENTI] Evento seguito {seguito['evento_id']} arricchito per modifica")
+                                        logger.debug("[EVENTI] Evento seguito %s arricchito per modifica", seguito['evento_id'])
                                     else:
-                                        print(f"[EVENTI] ATTENZIONE: Evento seguito {seguito['evento_id']} non trovato nel database!")
+                                        logger.warning("[EVENTI] ATTENZIONE: Evento seguito %s non trovato nel database!", seguito['evento_id'])
                                         # Se l'evento non esiste, imposta valori di default
                                         seguito['prot_msg_evento'] = 'EVENTO NON TROVATO'
                                         seguito['data_msg_evento'] = 'N/D'
                                         seguito['dettagli_evento'] = 'Evento collegato non più presente nel sistema'
                                 except Exception as e:
-                                    print(f"[EVENTI] ERRORE recupero dati evento seguito {seguito.get('evento_id')}: {e}")
+                                    logger.error("[EVENTI] ERRORE recupero dati evento seguito %s: %s", seguito.get('evento_id'), e)
                                     # In caso di errore, imposta valori di fallback
                                     seguito['prot_msg_evento'] = 'ERRORE'
                                     seguito['data_msg_evento'] = 'N/D'
@@ -658,7 +810,7 @@ def modifica_evento_form(id):
                     # Prepara la versione JSON per il campo nascosto
                     prot_data_json = json.dumps(prot_data) if prot_data else ''
                 
-                print(f"[EVENTI] prot_data arricchito per modifica: {prot_data}")
+                logger.debug("[EVENTI] prot_data arricchito per modifica: %s", prot_data)
                 
                 return render_template('eventi/modifica_evento.html',
                                      evento=evento,
@@ -669,10 +821,7 @@ def modifica_evento_form(id):
                                      user_role=get_user_role())
                 
     except Exception as e:
-        print(f"[EVENTI] Errore caricamento evento per modifica ID {id}: {e}")
-        print(f"[EVENTI] Tipo errore: {type(e).__name__}")
-        import traceback
-        print(f"[EVENTI] Traceback completo: {traceback.format_exc()}")
+        logger.exception("[EVENTI] Errore caricamento evento per modifica ID %s: %s", id, e)
         flash('Errore nel caricamento dell\'evento.', 'error')
         return redirect(url_for('eventi.lista_eventi'))
 
@@ -686,8 +835,8 @@ def aggiorna_evento(id):
         flash('Accesso negato. Privilegi insufficienti.', 'error')
         return redirect(url_for('main.dashboard'))
     
-    print(f"[EVENTI] Richiesta aggiornamento evento ID {id}")
-    print(f"[EVENTI] Dati ricevuti: {dict(request.form)}")
+    logger.debug("[EVENTI] Richiesta aggiornamento evento ID %s", id)
+    logger.debug("[EVENTI] Dati ricevuti: %s", request.form)
     
     try:
         # Estrai dati dal form
@@ -702,40 +851,40 @@ def aggiorna_evento(id):
         # Validazione e formattazione protocollo a 7 cifre
         prot_msg_evento_clean = ''.join(filter(str.isdigit, prot_msg_evento))
         if not prot_msg_evento_clean.isdigit():
-            print(f"[EVENTI] Errore validazione protocollo: '{prot_msg_evento}' non è numerico")
+            logger.error("[EVENTI] Errore validazione protocollo: '%s' non è numerico", prot_msg_evento)
             flash('Il protocollo messaggio evento deve contenere solo numeri.', 'error')
             return redirect(url_for('eventi.modifica_evento_form', id=id))
         
         prot_msg_evento = prot_msg_evento_clean.zfill(7)  # Applica padding a 7 cifre
-        print(f"[EVENTI] Protocollo formattato: '{prot_msg_evento}'")
+        logger.debug("[EVENTI] Protocollo formattato: '%s'", prot_msg_evento)
         
         data_msg_evento = request.form.get('data_msg_evento')
         seguiti_eventi = request.form.get('seguiti_eventi', '').strip()
         
-        print(f"[EVENTI] Campi estratti per aggiornamento:")
-        print(f"  - ente_id: '{ente_id}' ({'OK' if ente_id else 'VUOTO'})")
-        print(f"  - carattere: '{carattere}' ({'OK' if carattere else 'VUOTO'})")
-        print(f"  - tipo_evento: '{tipo_evento}' ({'OK' if tipo_evento else 'VUOTO'})")
-        print(f"  - data_evento: '{data_evento}' ({'OK' if data_evento else 'VUOTO'})")
-        print(f"  - note: '{note[:50]}...' ({'OK' if note else 'VUOTO'})")
-        print(f"  - prot_msg_evento: '{prot_msg_evento}' ({'OK' if prot_msg_evento else 'VUOTO'})")
-        print(f"  - data_msg_evento: '{data_msg_evento}' ({'OK' if data_msg_evento else 'VUOTO'})")
-        print(f"  - seguiti_eventi: '{seguiti_eventi[:100]}...' ({'OK' if seguiti_eventi else 'VUOTO'})")
+        logger.debug("[EVENTI] Campi estratti per aggiornamento:")
+        logger.debug("  - ente_id: '%s' (%s)", ente_id, 'OK' if ente_id else 'VUOTO')
+        logger.debug("  - carattere: '%s' (%s)", carattere, 'OK' if carattere else 'VUOTO')
+        logger.debug("  - tipo_evento: '%s' (%s)", tipo_evento, 'OK' if tipo_evento else 'VUOTO')
+        logger.debug("  - data_evento: '%s' (%s)", data_evento, 'OK' if data_evento else 'VUOTO')
+        logger.debug("  - note: '%s...' (%s)", note[:50], 'OK' if note else 'VUOTO')
+        logger.debug("  - prot_msg_evento: '%s' (%s)", prot_msg_evento, 'OK' if prot_msg_evento else 'VUOTO')
+        logger.debug("  - data_msg_evento: '%s' (%s)", data_msg_evento, 'OK' if data_msg_evento else 'VUOTO')
+        logger.debug("  - seguiti_eventi: '%s...' (%s)", seguiti_eventi[:100], 'OK' if seguiti_eventi else 'VUOTO')
         
         # Validazione
         campi_obbligatori = [ente_id, carattere, tipo_evento, note, prot_msg_evento, data_msg_evento]
         if not all(campi_obbligatori):
-            print(f"[EVENTI] VALIDAZIONE FALLITA - campi mancanti:")
+            logger.warning("[EVENTI] VALIDAZIONE FALLITA - campi mancanti:")
             for i, campo in enumerate(['ente_id', 'carattere', 'tipo_evento', 'note', 'prot_msg_evento', 'data_msg_evento']):
                 if not campi_obbligatori[i]:
-                    print(f"  - {campo}: MANCANTE")
+                    logger.warning("  - %s: MANCANTE", campo)
             flash('Tutti i campi obbligatori devono essere compilati.', 'error')
             return redirect(url_for('eventi.modifica_evento_form', id=id))
         
-        print("[EVENTI] Validazione superata, procedo con l'aggiornamento database")
+        logger.debug("[EVENTI] Validazione superata, procedo con l'aggiornamento database")
         
         # Aggiorna nel database
-        with get_auth_db_connection() as conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica che l'evento esista
                 cur.execute("SELECT id FROM eventi WHERE id = %s", (id,))
@@ -745,7 +894,7 @@ def aggiorna_evento(id):
                     flash('Evento non trovato.', 'error')
                     return redirect(url_for('eventi.lista_eventi'))
                 
-                print(f"[EVENTI] Evento ID {id} esistente, procedo con aggiornamento")
+                logger.debug("[EVENTI] Evento ID %s esistente, procedo con aggiornamento", id)
                 
                 # Parse dei seguiti eventi JSON 
                 rife_evento_json = None
@@ -753,13 +902,13 @@ def aggiorna_evento(id):
                     try:
                         rife_evento_data = json.loads(seguiti_eventi)
                         rife_evento_json = json.dumps(rife_evento_data)  # Re-stringify per il database
-                        print(f"[EVENTI] Seguiti eventi parsati correttamente: {len(rife_evento_data.get('seguiti_eventi', []))} elementi")
+                        logger.debug("[EVENTI] Seguiti eventi parsati correttamente: %s elementi", len(rife_evento_data.get('seguiti_eventi', [])))
                     except json.JSONDecodeError as json_err:
-                        print(f"[EVENTI] Errore parsing JSON seguiti eventi: {json_err}")
+                        logger.error("[EVENTI] Errore parsing JSON seguiti eventi: %s", json_err)
                         flash('Errore nel formato dei dati seguiti eventi.', 'error')
                         return redirect(url_for('eventi.modifica_evento_form', id=id))
                 else:
-                    print("[EVENTI] Nessun seguito eventi fornito")
+                    logger.debug("[EVENTI] Nessun seguito eventi fornito")
                 
                 # Query di aggiornamento
                 cur.execute("""
@@ -791,14 +940,13 @@ def aggiorna_evento(id):
                 ))
                 
                 conn.commit()
-                print(f"[EVENTI] Evento ID {id} aggiornato con successo")
+                logger.info("[EVENTI] Evento ID %s aggiornato con successo", id)
+                response_cache.invalidate('eventi')
                 flash('Evento aggiornato con successo.', 'success')
                 return redirect(url_for('eventi.visualizza_evento', id=id))
                 
     except Exception as e:
-        print(f"[EVENTI] Errore durante aggiornamento evento ID {id}: {e}")
-        import traceback
-        print(f"[EVENTI] Traceback: {traceback.format_exc()}")
+        logger.exception("[EVENTI] Errore durante aggiornamento evento ID %s: %s", id, e)
         flash('Errore durante l\'aggiornamento dell\'evento.', 'error')
         return redirect(url_for('eventi.modifica_evento_form', id=id))
 
@@ -812,7 +960,7 @@ def elimina_evento(id):
         return redirect(url_for('main.dashboard'))
     
     try:
-        with get_auth_db_connection() as conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica che l'evento esista
                 cur.execute("SELECT id FROM eventi WHERE id = %s", (id,))
@@ -825,18 +973,20 @@ def elimina_evento(id):
                 # Elimina l'evento
                 cur.execute("DELETE FROM eventi WHERE id = %s", (id,))
                 conn.commit()
+                response_cache.invalidate('eventi')
                 
-                print(f"[EVENTI] Evento ID {id} eliminato con successo")
+                logger.info("[EVENTI] Evento ID %s eliminato con successo", id)
                 flash('Evento eliminato con successo.', 'success')
                 return redirect(url_for('eventi.lista_eventi'))
                 
     except Exception as e:
-        print(f"[EVENTI] Errore durante eliminazione evento ID {id}: {e}")
+        logger.error("[EVENTI] Errore durante eliminazione evento ID %s: %s", id, e)
         flash('Errore durante l\'eliminazione dell\'evento.', 'error')
         return redirect(url_for('eventi.lista_eventi'))
 
 @eventi.route('/api/enti-livello1')
 @login_required  
+@response_cache.cached_json('eventi')
 def api_enti_livello1():
     """API per ottenere enti di livello 1 (Comando Logistico + figli diretti) filtrati per tipo evento"""
     
@@ -850,67 +1000,23 @@ def api_enti_livello1():
         tipo_evento = request.args.get('tipo_evento', '')
         carattere_filtro = request.args.get('carattere_filtro', '')
         
-        # Calcola il periodo - AGGIORNATO per usare data_msg_evento
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"data_msg_evento BETWEEN '{start_date}' AND '{end_date}'"
-        else:
-            days_map = {
-                'week': 7,
-                'month': 30,
-                'quarter': 90,
-                'year': 365
-            }
-            days = days_map.get(period, 365)
-            date_filter = f"data_msg_evento >= CURRENT_DATE - INTERVAL '{days} days'"
-        
-        # Costruisci filtri aggiuntivi
-        additional_filters = []
-        if tipo_evento:
-            additional_filters.append(f"e.tipo_evento = '{tipo_evento}'")
-        if carattere_filtro:
-            additional_filters.append(f"e.carattere = '{carattere_filtro}'")
-        
-        where_clause = date_filter
-        if additional_filters:
-            where_clause += " AND " + " AND ".join(additional_filters)
+        # Filtri sul rollup giornaliero (periodo su data_msg_evento)
+        where_rollup, params = eventi_rollup.build_filters(
+            period, start_date, end_date, carattere=carattere_filtro, tipo_evento=tipo_evento
+        )
         
         conn = get_auth_db_connection()
         try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Query CORRETTA per enti di livello 1 con aggregazione ricorsiva
-                cur.execute(f"""
-                    WITH enti_primo_livello AS (
-                        SELECT id, nome FROM enti_militari WHERE parent_id = 1 OR id = 1
-                    ),
-                    eventi_aggregati AS (
-                        SELECT 
-                            CASE 
-                                WHEN em.id = 1 THEN em.id  -- Comando principale stesso
-                                WHEN em.parent_id = 1 THEN em.id  -- Enti diretti
-                                WHEN parent.parent_id = 1 THEN parent.id  -- Nipoti → Padre
-                                WHEN grandparent.parent_id = 1 THEN grandparent.id  -- Pronipoti → Nonno
-                                ELSE em.id 
-                            END as ente_primo_livello_id
-                        FROM eventi e
-                        JOIN enti_militari em ON e.ente_id = em.id
-                        LEFT JOIN enti_militari parent ON em.parent_id = parent.id
-                        LEFT JOIN enti_militari grandparent ON parent.parent_id = grandparent.id
-                        WHERE {where_clause}
-                    )
-                    SELECT 
-                        epl.id,
-                        epl.nome,
-                        COUNT(*) as count
-                    FROM eventi_aggregati ea
-                    JOIN enti_primo_livello epl ON ea.ente_primo_livello_id = epl.id
-                    GROUP BY epl.id, epl.nome
-                    ORDER BY epl.nome
-                """)
-                enti_data = cur.fetchall()
-                
+            # Totali dei figli diretti del Comando principale (sottoalberi interi)
+            nodes = eventi_drilldown.aggrega(conn, ROOT_ENTE_ID, where_rollup, params) or []
         finally:
             conn.close()
         
+        enti_data = sorted(
+            ({'id': node['id'], 'nome': node['nome'], 'count': node['totale']} for node in nodes),
+            key=lambda r: r['nome']
+        )
+        
         if not enti_data:
             return jsonify({
                 'success': True,
@@ -953,11 +1059,12 @@ def api_enti_livello1():
         })
         
     except Exception as e:
-        print(f"[EVENTI] Errore API enti livello 1: {e}")
+        logger.error("[EVENTI] Errore API enti livello 1: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @eventi.route('/api/enti-stacked')
 @login_required
+@response_cache.cached_json('eventi')
 def api_enti_stacked():
     """API per dati stacked per la vista per-ente (Comando Logistico + figli diretti con breakdown per tipo evento)"""
     
@@ -974,167 +1081,75 @@ def api_enti_stacked():
         ente_specifico_nome = request.args.get('ente_specifico_nome')  # Nome ente specifico livello 3
         livello_3 = request.args.get('livello_3') == 'true'  # Flag per livello 3
         
-        # Calcola il periodo
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"e.data_msg_evento BETWEEN '{start_date}' AND '{end_date}'"
-        else:
-            days_map = {
-                'week': 7,
-                'month': 30,
-                'quarter': 90,
-                'year': 365
-            }
-            days = days_map.get(period, 365)
-            date_filter = f"e.data_msg_evento >= CURRENT_DATE - INTERVAL '{days} days'"
+        # Filtri sul rollup giornaliero (periodo su data_msg_evento)
+        where_periodo, params_periodo = eventi_rollup.build_filters(period, start_date, end_date)
+        where_clause, params = eventi_rollup.build_filters(
+            period, start_date, end_date, carattere=carattere_filtro
+        )
         
-        # Aggiungi filtro carattere se presente
-        additional_filters = []
-        if carattere_filtro:
-            additional_filters.append(f"e.carattere = '{carattere_filtro}'")
-        
-        where_clause = date_filter
-        if additional_filters:
-            where_clause += " AND " + " AND ".join(additional_filters)
-        
-        # Converti nome ente in ID se fornito
+        # Converti nome ente in ID se fornito (dall'albero in memoria)
+        tree = enti_hierarchy.get_index()
         if ente_parent_nome and not ente_parent:
-            conn_temp = get_auth_db_connection()
-            try:
-                with conn_temp.cursor() as cur_temp:
-                    cur_temp.execute("SELECT id FROM enti_militari WHERE nome = %s", (ente_parent_nome,))
-                    result = cur_temp.fetchone()
-                    if result:
-                        ente_parent = result[0]
-                        print(f"[EVENTI API STACKED DEBUG] Converted '{ente_parent_nome}' to ID: {ente_parent}")
-                    else:
-                        print(f"[EVENTI API STACKED DEBUG] WARNING: Ente '{ente_parent_nome}' not found")
-            finally:
-                conn_temp.close()
+            ente_parent = tree.id_for_name(ente_parent_nome)
+            if ente_parent is not None:
+                logger.debug("[EVENTI API STACKED DEBUG] Converted '%s' to ID: %s", ente_parent_nome, ente_parent)
+            else:
+                logger.warning("[EVENTI API STACKED DEBUG] WARNING: Ente '%s' not found", ente_parent_nome)
         
         # Converti nome ente specifico per livello 3
         ente_specifico_id = None
         if ente_specifico_nome and livello_3:
-            conn_temp = get_auth_db_connection()
-            try:
-                with conn_temp.cursor() as cur_temp:
-                    cur_temp.execute("SELECT id FROM enti_militari WHERE nome = %s", (ente_specifico_nome,))
-                    result = cur_temp.fetchone()
-                    if result:
-                        ente_specifico_id = result[0]
-                        print(f"[EVENTI API STACKED DEBUG] Level 3 - Converted '{ente_specifico_nome}' to ID: {ente_specifico_id}")
-                    else:
-                        print(f"[EVENTI API STACKED DEBUG] WARNING: Ente specifico '{ente_specifico_nome}' not found")
-            finally:
-                conn_temp.close()
+            ente_specifico_id = tree.id_for_name(ente_specifico_nome)
+            if ente_specifico_id is not None:
+                logger.debug("[EVENTI API STACKED DEBUG] Level 3 - Converted '%s' to ID: %s", ente_specifico_nome, ente_specifico_id)
+            else:
+                logger.warning("[EVENTI API STACKED DEBUG] WARNING: Ente specifico '%s' not found", ente_specifico_nome)
         
         conn = get_auth_db_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Prima controlla se ci sono eventi nel database
-                cur.execute(f"SELECT COUNT(*) as total FROM eventi e WHERE {where_clause}")
+                cur.execute(f"SELECT COALESCE(SUM(r.count), 0) as total FROM eventi_daily_rollup r WHERE {where_clause}", params)
                 total_eventi = cur.fetchone()['total']
-                print(f"[EVENTI API STACKED DEBUG] Total events in period: {total_eventi}")
+                logger.debug("[EVENTI API STACKED DEBUG] Total events in period: %s", total_eventi)
                 
                 if total_eventi == 0:
-                    print(f"[EVENTI API STACKED DEBUG] No events found with filter: {where_clause}")
+                    logger.debug("[EVENTI API STACKED DEBUG] No events found with filter: %s", where_clause)
                     stacked_data = []
                 else:
                     if livello_3 and ente_specifico_id:
                         # Livello 3: mostra tipi evento per ente specifico con aggregazione ricorsiva
-                        print(f"[EVENTI API STACKED DEBUG] Level 3 - Event types for ente: {ente_specifico_id}")
+                        logger.debug("[EVENTI API STACKED DEBUG] Level 3 - Event types for ente: %s", ente_specifico_id)
                         cur.execute(f"""
-                            WITH RECURSIVE gerarchia_ente AS (
-                                SELECT id, nome, parent_id, 0 as livello
-                                FROM enti_militari 
-                                WHERE id = {ente_specifico_id}
-                                
-                                UNION ALL
-                                
-                                SELECT e.id, e.nome, e.parent_id, g.livello + 1
-                                FROM enti_militari e
-                                INNER JOIN gerarchia_ente g ON e.parent_id = g.id
-                            )
                             SELECT 
-                                e.tipo_evento,
-                                COUNT(*) as count
-                            FROM eventi e
-                            INNER JOIN gerarchia_ente g ON e.ente_id = g.id
+                                r.tipo_evento,
+                                SUM(r.count) as count
+                            FROM eventi_daily_rollup r
+                            INNER JOIN enti_militari_closure g
+                                ON g.descendant_id = r.ente_id
+                               AND g.ancestor_id = %s
                             WHERE {where_clause}
-                            GROUP BY e.tipo_evento
-                            ORDER BY e.tipo_evento
-                        """)
-                    elif ente_parent:
-                        # Drill-down livello 1+: mostra ente padre + figli diretti con aggregazione ricorsiva
-                        print(f"[EVENTI API STACKED DEBUG] Drill-down for parent: {ente_parent} (shows parent + children)")
-                        cur.execute(f"""
-                            WITH eventi_aggregati AS (
-                                SELECT 
-                                    CASE 
-                                        WHEN em.id = {ente_parent} THEN em.id  -- Ente padre stesso
-                                        WHEN em.parent_id = {ente_parent} THEN em.id  -- Figli diretti
-                                        WHEN parent.parent_id = {ente_parent} THEN parent.id  -- Nipoti → Padre
-                                        WHEN grandparent.parent_id = {ente_parent} THEN grandparent.id  -- Pronipoti → Nonno
-                                        ELSE NULL
-                                    END as ente_target_id,
-                                    e.tipo_evento
-                                FROM eventi e
-                                JOIN enti_militari em ON e.ente_id = em.id
-                                LEFT JOIN enti_militari parent ON em.parent_id = parent.id
-                                LEFT JOIN enti_militari grandparent ON parent.parent_id = grandparent.id
-                                WHERE {where_clause}
-                                AND (em.id = {ente_parent} OR em.parent_id = {ente_parent} OR parent.parent_id = {ente_parent} OR grandparent.parent_id = {ente_parent})
-                            )
-                            SELECT 
-                                em_target.nome,
-                                ea.tipo_evento,
-                                COUNT(*) as count
-                            FROM eventi_aggregati ea
-                            JOIN enti_militari em_target ON ea.ente_target_id = em_target.id
-                            WHERE ea.ente_target_id IS NOT NULL
-                            GROUP BY em_target.nome, ea.tipo_evento
-                            ORDER BY em_target.nome, ea.tipo_evento
-                        """)
+                            GROUP BY r.tipo_evento
+                            ORDER BY r.tipo_evento
+                        """, [int(ente_specifico_id)] + params)
+                        stacked_data = cur.fetchall()
                     else:
-                        # Query con aggregazione ricorsiva per enti di primo livello (livello 0)
-                        cur.execute(f"""
-                            WITH eventi_aggregati AS (
-                                SELECT 
-                                    CASE 
-                                        WHEN em.id = 1 THEN em.id  -- Comando principale stesso
-                                        WHEN em.parent_id = 1 THEN em.id  -- Enti diretti
-                                        WHEN parent.parent_id = 1 THEN parent.id  -- Nipoti → Padre
-                                        WHEN grandparent.parent_id = 1 THEN grandparent.id  -- Pronipoti → Nonno
-                                        ELSE NULL -- Escludi eventi fuori gerarchia
-                                    END as ente_primo_livello_id,
-                                    e.tipo_evento
-                                FROM eventi e
-                                JOIN enti_militari em ON e.ente_id = em.id
-                                LEFT JOIN enti_militari parent ON em.parent_id = parent.id
-                                LEFT JOIN enti_militari grandparent ON parent.parent_id = grandparent.id
-                                WHERE {where_clause}
-                                AND (em.id = 1 OR em.parent_id = 1 OR parent.parent_id = 1 OR grandparent.parent_id = 1)
-                            )
-                            SELECT 
-                                em_target.nome,
-                                ea.tipo_evento,
-                                COUNT(*) as count
-                            FROM eventi_aggregati ea
-                            JOIN enti_militari em_target ON ea.ente_primo_livello_id = em_target.id
-                            WHERE ea.ente_primo_livello_id IS NOT NULL
-                            GROUP BY em_target.nome, ea.tipo_evento
-                            ORDER BY em_target.nome, ea.tipo_evento
-                        """)
-                stacked_data = cur.fetchall()
+                        # Livello 0 (figli del Comando principale) o drill-down
+                        # livello 1+ (ente padre + figli diretti): totali per
+                        # sottoalbero e tipo evento
+                        root_id = int(ente_parent) if ente_parent else ROOT_ENTE_ID
+                        logger.debug("[EVENTI API STACKED DEBUG] Drill-down for parent: %s (shows parent + children)", root_id)
+                        stacked_data = _righe_stacked(
+                            eventi_drilldown.aggrega(conn, root_id, where_clause, params) or []
+                        )
                 
                 # Debug della query per capire perché i totali sono 0
-                print(f"[EVENTI API STACKED RICORSIVA] Query executed successfully. Raw results count: {len(stacked_data)}")
-                for i, row in enumerate(stacked_data[:5]):  # Prime 5 righe per debug
-                    print(f"[EVENTI API STACKED] Row {i}: {dict(row)}")
-                
-                if stacked_data:
-                    print(f"[EVENTI API STACKED DEBUG] First row example: {dict(stacked_data[0])}")
-                else:
-                    print("[EVENTI API STACKED DEBUG] No stacked_data found")
+                logger.debug("[EVENTI API STACKED RICORSIVA] Query executed successfully. Raw results count: %s", len(stacked_data))
+                if logger.isEnabledFor(logging.DEBUG):
+                    for i, row in enumerate(stacked_data[:5]):  # Prime 5 righe per debug
+                        logger.debug("[EVENTI API STACKED] Row %s: %s", i, row)
+                    if not stacked_data:
+                        logger.debug("[EVENTI API STACKED DEBUG] No stacked_data found")
                 
         finally:
             conn.close()
@@ -1180,65 +1195,7 @@ def api_enti_stacked():
                     'breakdown': {}  # Non serve breakdown per livello 3
                 }
             })
-        else:
-            # Livelli 0-2: dati per enti (comportamento originale)
-            enti_map = {}
-            tipi_evento_trovati = set()
-            
-            # Prima passata: raccoglie tutti i tipi evento trovati e inizializza enti
-            for row in stacked_data:
-                ente_nome = row['nome']
-                tipo_evento = row['tipo_evento']
-                tipi_evento_trovati.add(tipo_evento)
-                
-                if ente_nome not in enti_map:
-                    enti_map[ente_nome] = {}
-        
-        # Usa i tipi evento trovati nel database invece di hardcode
-        tipi_evento = list(tipi_evento_trovati) if tipi_evento_trovati else ['TIPO A', 'TIPO B', 'TIPO C', 'TIPO D', 'TIPO E']
-        
-        # Inizializza tutti gli enti con tutti i tipi evento a 0
-        for ente_nome in enti_map:
-            enti_map[ente_nome] = {tipo: 0 for tipo in tipi_evento}
-        
-        # Popola i dati per tipo evento
-        for row in stacked_data:
-            ente_nome = row['nome']
-            tipo_evento = row['tipo_evento']
-            count = row['count']
-            if ente_nome in enti_map and tipo_evento in enti_map[ente_nome]:
-                enti_map[ente_nome][tipo_evento] = count
-        
-        # Formatta per Chart.js
-        labels = list(enti_map.keys())
-        totals = []
-        breakdown = {}
-        
-        # Colori per gli enti
-        ente_colors = [
-            'rgba(54, 162, 235, 0.8)',   # Blu
-            'rgba(255, 99, 132, 0.8)',   # Rosa
-            'rgba(255, 205, 86, 0.8)',   # Giallo
-            'rgba(75, 192, 192, 0.8)',   # Verde acqua
-            'rgba(153, 102, 255, 0.8)',  # Viola
-            'rgba(255, 159, 64, 0.8)',   # Arancione
-            'rgba(199, 199, 199, 0.8)',  # Grigio
-            'rgba(83, 102, 255, 0.8)'    # Blu scuro
-        ]
-        
-        backgroundColor = []
-        
-        for i, (ente_nome, tipo_counts) in enumerate(enti_map.items()):
-            # Calcola totale per questo ente
-            totale_ente = sum(tipo_counts.values())
-            totals.append(totale_ente)
-            
-            # Breakdown per tipo evento
-            breakdown[ente_nome] = tipo_counts
-            
-            # Colore per questo ente
-            color_index = i % len(ente_colors)
-            backgroundColor.append(ente_colors[color_index])
+        labels, totals, backgroundColor, breakdown, tipi_evento = _formatta_stacked_enti(stacked_data)
         
         # Statistiche aggregate
         total_events = sum(totals)
@@ -1250,18 +1207,17 @@ def api_enti_stacked():
         
         if not carattere_filtro:
             # Query separata per carattere solo se non è già filtrato
-            with get_auth_db_connection() as conn_stats:
+            with db_connection() as conn_stats:
                 with conn_stats.cursor(cursor_factory=RealDictCursor) as cur:
                     cur.execute(f"""
-                        SELECT carattere, COUNT(*) as count
-                        FROM eventi e
-                        JOIN enti_militari em ON e.ente_id = em.id
-                        LEFT JOIN enti_militari parent ON em.parent_id = parent.id
-                        LEFT JOIN enti_militari grandparent ON parent.parent_id = grandparent.id
-                        WHERE {date_filter}
-                        AND (em.id = 1 OR em.parent_id = 1 OR parent.parent_id = 1 OR grandparent.parent_id = 1)
-                        GROUP BY carattere
-                    """)
+                        SELECT r.carattere, SUM(r.count) as count
+                        FROM eventi_daily_rollup r
+                        INNER JOIN enti_militari_closure g
+                            ON g.descendant_id = r.ente_id
+                           AND g.ancestor_id = %s
+                        WHERE {where_periodo}
+                        GROUP BY r.carattere
+                    """, [ROOT_ENTE_ID] + params_periodo)
                     carattere_data = cur.fetchall()
                     
                     for row in carattere_data:
@@ -1279,12 +1235,12 @@ def api_enti_stacked():
         }
         
         # Debug logging per verificare dati
-        print(f"[EVENTI API STACKED] Raw data count: {len(stacked_data)}")
-        print(f"[EVENTI API STACKED] Labels: {labels}")
-        print(f"[EVENTI API STACKED] Totals: {totals}")
-        print(f"[EVENTI API STACKED] Stats: {stats}")
-        print(f"[EVENTI API STACKED] Breakdown keys: {list(breakdown.keys()) if breakdown else 'None'}")
-        print(f"[EVENTI API STACKED] Date filter used: {where_clause}")
+        logger.debug("[EVENTI API STACKED] Raw data count: %s", len(stacked_data))
+        logger.debug("[EVENTI API STACKED] Labels: %s", labels)
+        logger.debug("[EVENTI API STACKED] Totals: %s", totals)
+        logger.debug("[EVENTI API STACKED] Stats: %s", stats)
+        logger.debug("[EVENTI API STACKED] Breakdown keys: %s", list(breakdown.keys()) if breakdown else 'None')
+        logger.debug("[EVENTI API STACKED] Date filter used: %s", where_clause)
         
         return jsonify({
             'success': True,
@@ -1298,11 +1254,12 @@ def api_enti_stacked():
         })
         
     except Exception as e:
-        print(f"[EVENTI] Errore API enti stacked: {e}")
+        logger.error("[EVENTI] Errore API enti stacked: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @eventi.route('/api/enti-livello2')
 @login_required  
+@response_cache.cached_json('eventi')
 def api_enti_livello2():
     """API per ottenere tutti gli enti dipendenti (ricorsivi) dall'ente di livello 1 selezionato"""
     
@@ -1320,68 +1277,33 @@ def api_enti_livello2():
         if not ente_parent:
             return jsonify({'error': 'Parametro ente_parent richiesto'}), 400
         
-        # Calcola il periodo - AGGIORNATO per usare data_msg_evento
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"data_msg_evento BETWEEN '{start_date}' AND '{end_date}'"
-        else:
-            days_map = {
-                'week': 7,
-                'month': 30,
-                'quarter': 90,
-                'year': 365
-            }
-            days = days_map.get(period, 365)
-            date_filter = f"data_msg_evento >= CURRENT_DATE - INTERVAL '{days} days'"
+        # Filtri sul rollup giornaliero (periodo su data_msg_evento)
+        where_rollup, params = eventi_rollup.build_filters(
+            period, start_date, end_date, carattere=carattere_filtro, tipo_evento=tipo_evento
+        )
         
-        # Costruisci filtri aggiuntivi
-        additional_filters = []
-        if tipo_evento:
-            additional_filters.append(f"e.tipo_evento = '{tipo_evento}'")
-        if carattere_filtro:
-            additional_filters.append(f"e.carattere = '{carattere_filtro}'")
-        
-        where_clause = date_filter
-        if additional_filters:
-            where_clause += " AND " + " AND ".join(additional_filters)
+        # ID dell'ente parent dal nome (albero in memoria)
+        parent_id = enti_hierarchy.get_index().id_for_name(ente_parent)
+        if parent_id is None:
+            return jsonify({'error': f'Ente parent "{ente_parent}" non trovato'}), 404
         
         conn = get_auth_db_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Prima ottieni l'ID dell'ente parent dal nome
-                cur.execute("SELECT id FROM enti_militari WHERE nome = %s", (ente_parent,))
-                parent_result = cur.fetchone()
-                
-                if not parent_result:
-                    return jsonify({'error': f'Ente parent "{ente_parent}" non trovato'}), 404
-                
-                parent_id = parent_result['id']
-                
-                # Query ricorsiva per tutti gli enti dipendenti
+                # Tutti gli enti dipendenti (ente compreso) con eventi nel periodo
                 cur.execute(f"""
-                    WITH RECURSIVE gerarchia_enti AS (
-                        -- Caso base: ente selezionato
-                        SELECT id, nome, parent_id, 0 as livello_rel
-                        FROM enti_militari 
-                        WHERE id = %s
-                        
-                        UNION ALL
-                        
-                        -- Caso ricorsivo: tutti gli enti dipendenti
-                        SELECT em.id, em.nome, em.parent_id, g.livello_rel + 1
-                        FROM enti_militari em
-                        INNER JOIN gerarchia_enti g ON em.parent_id = g.id
-                    )
                     SELECT 
                         g.id,
                         g.nome,
-                        g.livello_rel,
-                        COUNT(e.id) as count
-                    FROM gerarchia_enti g
-                    LEFT JOIN eventi e ON e.ente_id = g.id AND {where_clause}
-                    GROUP BY g.id, g.nome, g.livello_rel
-                    HAVING COUNT(e.id) > 0  -- Solo enti con eventi
+                        c.depth as livello_rel,
+                        SUM(r.count) as count
+                    FROM enti_militari_closure c
+                    JOIN enti_militari g ON g.id = c.descendant_id
+                    JOIN eventi_daily_rollup r ON r.ente_id = g.id
+                    WHERE c.ancestor_id = %s AND {where_rollup}
+                    GROUP BY g.id, g.nome, c.depth
                     ORDER BY g.nome
-                """, (parent_id,))
+                """, [parent_id] + params)
                 enti_data = cur.fetchall()
                 
         finally:
@@ -1434,9 +1356,144 @@ def api_enti_livello2():
         })
         
     except Exception as e:
-        print(f"[EVENTI] Errore API enti livello 2: {e}")
+        logger.error("[EVENTI] Errore API enti livello 2: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@eventi.route('/api/drill/<int:ente_id>')
+@login_required
+@response_cache.cached_json('eventi')
+def api_drill_ente(ente_id):
+    """
+    API drill-down per id a qualsiasi profondità: totali dei sottoalberi a
+    `depth` livelli sotto l'ente, per tipo evento e carattere (una query).
+    Per scendere di livello si richiama con l'id di uno dei nodi restituiti.
+    """
+    if not is_operatore_or_above():
+        return jsonify({'error': 'Accesso negato'}), 403
+    
+    depth = request.args.get('depth', 1, type=int)
+    if depth is None or not 1 <= depth <= eventi_drilldown.MAX_DEPTH:
+        return jsonify({'error': f'depth deve essere tra 1 e {eventi_drilldown.MAX_DEPTH}'}), 400
+    
+    try:
+        where_rollup, params = eventi_rollup.build_filters(
+            request.args.get('period', 'year'),
+            request.args.get('start_date'),
+            request.args.get('end_date'),
+            carattere=request.args.get('carattere') or None,
+            tipo_evento=request.args.get('tipo_evento') or None
+        )
+    except ValueError:
+        return jsonify({'error': 'Date non valide (formato AAAA-MM-GG)'}), 400
+    
+    try:
+        conn = get_auth_db_connection()
+        try:
+            nodes = eventi_drilldown.aggrega(conn, ente_id, where_rollup, params, depth)
+        finally:
+            conn.close()
+        
+        if nodes is None:
+            return jsonify({'error': f'Ente {ente_id} non trovato'}), 404
+        
+        # Percorso radice -> ente per la navigazione a ritroso
+        tree = enti_hierarchy.get_index()
+        percorso = [
+            {'id': antenato, 'nome': tree.name(antenato)}
+            for antenato in (tree.ancestor_at(ente_id, level) for level in range(tree.depth(ente_id) + 1))
+        ]
+        
+        return jsonify({
+            'success': True,
+            'ente': {
+                'id': ente_id,
+                'nome': tree.name(ente_id),
+                'parent_id': tree.parents.get(ente_id),
+                'percorso': percorso
+            },
+            'depth': depth,
+            'totale': sum(node['totale'] for node in nodes),
+            'nodes': nodes
+        })
+        
+    except Exception as e:
+        logger.error("[EVENTI] Errore API drill ente %s: %s", ente_id, e)
         return jsonify({'error': str(e)}), 500
 
+@eventi.route('/api/serie')
+@login_required
+@response_cache.cached_json('eventi')
+def api_eventi_serie():
+    """
+    API serie temporale eventi del Comando Logistico per giorno/settimana/mese
+    (intervalli senza eventi a 0), facoltativamente per tipo evento, carattere
+    o ente di primo livello. Legge il rollup giornaliero.
+    """
+    if not is_operatore_or_above():
+        return jsonify({'error': 'Accesso negato'}), 403
+    
+    period = request.args.get('period', 'year')
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    granularita = request.args.get('granularita', 'month')
+    group_by = request.args.get('group_by', '')
+    
+    gruppi = {'': None, 'tipo_evento': 'r.tipo_evento', 'carattere': 'r.carattere', 'ente': None}
+    if group_by not in gruppi:
+        return jsonify({'error': f"group_by non supportato: {group_by}"}), 400
+    
+    try:
+        dal, al = eventi_rollup.resolve_period(period, start_date, end_date)
+        where_rollup, params = eventi_rollup.build_filters(
+            period, start_date, end_date,
+            carattere=request.args.get('carattere') or None,
+            tipo_evento=request.args.get('tipo_evento') or None
+        )
+    except ValueError:
+        return jsonify({'error': 'Date non valide (formato AAAA-MM-GG)'}), 400
+    al = al or datetime.now().date()
+    
+    tree = enti_hierarchy.get_index()
+    try:
+        conn = get_auth_db_connection()
+        try:
+            risultato = serie_temporali.serie(
+                conn,
+                sorgente='eventi_daily_rollup r JOIN enti_militari_closure g ON g.descendant_id = r.ente_id',
+                colonna_data='r.day',
+                misura='SUM(r.count)',
+                where=f'g.ancestor_id = %s AND {where_rollup}',
+                params=[ROOT_ENTE_ID] + params,
+                dal=dal, al=al, granularita=granularita,
+                gruppo=gruppi[group_by],
+                colonna_ente='r.ente_id',
+                mappa_enti=serie_temporali.mappa_primo_livello(tree, ROOT_ENTE_ID) if group_by == 'ente' else None
+            )
+        finally:
+            conn.close()
+    except serie_temporali.SerieNonValida as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error("[EVENTI] Errore API serie: %s", e)
+        return jsonify({'error': str(e)}), 500
+    
+    for s in risultato['series']:
+        if group_by == 'ente':
+            s['label'] = tree.name(s['gruppo'])
+        elif group_by == 'tipo_evento' and s['gruppo']:
+            s['label'] = s['gruppo'].upper().replace('_', ' ')
+        else:
+            s['label'] = s['gruppo'] or 'N/D'
+    
+    return jsonify({
+        'success': True,
+        'granularita': granularita,
+        'dal': dal.isoformat(),
+        'al': al.isoformat(),
+        'labels': risultato['labels'],
+        'series': risultato['series']
+    })
+
 @eventi.route('/api/enti-comando-logistico')
 @login_required
 def api_enti_comando_logistico():
@@ -1454,9 +1511,9 @@ def api_enti_comando_logistico():
                 cur.execute("""
                     SELECT id, nome, codice
                     FROM enti_militari 
-                    WHERE check_ente_comando_logistico(id) = true
+                    WHERE id = ANY(%s)
                     ORDER BY nome
-                """)
+                """, (get_enti_comando_logistico(conn),))
                 enti = cur.fetchall()
                 
         finally:
@@ -1469,7 +1526,7 @@ def api_enti_comando_logistico():
         } for ente in enti])
         
     except Exception as e:
-        print(f"[EVENTI] Errore API enti: {e}")
+        logger.error("[EVENTI] Errore API enti: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # Registrazione gestori errore specifici per il blueprint
@@ -1480,6 +1537,7 @@ def not_found_error(error):
 
 @eventi.route('/api/categorie')
 @login_required
+@response_cache.cached_json('eventi')
 def api_eventi_categorie():
     """API LIVELLO 0: Categorie eventi del Comando Logistico dell'Esercito (Tipo A, B, C, D, E)"""
     if not is_operatore_or_above():
@@ -1490,23 +1548,14 @@ def api_eventi_categorie():
     end_date = request.args.get('end_date', '')
     carattere_filter = request.args.get('carattere', '')
     
-    print(f"[EVENTI API] /api/categorie - Livello 0: Comando Logistico - carattere_filter={carattere_filter}")
+    logger.debug("[EVENTI API] /api/categorie - Livello 0: Comando Logistico - carattere_filter=%s", carattere_filter)
     
     try:
-        # Calcola il filtro temporale
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"e.data_msg_evento BETWEEN '{start_date}' AND '{end_date}'"
-        else:
-            days_map = {'week': 7, 'month': 30, 'quarter': 90, 'year': 365}
-            days = days_map.get(period, 365)
-            date_filter = f"e.data_msg_evento >= CURRENT_DATE - INTERVAL '{days} days'"
-        
-        # Costruisci condizioni WHERE
-        where_conditions = [date_filter]
-        if carattere_filter and carattere_filter in ['positivo', 'negativo']:
-            where_conditions.append(f"e.carattere = '{carattere_filter}'")
-        
-        where_clause = ' AND '.join(where_conditions)
+        # Filtri sul rollup giornaliero
+        where_clause, params = eventi_rollup.build_filters(
+            period, start_date, end_date,
+            carattere=carattere_filter if carattere_filter in ('positivo', 'negativo') else None
+        )
         
         conn = get_auth_db_connection()
         try:
@@ -1514,14 +1563,13 @@ def api_eventi_categorie():
                 # LIVELLO 0: Categorie eventi aggregate per tutto il Comando Logistico
                 cur.execute(f"""
                     SELECT 
-                        e.tipo_evento as categoria,
-                        COUNT(*) as count
-                    FROM eventi e
-                    JOIN enti_militari em ON e.ente_id = em.id
+                        r.tipo_evento as categoria,
+                        SUM(r.count) as count
+                    FROM eventi_daily_rollup r
                     WHERE {where_clause}
-                    GROUP BY e.tipo_evento
-                    ORDER BY e.tipo_evento
-                """)
+                    GROUP BY r.tipo_evento
+                    ORDER BY r.tipo_evento
+                """, params)
                 results = cur.fetchall()
                 
         finally:
@@ -1538,7 +1586,7 @@ def api_eventi_categorie():
         labels = [format_tipo_evento(row['categoria']) for row in results]
         values = [row['count'] for row in results]
         
-        print(f"[EVENTI API] Livello 0 - Trovati {len(results)} tipi evento: {labels}")
+        logger.debug("[EVENTI API] Livello 0 - Trovati %s tipi evento: %s", len(results), labels)
         
         return jsonify({
             'success': True,
@@ -1549,7 +1597,7 @@ def api_eventi_categorie():
         })
         
     except Exception as e:
-        print(f"[EVENTI] Errore API categorie livello 0: {e}")
+        logger.error("[EVENTI] Errore API categorie livello 0: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @eventi.route('/api/sottocategorie')
@@ -1564,6 +1612,7 @@ def api_eventi_sottocategorie():
 
 @eventi.route('/api/enti')
 @login_required  
+@response_cache.cached_json('eventi')
 def api_eventi_enti():
     """API MULTILIVELLO: Gestisce livelli 1, 2, 3 del drill-down gerarchico con categorie eventi per livello"""
     if not is_operatore_or_above():
@@ -1579,7 +1628,7 @@ def api_eventi_enti():
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
     
-    print(f"[EVENTI API] /api/enti - Livello {level}: categoria={categoria_selezionata}, carattere_filtro={carattere_filtro}, ente_primo={ente_primo_livello}, ente_secondo={ente_secondo_livello}")
+    logger.debug("[EVENTI API] /api/enti - Livello %s: categoria=%s, carattere_filtro=%s, ente_primo=%s, ente_secondo=%s", level, categoria_selezionata, carattere_filtro, ente_primo_livello, ente_secondo_livello)
     
     # Converti categoria formattata ("Tipo A") a formato database ("tipo_a")
     def unformat_tipo_evento(tipo_formatted):
@@ -1591,123 +1640,43 @@ def api_eventi_enti():
     tipo_evento_db = unformat_tipo_evento(categoria_selezionata) if categoria_selezionata else None
     
     try:
-        # Calcola il filtro temporale
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"e.data_msg_evento BETWEEN '{start_date}' AND '{end_date}'"
+        # Filtri sul rollup giornaliero
+        where_rollup, params = eventi_rollup.build_filters(
+            period, start_date, end_date,
+            carattere=carattere_filtro if carattere_filtro in ('positivo', 'negativo') else None,
+            tipo_evento=tipo_evento_db
+        )
+        
+        # Radice del livello: il Comando principale, poi l'ente selezionato
+        # al livello precedente (nome -> id dall'albero in memoria)
+        tree = enti_hierarchy.get_index()
+        if level == '1':
+            root_id = ROOT_ENTE_ID
+        elif level == '2' and ente_primo_livello:
+            root_id = tree.id_for_name(ente_primo_livello)
+        elif level == '3' and ente_secondo_livello:
+            root_id = tree.id_for_name(ente_secondo_livello)
         else:
-            days_map = {'week': 7, 'month': 30, 'quarter': 90, 'year': 365}
-            days = days_map.get(period, 365)
-            date_filter = f"e.data_msg_evento >= CURRENT_DATE - INTERVAL '{days} days'"
+            return jsonify({'error': f'Livello {level} non supportato o parametri mancanti'}), 400
+        logger.debug("[EVENTI API] Livello %s - Sottoalberi di %s per tipo %s", level, root_id, tipo_evento_db)
         
-        conn = get_auth_db_connection()
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # Costruisci condizioni WHERE base
-                where_conditions = [date_filter]
-                params = []
-                
-                if tipo_evento_db:
-                    where_conditions.append("e.tipo_evento = %s")
-                    params.append(tipo_evento_db)
-                
-                if carattere_filtro and carattere_filtro in ['positivo', 'negativo']:
-                    where_conditions.append("e.carattere = %s")
-                    params.append(carattere_filtro)
-                
-                where_clause = " AND ".join(where_conditions)
-                
-                if level == '1':
-                    # LIVELLO 1: Categorie eventi aggregate per Enti primo livello
-                    # Mostra gli enti primi livello che hanno eventi del tipo selezionato
-                    print(f"[EVENTI API] Livello 1 - Enti primo livello per tipo {tipo_evento_db}")
-                    cur.execute(f"""
-                        WITH enti_primo_livello AS (
-                            SELECT id, nome FROM enti_militari WHERE parent_id = 1 OR id = 1
-                        ),
-                        eventi_aggregati AS (
-                            SELECT 
-                                CASE 
-                                    WHEN em.id = 1 THEN em.id  -- Comando principale stesso
-                                    WHEN em.parent_id = 1 THEN em.id  -- Ente primo livello diretto
-                                    WHEN parent.parent_id = 1 THEN parent.id  -- Padre è primo livello
-                                    WHEN grandparent.parent_id = 1 THEN grandparent.id  -- Nonno è primo livello
-                                    ELSE em.id 
-                                END as ente_primo_livello_id
-                            FROM eventi e
-                            JOIN enti_militari em ON e.ente_id = em.id
-                            LEFT JOIN enti_militari parent ON em.parent_id = parent.id
-                            LEFT JOIN enti_militari grandparent ON parent.parent_id = grandparent.id
-                            WHERE {where_clause}
-                        )
-                        SELECT 
-                            epl.nome as ente,
-                            COUNT(*) as count
-                        FROM eventi_aggregati ea
-                        JOIN enti_primo_livello epl ON ea.ente_primo_livello_id = epl.id
-                        GROUP BY epl.id, epl.nome
-                        ORDER BY epl.nome
-                    """, params)
-                    
-                elif level == '2' and ente_primo_livello:
-                    # LIVELLO 2: Categorie eventi per Enti secondo livello dell'ente primo selezionato
-                    # Mostra gli enti secondo livello (figli dell'ente primo) che hanno eventi del tipo selezionato
-                    print(f"[EVENTI API] Livello 2 - Enti secondo livello per {ente_primo_livello}")
-                    cur.execute(f"""
-                        WITH ente_primo AS (
-                            SELECT id FROM enti_militari WHERE nome = %s AND parent_id = 1
-                        )
-                        SELECT 
-                            em.nome as ente,
-                            COUNT(*) as count
-                        FROM eventi e
-                        JOIN enti_militari em ON e.ente_id = em.id
-                        WHERE {where_clause} 
-                        AND (
-                            em.parent_id = (SELECT id FROM ente_primo) OR
-                            EXISTS (
-                                SELECT 1 FROM enti_militari parent 
-                                WHERE parent.id = em.parent_id 
-                                AND parent.parent_id = (SELECT id FROM ente_primo)
-                            )
-                        )
-                        GROUP BY em.id, em.nome
-                        ORDER BY em.nome
-                    """, params + [ente_primo_livello])
-                    
-                elif level == '3' and ente_secondo_livello:
-                    # LIVELLO 3: Categorie eventi per Enti terzo livello dell'ente secondo selezionato
-                    # Mostra gli enti terzo livello (figli dell'ente secondo) che hanno eventi del tipo selezionato
-                    print(f"[EVENTI API] Livello 3 - Enti terzo livello per {ente_secondo_livello}")
-                    cur.execute(f"""
-                        WITH ente_secondo AS (
-                            SELECT id FROM enti_militari WHERE nome = %s
-                        )
-                        SELECT 
-                            em.nome as ente,
-                            COUNT(*) as count
-                        FROM eventi e
-                        JOIN enti_militari em ON e.ente_id = em.id
-                        WHERE {where_clause} 
-                        AND (
-                            em.id = (SELECT id FROM ente_secondo) OR
-                            em.parent_id = (SELECT id FROM ente_secondo)
-                        )
-                        GROUP BY em.id, em.nome
-                        ORDER BY em.nome
-                    """, params + [ente_secondo_livello])
-                else:
-                    return jsonify({'error': f'Livello {level} non supportato o parametri mancanti'}), 400
-                    
-                results = cur.fetchall()
-                
-        finally:
-            conn.close()
+        nodes = []
+        if root_id is not None:
+            conn = get_auth_db_connection()
+            try:
+                nodes = eventi_drilldown.aggrega(conn, root_id, where_rollup, params) or []
+            finally:
+                conn.close()
+        results = sorted(
+            ({'ente': node['nome'], 'count': node['totale']} for node in nodes),
+            key=lambda r: r['ente']
+        )
             
         # Prepara risposta
         labels = [row['ente'] for row in results]
         values = [row['count'] for row in results]
         
-        print(f"[EVENTI API] Livello {level} - Trovati {len(results)} enti: {labels}")
+        logger.debug("[EVENTI API] Livello %s - Trovati %s enti: %s", level, len(results), labels)
         
         return jsonify({
             'success': True,
@@ -1718,11 +1687,101 @@ def api_eventi_enti():
         })
         
     except Exception as e:
-        print(f"[EVENTI] Errore API enti livello {level}: {e}")
+        logger.error("[EVENTI] Errore API enti livello %s: %s", level, e)
         return jsonify({'error': str(e)}), 500
 
+# ===========================================
+# DETTAGLI EVENTI (lista ed export)
+# ===========================================
+
+# Colonne della lista di dettaglio, nell'ordine dell'export CSV
+DETTAGLI_CAMPI = (
+    'id', 'data_evento', 'data_msg_evento', 'prot_msg_evento', 'carattere',
+    'tipo_evento', 'ente_nome', 'tipologia_nome', 'tipologia_descrizione',
+    'rife_evento', 'note', 'creato_da'
+)
+
+# Righe lette dal server per ogni round-trip del cursore di export
+EXPORT_ITERSIZE = int(os.environ.get('TALON_EXPORT_ITERSIZE', '2000'))
+
+def _query_dettagli(level, ente_nome, carattere, tipo_evento, period, start_date, end_date):
+    """
+    Query (senza LIMIT) e parametri della lista eventi per i filtri del
+    drill-down. Al livello 2 con un ente include tutti gli enti dipendenti
+    (closure table). None se l'ente del livello 2 non esiste; ValueError
+    per date non valide.
+    """
+    dal, al = eventi_rollup.resolve_period(period, start_date, end_date, default='month')
+    where_conditions = ['e.data_msg_evento >= %s']
+    params = [dal]
+    if al is not None:
+        where_conditions.append('e.data_msg_evento <= %s')
+        params.append(al)
+    if carattere:
+        where_conditions.append('e.carattere = %s')
+        params.append(carattere)
+    if tipo_evento:
+        where_conditions.append('e.tipo_evento = %s')
+        params.append(tipo_evento)
+
+    join_gerarchia = ''
+    if level == '2' and ente_nome:
+        # ID dell'ente parent dal nome (albero in memoria)
+        parent_id = enti_hierarchy.get_index().id_for_name(ente_nome)
+        if parent_id is None:
+            return None
+        join_gerarchia = (
+            "JOIN enti_militari_closure g ON g.descendant_id = em.id AND g.ancestor_id = %s"
+        )
+        params.insert(0, parent_id)
+    elif ente_nome:
+        where_conditions.append('em.nome = %s')
+        params.append(ente_nome)
+
+    sql = f"""
+        SELECT
+            e.id,
+            e.data_evento,
+            e.data_msg_evento,
+            e.prot_msg_evento,
+            e.carattere,
+            e.tipo_evento,
+            e.rife_evento,
+            e.note,
+            em.nome as ente_nome,
+            te.nome as tipologia_nome,
+            te.descrizione as tipologia_descrizione,
+            u.nome || ' ' || u.cognome as creato_da_nome
+        FROM eventi e
+        JOIN enti_militari em ON e.ente_id = em.id
+        {join_gerarchia}
+        LEFT JOIN tipologia_evento te ON e.tipologia_evento_id = te.id
+        LEFT JOIN utenti u ON e.creato_da = u.id
+        WHERE {' AND '.join(where_conditions)}
+        ORDER BY e.data_msg_evento DESC, e.id DESC
+    """
+    return sql, params
+
+def _formatta_dettaglio(row):
+    """Riga di dettaglio evento per la lista e per l'export"""
+    return {
+        'id': row['id'],
+        'data_evento': row['data_evento'].strftime('%d/%m/%Y') if row['data_evento'] else '',
+        'data_msg_evento': row['data_msg_evento'].strftime('%d/%m/%Y') if row['data_msg_evento'] else '',
+        'prot_msg_evento': row['prot_msg_evento'] or '',
+        'carattere': row['carattere'],
+        'tipo_evento': row['tipo_evento'],
+        'ente_nome': row['ente_nome'],
+        'tipologia_nome': row['tipologia_nome'] or '',
+        'tipologia_descrizione': row['tipologia_descrizione'] or '',
+        'rife_evento': row['rife_evento'],
+        'note': row['note'] or '',
+        'creato_da': row['creato_da_nome'] or 'N/D'
+    }
+
 @eventi.route('/api/dettagli')
 @login_required
+@response_cache.cached_json('eventi', default_period='month')
 def api_eventi_dettagli():
     """API per ottenere i dettagli degli eventi di un ente"""
     if not is_operatore_or_above():
@@ -1738,148 +1797,24 @@ def api_eventi_dettagli():
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
     
-    print(f"[EVENTI API] Dettagli richiesti con parametri:")
-    print(f"  - ente: '{ente_nome}'")
-    print(f"  - carattere_filter: '{carattere_filter}'") 
-    print(f"  - sottocategoria (tipo_evento): '{tipo_evento}'")
-    print(f"  - level: '{level}'")
-    print(f"  - period: '{period}'")
-    print(f"  - start_date: '{start_date}'")
-    print(f"  - end_date: '{end_date}'")
-    
+    logger.debug("[EVENTI API] Dettagli: ente='%s' livello=%s carattere='%s' tipo='%s' periodo=%s %s..%s", ente_nome, level, carattere_filter, tipo_evento, period, start_date, end_date)
+
     try:
-        # Calcola il filtro temporale - AGGIORNATO per usare data_msg_evento
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"e.data_msg_evento BETWEEN '{start_date}' AND '{end_date}'"
-        else:
-            days_map = {'week': 7, 'month': 30, 'quarter': 90, 'year': 365}
-            days = days_map.get(period, 30)
-            date_filter = f"e.data_msg_evento >= CURRENT_DATE - INTERVAL '{days} days'"
-        
+        try:
+            query = _query_dettagli(level, ente_nome, carattere_filter, tipo_evento,
+                                    period, start_date, end_date)
+        except ValueError:
+            return jsonify({'error': 'Date non valide (formato AAAA-MM-GG)'}), 400
+        if query is None:
+            return jsonify({'error': f'Ente parent "{ente_nome}" non trovato'}), 404
+        sql, params = query
+
         conn = get_auth_db_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                
-                # Al livello 2, usa query ricorsiva come enti-livello2 per includere enti dipendenti
-                if level == '2' and ente_nome:
-                    print(f"[EVENTI API] Livello 2 rilevato - usando query ricorsiva per ente: {ente_nome}")
-                    
-                    # Prima ottieni l'ID dell'ente parent dal nome
-                    cur.execute("SELECT id FROM enti_militari WHERE nome = %s", (ente_nome,))
-                    parent_result = cur.fetchone()
-                    
-                    if not parent_result:
-                        return jsonify({'error': f'Ente parent "{ente_nome}" non trovato'}), 404
-                    
-                    parent_id = parent_result['id']
-                    
-                    # Costruisci filtri aggiuntivi per la query ricorsiva
-                    additional_filters = []
-                    recursive_params = [parent_id]
-                    
-                    if carattere_filter:
-                        additional_filters.append("e.carattere = %s")
-                        recursive_params.append(carattere_filter)
-                    if tipo_evento:
-                        additional_filters.append("e.tipo_evento = %s")
-                        recursive_params.append(tipo_evento)
-                    
-                    where_clause_recursive = date_filter
-                    if additional_filters:
-                        where_clause_recursive += " AND " + " AND ".join(additional_filters)
-                    
-                    # Query ricorsiva per ottenere tutti gli eventi degli enti dipendenti
-                    cur.execute(f"""
-                        WITH RECURSIVE gerarchia_enti AS (
-                            -- Caso base: ente selezionato
-                            SELECT id, nome, parent_id, 0 as livello_rel
-                            FROM enti_militari 
-                            WHERE id = %s
-                            
-                            UNION ALL
-                            
-                            -- Caso ricorsivo: tutti gli enti dipendenti
-                            SELECT em.id, em.nome, em.parent_id, g.livello_rel + 1
-                            FROM enti_militari em
-                            INNER JOIN gerarchia_enti g ON em.parent_id = g.id
-                        )
-                        SELECT 
-                            e.id,
-                            e.data_evento,
-                            e.data_msg_evento,
-                            e.prot_msg_evento,
-                            e.carattere,
-                            e.tipo_evento,
-                            e.rife_evento,
-                            e.note,
-                            em.nome as ente_nome,
-                            te.nome as tipologia_nome,
-                            te.descrizione as tipologia_descrizione,
-                            u.nome || ' ' || u.cognome as creato_da_nome
-                        FROM eventi e
-                        JOIN enti_militari em ON e.ente_id = em.id
-                        JOIN gerarchia_enti g ON em.id = g.id  -- Include solo enti nella gerarchia
-                        LEFT JOIN tipologia_evento te ON e.tipologia_evento_id = te.id
-                        LEFT JOIN utenti u ON e.creato_da = u.id
-                        WHERE {where_clause_recursive}
-                        ORDER BY e.data_msg_evento DESC, e.id DESC
-                        LIMIT 1000
-                    """, recursive_params)
-                    
-                else:
-                    # Livelli 0, 1, 3+ - usa query standard (non ricorsiva)
-                    print(f"[EVENTI API] Livello {level} - usando query standard")
-                    
-                    where_conditions = [date_filter]
-                    params = []
-                    
-                    if carattere_filter:
-                        where_conditions.append("e.carattere = %s")
-                        params.append(carattere_filter)
-                    if tipo_evento:
-                        where_conditions.append("e.tipo_evento = %s")
-                        params.append(tipo_evento)
-                    if ente_nome:
-                        where_conditions.append("em.nome = %s")
-                        params.append(ente_nome)
-                    
-                    where_clause = " AND ".join(where_conditions)
-                
-                    print(f"[EVENTI API] Esecuzione query standard con WHERE: {where_clause}")
-                    print(f"[EVENTI API] Parametri query: {params}")
-                    
-                    # Query corretta con struttura database reale
-                    cur.execute(f"""
-                        SELECT 
-                            e.id,
-                            e.data_evento,
-                            e.data_msg_evento,
-                            e.prot_msg_evento,
-                            e.carattere,
-                            e.tipo_evento,
-                            e.rife_evento,
-                            e.note,
-                            em.nome as ente_nome,
-                            te.nome as tipologia_nome,
-                            te.descrizione as tipologia_descrizione,
-                            u.nome || ' ' || u.cognome as creato_da_nome
-                        FROM eventi e
-                        JOIN enti_militari em ON e.ente_id = em.id
-                        LEFT JOIN tipologia_evento te ON e.tipologia_evento_id = te.id
-                        LEFT JOIN utenti u ON e.creato_da = u.id
-                        WHERE {where_clause}
-                        ORDER BY e.data_msg_evento DESC, e.id DESC
-                        LIMIT 100
-                    """, params)
-                
+                # Al livello 2 include gli enti dipendenti, quindi più righe
+                cur.execute(f"{sql} LIMIT {1000 if level == '2' and ente_nome else 100}", params)
                 results = cur.fetchall()
-                
-                print(f"[EVENTI API] Query eseguita, risultati trovati: {len(results)}")
-                if results:
-                    print(f"[EVENTI API] Primo risultato: ID={results[0]['id']}, Ente={results[0]['ente_nome']}")
-                else:
-                    print(f"[EVENTI API] NESSUN RISULTATO - Query: {where_clause}")
-                    print(f"[EVENTI API] Parametri query: {params}")
 
                 # Calcola statistiche caratteri per validazione
                 character_stats = {'positivi': 0, 'negativi': 0, 'totale': len(results)}
@@ -1890,49 +1825,15 @@ def api_eventi_dettagli():
                             character_stats['positivi'] += 1
                         elif carattere_norm == 'negativo':
                             character_stats['negativi'] += 1
-                
-                print(f"[EVENTI API] Statistiche caratteri: {character_stats}")
-                
+
         finally:
             conn.close()
-            
-        # Formatta i risultati - AGGIORNATO con nuovi campi
-        try:
-            formatted_results = [{
-                'id': row['id'],
-                'data_evento': row['data_evento'].strftime('%d/%m/%Y') if row['data_evento'] else '',
-                'data_msg_evento': row['data_msg_evento'].strftime('%d/%m/%Y') if row['data_msg_evento'] else '',
-                'prot_msg_evento': row['prot_msg_evento'] or '',
-                'carattere': row['carattere'],
-                'tipo_evento': row['tipo_evento'], 
-                'ente_nome': row['ente_nome'],
-                'tipologia_nome': row['tipologia_nome'] or '',
-                'tipologia_descrizione': row['tipologia_descrizione'] or '',
-                'rife_evento': row['rife_evento'],
-                'note': row['note'] or '',
-                'creato_da': row['creato_da_nome'] or 'N/D'
-            } for row in results]
-        except Exception as format_error:
-            print(f"[EVENTI API] Errore formattazione risultati: {format_error}")
-            # Return basic format se la formattazione fallisce
-            formatted_results = [{
-                'id': row['id'],
-                'data_evento': str(row['data_evento']) if row['data_evento'] else '',
-                'data_msg_evento': str(row['data_msg_evento']) if row['data_msg_evento'] else '',
-                'prot_msg_evento': str(row['prot_msg_evento']) if row['prot_msg_evento'] else '',
-                'carattere': str(row['carattere']) if row['carattere'] else '',
-                'tipo_evento': str(row['tipo_evento']) if row['tipo_evento'] else '', 
-                'ente_nome': str(row['ente_nome']) if row['ente_nome'] else '',
-                'tipologia_nome': str(row['tipologia_nome']) if row['tipologia_nome'] else '',
-                'tipologia_descrizione': str(row['tipologia_descrizione']) if row['tipologia_descrizione'] else '',
-                'rife_evento': row['rife_evento'] if row['rife_evento'] else None,
-                'note': str(row['note']) if row['note'] else '',
-                'creato_da': str(row['creato_da_nome']) if row['creato_da_nome'] else 'N/D'
-            } for row in results]
-        
+
+        formatted_results = [_formatta_dettaglio(row) for row in results]
+
         # NEW: Se richiesta aggregazione per grafico, restituisci dati in formato chart
         if aggregate_for_chart == 'true' and level == '3':
-            print(f"[EVENTI API] Livello 3 - Preparazione dati aggregati per grafico")
+            logger.debug("[EVENTI API] Livello 3 - Preparazione dati aggregati per grafico")
             
             # Aggrega eventi per mese per creare grafico temporale
             from collections import defaultdict
@@ -1951,7 +1852,7 @@ def api_eventi_dettagli():
                         month_key = date_obj.strftime('%Y-%m')
                         monthly_data[month_key] += 1
                 except Exception as e:
-                    print(f"[EVENTI API] Errore parsing data: {e}")
+                    logger.error("[EVENTI API] Errore parsing data: %s", e)
                     continue
             
             # Ordina per mese e prepara dati chart
@@ -1973,7 +1874,7 @@ def api_eventi_dettagli():
             # Colori per il grafico livello 3
             colors = ['rgba(74, 144, 226, 0.8)' for _ in values]
             
-            print(f"[EVENTI API] Dati chart generati: {len(labels)} mesi, {sum(values)} eventi totali")
+            logger.debug("[EVENTI API] Dati chart generati: %s mesi, %s eventi totali", len(labels), sum(values))
             
             return jsonify({
                 'success': True,
@@ -1988,7 +1889,7 @@ def api_eventi_dettagli():
             })
         
         # Risposta standard per dettagli
-        print(f"[EVENTI API] Ritorno risultati: {len(formatted_results)} eventi con stats: {character_stats}")
+        logger.debug("[EVENTI API] Ritorno risultati: %s eventi con stats: %s", len(formatted_results), character_stats)
         return jsonify({
             'success': True,
             'data': formatted_results,
@@ -1997,12 +1898,93 @@ def api_eventi_dettagli():
         })
         
     except Exception as e:
-        print(f"[EVENTI API] ERRORE GENERALE: {e}")
-        import traceback
-        print(f"[EVENTI API] Stack trace completo:")
-        traceback.print_exc()
+        logger.exception("[EVENTI API] ERRORE GENERALE: %s", e)
         return jsonify({'error': str(e)}), 500
 
+@eventi.route('/api/dettagli/export')
+@login_required
+def api_eventi_dettagli_export():
+    """
+    Export in streaming dei dettagli eventi (stessi filtri di /api/dettagli,
+    senza limite di righe) come NDJSON (`formato=ndjson`, default) o CSV.
+    Le righe arrivano da un cursore lato server a blocchi di EXPORT_ITERSIZE:
+    la memoria usata non dipende dal numero di eventi esportati.
+    """
+    if not is_operatore_or_above():
+        return jsonify({'error': 'Accesso negato'}), 403
+
+    formato = request.args.get('formato', 'ndjson')
+    if formato not in ('ndjson', 'csv'):
+        return jsonify({'error': f'Formato non supportato: {formato}'}), 400
+
+    ente_nome = request.args.get('ente', '')
+    try:
+        query = _query_dettagli(
+            request.args.get('level', '0'),
+            ente_nome,
+            request.args.get('carattere', '') or request.args.get('categoria', ''),
+            request.args.get('sottocategoria', ''),
+            request.args.get('period', 'month'),
+            request.args.get('start_date', ''),
+            request.args.get('end_date', '')
+        )
+    except ValueError:
+        return jsonify({'error': 'Date non valide (formato AAAA-MM-GG)'}), 400
+    if query is None:
+        return jsonify({'error': f'Ente parent "{ente_nome}" non trovato'}), 404
+    sql, params = query
+    user_id = request.current_user['user_id']
+
+    def righe():
+        conn = get_auth_db_connection()
+        esportati = 0
+        try:
+            # Cursore con nome: le righe restano sul server e arrivano a blocchi
+            with conn.cursor(name='eventi_export', cursor_factory=RealDictCursor) as cur:
+                cur.itersize = EXPORT_ITERSIZE
+                cur.execute(sql, params)
+
+                if formato == 'csv':
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    writer.writerow(DETTAGLI_CAMPI)
+                    for row in cur:
+                        riga = _formatta_dettaglio(row)
+                        writer.writerow([riga[campo] for campo in DETTAGLI_CAMPI])
+                        esportati += 1
+                        if buffer.tell() >= 65536:
+                            yield buffer.getvalue()
+                            buffer.seek(0)
+                            buffer.truncate()
+                    yield buffer.getvalue()
+                else:
+                    blocco = []
+                    for row in cur:
+                        blocco.append(json.dumps(_formatta_dettaglio(row), ensure_ascii=False))
+                        esportati += 1
+                        if len(blocco) >= 500:
+                            yield '\n'.join(blocco) + '\n'
+                            blocco = []
+                    if blocco:
+                        yield '\n'.join(blocco) + '\n'
+        finally:
+            conn.close()
+
+        log_user_action(
+            user_id,
+            'EXPORT_EVENTI',
+            f'Esportati {esportati} eventi in {formato.upper()}',
+            'eventi'
+        )
+
+    estensione, mimetype = ('csv', 'text/csv') if formato == 'csv' else ('ndjson', 'application/x-ndjson')
+    filename = f'eventi_export_{datetime.now().strftime("%Y%m%d_%H%M")}.{estensione}'
+    return Response(
+        stream_with_context(righe()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 @eventi.route('/api/test-dettagli')
 @login_required
 def api_test_dettagli():
@@ -2011,19 +1993,19 @@ def api_test_dettagli():
         return jsonify({'error': 'Accesso negato'}), 403
     
     try:
-        print("[EVENTI TEST] Inizio test API semplificata...")
+        logger.debug("[EVENTI TEST] Inizio test API semplificata...")
         
         conn = get_auth_db_connection()
-        print("[EVENTI TEST] Connessione database ottenuta")
+        logger.debug("[EVENTI TEST] Connessione database ottenuta")
         
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                print("[EVENTI TEST] Cursor creato")
+                logger.debug("[EVENTI TEST] Cursor creato")
                 
                 # Test query molto semplice
                 cur.execute("SELECT COUNT(*) as total FROM eventi LIMIT 1")
                 result = cur.fetchone()
-                print(f"[EVENTI TEST] Query test eseguita, risultato: {result}")
+                logger.debug("[EVENTI TEST] Query test eseguita, risultato: %s", result)
                 
                 # Debug: Verifica struttura tabella eventi
                 cur.execute("""
@@ -2033,9 +2015,9 @@ def api_test_dettagli():
                     ORDER BY ordinal_position
                 """)
                 columns = cur.fetchall()
-                print(f"[EVENTI TEST] Colonne tabella eventi:")
+                logger.debug("[EVENTI TEST] Colonne tabella eventi:")
                 for col in columns:
-                    print(f"  - {col['column_name']} ({col['data_type']})")
+                    logger.debug("  - %s (%s)", col['column_name'], col['data_type'])
                 
                 return jsonify({
                     'success': True,
@@ -2046,16 +2028,15 @@ def api_test_dettagli():
                 
         finally:
             conn.close()
-            print("[EVENTI TEST] Connessione chiusa")
+            logger.debug("[EVENTI TEST] Connessione chiusa")
             
     except Exception as e:
-        print(f"[EVENTI TEST] ERRORE: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("[EVENTI TEST] ERRORE: %s", e)
         return jsonify({'error': str(e), 'test': 'failed'}), 500
 
 @eventi.route('/api/statistiche')
 @login_required
+@response_cache.cached_json('eventi', default_period='month')
 def api_eventi_statistiche():
     """API per statistiche generali eventi del periodo"""
     if not is_operatore_or_above():
@@ -2067,33 +2048,25 @@ def api_eventi_statistiche():
     carattere_filter = request.args.get('carattere', '')
     
     try:
-        # Calcola il filtro temporale
-        if period == 'custom' and start_date and end_date:
-            date_filter = f"data_evento BETWEEN '{start_date}' AND '{end_date}'"
-        else:
-            days_map = {'week': 7, 'month': 30, 'quarter': 90, 'year': 365}
-            days = days_map.get(period, 30)
-            date_filter = f"data_evento >= CURRENT_DATE - INTERVAL '{days} days'"
-        
-        # Aggiungi filtro carattere se specificato
-        where_conditions = [date_filter]
-        if carattere_filter and carattere_filter in ['positivo', 'negativo']:
-            where_conditions.append(f"carattere = '{carattere_filter}'")
-        
-        where_clause = ' AND '.join(where_conditions)
+        # Filtri sul rollup giornaliero (periodo su data_msg_evento come gli altri grafici)
+        where_clause, params = eventi_rollup.build_filters(
+            period, start_date, end_date,
+            carattere=carattere_filter if carattere_filter in ('positivo', 'negativo') else None,
+            default_period='month'
+        )
         
         conn = get_auth_db_connection()
         try:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(f"""
                     SELECT 
-                        COUNT(*) as totale,
-                        SUM(CASE WHEN carattere = 'positivo' THEN 1 ELSE 0 END) as positivi,
-                        SUM(CASE WHEN carattere = 'negativo' THEN 1 ELSE 0 END) as negativi,
-                        COUNT(DISTINCT ente_id) as enti_coinvolti
-                    FROM eventi 
+                        SUM(r.count) as totale,
+                        SUM(r.count) FILTER (WHERE r.carattere = 'positivo') as positivi,
+                        SUM(r.count) FILTER (WHERE r.carattere = 'negativo') as negativi,
+                        COUNT(DISTINCT r.ente_id) as enti_coinvolti
+                    FROM eventi_daily_rollup r
                     WHERE {where_clause}
-                """)
+                """, params)
                 result = cur.fetchone()
                 
         finally:
@@ -2110,11 +2083,12 @@ def api_eventi_statistiche():
         })
         
     except Exception as e:
-        print(f"[EVENTI] Errore API statistiche: {e}")
+        logger.error("[EVENTI] Errore API statistiche: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @eventi.route('/api/drill-down')
 @login_required
+@response_cache.cached_json('eventi')
 def api_eventi_drill_down():
     if not is_operatore_or_above():
         return jsonify({'error': 'Accesso negato'}), 403
@@ -2126,7 +2100,7 @@ def api_eventi_drill_down():
         return api_eventi_categorie()
     
     elif level == '1':
-        print(f"[EVENTI API] Drill-down Livello 1: selection_level_0='{selection_level_0}'")
+        logger.debug("[EVENTI API] Drill-down Livello 1: selection_level_0='%s'", selection_level_0)
         if not selection_level_0:
             return jsonify({'error': 'selection_level_0 richiesto per livello 1'}), 400
         
@@ -2136,91 +2110,35 @@ def api_eventi_drill_down():
         else:
             tipo_db = selection_level_0
         
-        print(f"[EVENTI API] Convertito in tipo_db: '{tipo_db}'")
+        logger.debug("[EVENTI API] Convertito in tipo_db: '%s'", tipo_db)
         
         try:
+            # Totali dei sottoalberi di primo livello (la radice con i soli eventi propri)
+            where_rollup, params = eventi_rollup.build_filters('year', tipo_evento=tipo_db)
             conn = get_auth_db_connection()
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    -- Approccio semplice: query diretta con logica a step
-                    SELECT 
-                        CASE 
-                            -- Se l'ente ha parent_id NULL: è la radice, usa se stesso
-                            WHEN em.parent_id IS NULL THEN em.nome
-                            
-                            -- Se il parent ha parent_id NULL: è figlio diretto della radice
-                            WHEN p1.parent_id IS NULL THEN em.nome
-                            
-                            -- Se il grandparent ha parent_id NULL: usa parent
-                            WHEN p2.parent_id IS NULL THEN p1.nome
-                            
-                            -- Se il great-grandparent ha parent_id NULL: usa grandparent
-                            WHEN p3.parent_id IS NULL THEN p2.nome
-                            
-                            -- Se il great-great-grandparent ha parent_id NULL: usa great-grandparent  
-                            WHEN p4.parent_id IS NULL THEN p3.nome
-                            
-                            -- Fallback per livelli più profondi: 'ALTRO'
-                            ELSE 'ALTRO'
-                        END as ente,
-                        COUNT(*) as count
-                    FROM eventi e
-                    JOIN enti_militari em ON e.ente_id = em.id
-                    LEFT JOIN enti_militari p1 ON em.parent_id = p1.id
-                    LEFT JOIN enti_militari p2 ON p1.parent_id = p2.id
-                    LEFT JOIN enti_militari p3 ON p2.parent_id = p3.id
-                    LEFT JOIN enti_militari p4 ON p3.parent_id = p4.id
-                    WHERE e.tipo_evento = %s
-                    AND e.data_msg_evento >= CURRENT_DATE - INTERVAL '365 days'
-                    AND check_ente_comando_logistico(em.id) = true
-                    GROUP BY 
-                        CASE 
-                            WHEN em.parent_id IS NULL THEN em.nome
-                            WHEN p1.parent_id IS NULL THEN em.nome
-                            WHEN p2.parent_id IS NULL THEN p1.nome
-                            WHEN p3.parent_id IS NULL THEN p2.nome
-                            WHEN p4.parent_id IS NULL THEN p3.nome
-                            ELSE 'ALTRO'
-                        END
-                    HAVING 
-                        CASE 
-                            WHEN em.parent_id IS NULL THEN em.nome
-                            WHEN p1.parent_id IS NULL THEN em.nome
-                            WHEN p2.parent_id IS NULL THEN p1.nome
-                            WHEN p3.parent_id IS NULL THEN p2.nome
-                            WHEN p4.parent_id IS NULL THEN p3.nome
-                            ELSE 'ALTRO'
-                        END <> 'ALTRO'
-                    ORDER BY CASE
-                        WHEN p1.parent_id IS NULL THEN p1.nome
-                        WHEN p2.parent_id IS NULL THEN p1.nome
-                        WHEN p3.parent_id IS NULL THEN p2.nome
-                        WHEN p4.parent_id IS NULL THEN p3.nome
-                        ELSE 'ALTRO'
-                    END
-                """, [tipo_db])
-                
-                results = cur.fetchall()
-                print(f"[EVENTI API] Query risultati: {len(results)} enti trovati")
-                
-                labels = [row['ente'] for row in results]
-                values = [row['count'] for row in results]
-                
-                print(f"[EVENTI API] Risultati finali: labels={labels}, values={values}")
-                print(f"[EVENTI API] Totale eventi: {sum(values)}")
-                
-                return jsonify({
-                    'success': True,
-                    'data': {
-                        'labels': labels,
-                        'values': values
-                    }
-                })
-                
+            try:
+                nodes = eventi_drilldown.aggrega(conn, ROOT_ENTE_ID, where_rollup, params) or []
+            finally:
+                conn.close()
+            results = sorted((node['nome'], node['totale']) for node in nodes)
+            logger.debug("[EVENTI API] Query risultati: %s enti trovati", len(results))
+            
+            labels = [ente for ente, _ in results]
+            values = [count for _, count in results]
+            
+            logger.debug("[EVENTI API] Risultati finali: labels=%s, values=%s", labels, values)
+            logger.debug("[EVENTI API] Totale eventi: %s", sum(values))
+            
+            return jsonify({
+                'success': True,
+                'data': {
+                    'labels': labels,
+                    'values': values
+                }
+            })
+            
         except Exception as e:
             return jsonify({'error': str(e)}), 500
-        finally:
-            conn.close()
     
     return jsonify({'error': f'Livello {level} non implementato'}), 400
 
@@ -2237,13 +2155,13 @@ def cerca_eventi_seguiti():
     protocollo = request.args.get('protocollo', '').strip().upper()
     data_msg = request.args.get('data', '').strip()
     
-    print(f"[SEGUITI API] Ricerca eventi - protocollo: '{protocollo}', data: '{data_msg}'")
+    logger.debug("[SEGUITI API] Ricerca eventi - protocollo: '%s', data: '%s'", protocollo, data_msg)
     
     if not protocollo and not data_msg:
         return jsonify({'error': 'Almeno un criterio di ricerca è richiesto'}), 400
     
     try:
-        with get_auth_db_connection() as conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 
                 # Costruisci la query dinamicamente
@@ -2274,18 +2192,20 @@ def cerca_eventi_seguiti():
                     FROM eventi e
                     INNER JOIN enti_militari em ON e.ente_id = em.id
                     WHERE {where_clause}
-                        AND check_ente_comando_logistico(em.id) = true
+                        AND e.ente_id = ANY(%s)
                     ORDER BY e.data_msg_evento DESC, e.creato_il DESC
                     LIMIT 50
                 """
                 
-                print(f"[SEGUITI API] Query: {query}")
-                print(f"[SEGUITI API] Params: {params}")
+                params.append(get_enti_comando_logistico(conn))
+                
+                logger.debug("[SEGUITI API] Query: %s", query)
+                logger.debug("[SEGUITI API] Params: %s", params)
                 
                 cur.execute(query, params)
                 eventi = cur.fetchall()
                 
-                print(f"[SEGUITI API] Trovati {len(eventi)} eventi")
+                logger.debug("[SEGUITI API] Trovati %s eventi", len(eventi))
                 
                 # Converti RealDictRow in dict normali per JSON
                 risultati = []
@@ -2305,9 +2225,7 @@ def cerca_eventi_seguiti():
                 return jsonify(risultati)
                 
     except Exception as e:
-        print(f"[SEGUITI API] Errore: {e}")
-        import traceback
-        print(f"[SEGUITI API] Traceback: {traceback.format_exc()}")
+        logger.exception("[SEGUITI API] Errore: %s", e)
         return jsonify({'error': f'Errore durante la ricerca: {str(e)}'}), 500
 
 
@@ -2319,7 +2237,7 @@ def debug_tipologie():
         return jsonify({'error': 'Accesso negato'}), 403
     
     try:
-        with get_auth_db_connection() as conn:
+        with db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica tutte le tipologie (anche non attive)
                 cur.execute("SELECT id, nome, descrizione, attivo FROM tipologia_evento ORDER BY id")
@@ -2372,7 +2290,7 @@ def init_tipologie():
     ]
     
     try:
-        with get_auth_db_connection() as conn:
+        with db_connection() as conn:
             with conn.cursor() as cur:
                 tipologie_create = 0
                 
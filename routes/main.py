@@ -7,6 +7,7 @@ from auth import (
     get_auth_db_connection  # usa la connessione centralizzata (PostgreSQL)
 )
 from psycopg2.extras import RealDictCursor
+from contextlib import closing
 from datetime import datetime
 import re
 
@@ -144,7 +145,7 @@ def gestione_utenti():
     """
     try:
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Query ottimizzata per ottenere tutti i dati utente
                 cur.execute(
@@ -246,7 +247,7 @@ def get_dashboard_stats(user_role):
     
     conn = get_db_connection()
     try:
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Conta enti militari
                 cur.execute('SELECT COUNT(*) AS count FROM enti_militari')
@@ -306,7 +307,7 @@ def get_admin_dashboard_stats():
     
     conn = get_db_connection()
     try:
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Utenti per ruolo
                 cur.execute(
@@ -459,7 +460,7 @@ def get_system_info():
     
     conn = get_db_connection()
     try:
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Dimensione database
                 cur.execute("SELECT pg_database_size(current_database()) AS size_bytes")
@@ -518,7 +519,7 @@ def recent_activities():
         offset = (page - 1) * per_page
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Conta totale attività
                 cur.execute(
@@ -614,7 +615,7 @@ def create_user():
             return jsonify({'success': False, 'error': 'Email non valida: deve iniziare con lettera/numero e terminare con @esercito.difesa.it'}), 400
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica se username già esiste
                 cur.execute('SELECT id FROM utenti WHERE username = %s', (username,))
@@ -680,7 +681,7 @@ def update_user(user_id):
         data = request.get_json()
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica che l'utente esista
                 cur.execute('SELECT * FROM utenti WHERE id = %s', (user_id,))
@@ -770,7 +771,7 @@ def toggle_user_status(user_id):
             return jsonify({'success': False, 'error': 'Non puoi disattivare te stesso'}), 400
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Ottieni stato attuale
                 cur.execute('SELECT attivo, username FROM utenti WHERE id = %s', (user_id,))
@@ -809,7 +810,7 @@ def get_deleted_users():
     """Recupera la lista degli utenti eliminati (solo admin)"""
     try:
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     '''
@@ -843,7 +844,7 @@ def restore_user(user_id):
     """Ripristina un utente eliminato (solo admin)"""
     try:
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica che l'utente esista ed sia eliminato
                 cur.execute('SELECT username, eliminato FROM utenti WHERE id = %s', (user_id,))
@@ -886,7 +887,7 @@ def delete_user(user_id):
             return jsonify({'success': False, 'error': 'Non puoi eliminare te stesso'}), 400
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica che l'utente esista
                 cur.execute('SELECT username FROM utenti WHERE id = %s', (user_id,))
@@ -922,7 +923,7 @@ def get_user_details(user_id):
     """
     try:
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute('''
                     SELECT 
@@ -965,7 +966,7 @@ def get_dropdown_data():
     """
     try:
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Ruoli attivi
                 cur.execute('''
@@ -1146,7 +1147,7 @@ def create_feedback():
             titolo = f"{tipo_labels.get(data['tipo'], 'Feedback')} - {datetime.now().strftime('%d/%m/%Y %H:%M')}"
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Inserisci feedback
                 cur.execute('''
@@ -1216,7 +1217,7 @@ def get_feedback_list():
         where_clause = 'WHERE ' + ' AND '.join(where_conditions) if where_conditions else ''
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Conta totale feedback
                 count_query = f"SELECT COUNT(*) as total FROM feedback f {where_clause}"
@@ -1284,7 +1285,7 @@ def update_feedback(feedback_id):
         admin_user_id = request.current_user['user_id']
         
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Verifica che il feedback esista
                 cur.execute('SELECT * FROM feedback WHERE id = %s', (feedback_id,))
@@ -1344,7 +1345,7 @@ def get_feedback_stats():
     """
     try:
         conn = get_db_connection()
-        with conn:
+        with closing(conn), conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # Conteggi per stato
                 cur.execute('''
@@ -12,33 +12,19 @@ import sys
 from datetime import datetime
 import psycopg2
 import psycopg2.extras
+from db import get_connection
 
 # Import per gestione immagini
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
 from image_manager import ImageManager
 
-# ===========================================
-# CONFIGURAZIONE DATABASE (PostgreSQL)
-# ===========================================
-
-PG_CFG = {
-    "host": os.environ.get("TALON_PG_HOST", "127.0.0.1"),
-    "port": int(os.environ.get("TALON_PG_PORT", "5432")),
-    "dbname": os.environ.get("TALON_PG_DB", "talon"),
-    "user": os.environ.get("TALON_PG_USER", "talon"),
-    "password": os.environ.get("TALON_PG_PASS", "TalonDB!2025"),
-}
-
 # Configurazione upload immagini
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'static', 'uploads', 'operazioni')
 image_manager = ImageManager(UPLOAD_FOLDER)
 
 def get_db_connection():
-    """Connessione a PostgreSQL con cursore dict-like"""
-    conn = psycopg2.connect(**PG_CFG)
-    # RealDictCursor restituisce dict per riga
-    conn.autocommit = False
-    return conn
+    """Connessione a PostgreSQL dal pool condiviso (RealDictCursor sui singoli cursori)"""
+    return get_connection()
 
 operazioni_bp = Blueprint('operazioni', __name__, template_folder='../templates')
 
@@ -166,6 +152,7 @@ def lista_operazioni():
             operazioni = cur.fetchall()
 
             stats = get_operazioni_stats(conn) if is_operatore_or_above() else {}
+        conn.close()
 
         # Calcola stato lato app
         operazioni_con_stato = []
@@ -185,7 +172,7 @@ def lista_operazioni():
                                stats=stats,
                                user_role=user_role)
     except Exception as e:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback()
             conn.close()
         flash(f'Errore nel caricamento delle operazioni: {str(e)}', 'error')
@@ -328,6 +315,7 @@ def salva_operazione():
                             # Log errori ma non interrompere il salvataggio dell'operazione
                             error_msg = '; '.join(upload_result['errors'])
                             flash(f'Operazione salvata ma errore nell\'upload immagine: {error_msg}', 'warning')
+        conn.close()
 
         log_user_action(
             user_id,
@@ -341,13 +329,13 @@ def salva_operazione():
 
     except ValueError as ve:
         if str(ve) == "DUPLICATO":
-            if 'conn' in locals():
+            if 'conn' in locals() and not conn.closed:
                 conn.rollback(); conn.close()
             flash('Esiste gi un\'operazione con questo nome missione o nome breve.', 'warning')
             return redirect(url_for('operazioni.inserisci_operazione_form'))
         raise
     except Exception as e:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         flash(f'Errore durante il salvataggio: {str(e)}', 'error')
         return redirect(url_for('operazioni.inserisci_operazione_form'))
@@ -378,6 +366,7 @@ def visualizza_operazione(id):
                 (id,)
             )
             operazione = cur.fetchone()
+        conn.close()
 
         if not operazione:
             flash('Operazione non trovata.', 'error')
@@ -397,7 +386,7 @@ def visualizza_operazione(id):
                                stato=stato,
                                user_role=user_role)
     except Exception as e:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         flash(f'Errore nel caricamento dell\'operazione: {str(e)}', 'error')
         return redirect(url_for('operazioni.lista_operazioni'))
@@ -424,6 +413,7 @@ def modifica_operazione_form(id):
                 (id,)
             )
             operazione = cur.fetchone()
+        conn.close()
 
         if not operazione:
             flash('Operazione non trovata.', 'error')
@@ -439,7 +429,7 @@ def modifica_operazione_form(id):
         return render_template('operazioni/modifica_operazione.html', operazione=operazione)
 
     except Exception as e:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         flash(f'Errore nel caricamento dell\'operazione: {str(e)}', 'error')
         return redirect(url_for('operazioni.lista_operazioni'))
@@ -585,6 +575,7 @@ def aggiorna_operazione(id):
                             # Log errori ma non interrompere l'aggiornamento dell'operazione
                             error_msg = '; '.join(upload_result['errors'])
                             flash(f'Operazione aggiornata ma errore nell\'upload immagine: {error_msg}', 'warning')
+        conn.close()
 
         log_user_action(
             user_id,
@@ -597,7 +588,7 @@ def aggiorna_operazione(id):
         return redirect(url_for('operazioni.visualizza_operazione', id=id))
 
     except ValueError as ve:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         if str(ve) == "NOT_FOUND":
             flash('Operazione non trovata.', 'error')
@@ -607,7 +598,7 @@ def aggiorna_operazione(id):
             flash('Errore di validazione.', 'error')
         return redirect(url_for('operazioni.modifica_operazione_form', id=id))
     except Exception as e:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         flash(f'Errore durante l\'aggiornamento: {str(e)}', 'error')
         return redirect(url_for('operazioni.modifica_operazione_form', id=id))
@@ -632,6 +623,7 @@ def elimina_operazione(id):
                     raise ValueError(f"ATTIVITA_COLLEGATE:{attivita['count']}")
 
                 cur.execute('DELETE FROM operazioni WHERE id = %s', (id,))
+        conn.close()
 
         log_user_action(
             user_id,
@@ -642,7 +634,7 @@ def elimina_operazione(id):
         )
         flash('Operazione eliminata con successo.', 'success')
     except ValueError as ve:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         msg = str(ve)
         if msg == "NOT_FOUND":
@@ -653,7 +645,7 @@ def elimina_operazione(id):
         else:
             flash('Errore di validazione.', 'error')
     except Exception as e:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         flash(f'Errore durante l\'eliminazione: {str(e)}', 'error')
     return redirect(url_for('operazioni.lista_operazioni'))
@@ -678,8 +670,9 @@ def api_operazioni_attive():
                 '''
             )
             rows = cur.fetchall()
+        conn.close()
         return jsonify(rows)
     except Exception as e:
-        if 'conn' in locals():
+        if 'conn' in locals() and not conn.closed:
             conn.rollback(); conn.close()
         return jsonify({'error': str(e)}), 500
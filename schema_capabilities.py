@@ -0,0 +1,200 @@
+# schema_capabilities.py - Oggetti dello schema presenti nel database, rilevati all'avvio
+"""
+Una sola query sul catalogo (pg_class, pg_proc, pg_trigger) all'avvio
+registra tabelle, viste, funzioni e trigger presenti nello schema: le route
+e i moduli scelgono il percorso (es. vista v_enti_accessibili o cono
+d'ombra, tabella revoche o solo memoria) con un controllo in memoria invece
+di interrogare information_schema o attendere un'eccezione ad ogni chiamata.
+
+Dopo l'applicazione di una migrazione il registro va aggiornato con
+`refresh()` (admin: POST /health/schema/refresh); i moduli che hanno
+preso decisioni all'avvio si registrano con `on_refresh()`.
+
+Se il catalogo non è leggibile (database non raggiungibile) il registro
+resta "non rilevato": ogni oggetto risulta presente e restano validi i
+fallback sulle eccezioni dei singoli moduli. Il rilevamento viene ritentato
+dopo TALON_SCHEMA_RETRY_SECONDS (o subito con `refresh()`).
+"""
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional
+
+import psycopg2
+
+from db import db_connection
+
+logger = logging.getLogger(__name__)
+
+# Secondi tra due tentativi di rilevamento dopo un errore
+PROBE_RETRY_SECONDS = float(os.environ.get('TALON_SCHEMA_RETRY_SECONDS', '30'))
+
+# Oggetti attesi -> migrazione che li crea (avviso all'avvio se mancano)
+EXPECTED = {
+    'enti_militari_closure': 'migrations/add_enti_militari_closure.sql',
+    'enti_militari_stats': 'migrations/add_enti_militari_stats.sql',
+    'eventi_daily_rollup': 'migrations/add_eventi_daily_rollup.sql',
+    'api_token_revocati': 'migrations/add_api_token_revocati.sql',
+    'talon_notify_cache_invalidate': 'migrations/add_cache_invalidation_notify.sql',
+    'trg_talon_cache_eventi': 'migrations/add_response_cache_notify.sql',
+    'trg_talon_cache_attivita': 'migrations/add_response_cache_notify.sql',
+}
+
+PROBE_SQL = '''
+    SELECT CASE WHEN c.relkind = 'v' OR c.relkind = 'm' THEN 'view' ELSE 'table' END, c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = ANY(current_schemas(false))
+      AND c.relkind IN ('r', 'p', 'v', 'm')
+    UNION ALL
+    SELECT 'function', p.proname
+    FROM pg_proc p
+    JOIN pg_namespace n ON n.oid = p.pronamespace
+    WHERE n.nspname = ANY(current_schemas(false))
+    UNION ALL
+    SELECT 'trigger', t.tgname
+    FROM pg_trigger t
+    WHERE NOT t.tgisinternal
+'''
+
+# ===========================================
+# REGISTRO
+# ===========================================
+
+class Capabilities:
+    """Snapshot immutabile degli oggetti presenti nello schema."""
+
+    def __init__(self, tables: Iterable[str] = (), views: Iterable[str] = (),
+                 functions: Iterable[str] = (), triggers: Iterable[str] = (),
+                 probed: bool = True):
+        self.tables: FrozenSet[str] = frozenset(tables)
+        self.views: FrozenSet[str] = frozenset(views)
+        self.functions: FrozenSet[str] = frozenset(functions)
+        self.triggers: FrozenSet[str] = frozenset(triggers)
+        self.probed = probed
+
+    def has_table(self, *names: str) -> bool:
+        """Tabelle o viste (utilizzabili in FROM)."""
+        return not self.probed or all(n in self.tables or n in self.views for n in names)
+
+    def has_view(self, name: str) -> bool:
+        return not self.probed or name in self.views
+
+    def has_function(self, name: str) -> bool:
+        return not self.probed or name in self.functions
+
+    def has_triggers(self, *names: str) -> bool:
+        return not self.probed or all(n in self.triggers for n in names)
+
+    def has(self, name: str) -> bool:
+        """Oggetto di qualsiasi tipo con quel nome."""
+        return not self.probed or any(
+            name in group for group in (self.tables, self.views, self.functions, self.triggers)
+        )
+
+    def without(self, name: str) -> 'Capabilities':
+        """Copia senza l'oggetto (rimosso dopo il rilevamento)."""
+        return Capabilities(self.tables - {name}, self.views - {name},
+                            self.functions - {name}, self.triggers - {name}, self.probed)
+
+    def missing(self) -> Dict[str, str]:
+        """Oggetti attesi assenti -> migrazione da applicare."""
+        if not self.probed:
+            return {}
+        return {name: migration for name, migration in EXPECTED.items() if not self.has(name)}
+
+    def info(self) -> Dict:
+        return {
+            'probed': self.probed,
+            'tables': len(self.tables),
+            'views': sorted(self.views),
+            'functions': len(self.functions),
+            'triggers': len(self.triggers),
+            'missing': self.missing(),
+        }
+
+UNKNOWN = Capabilities(probed=False)
+
+def probe() -> Capabilities:
+    """Legge il catalogo con una sola query."""
+    groups: Dict[str, List[str]] = {'table': [], 'view': [], 'function': [], 'trigger': []}
+    with db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(PROBE_SQL)
+            for kind, name in cur.fetchall():
+                groups[kind].append(name)
+    return Capabilities(groups['table'], groups['view'], groups['function'], groups['trigger'])
+
+# ===========================================
+# REGISTRO DI PROCESSO
+# ===========================================
+
+_capabilities: Optional[Capabilities] = None
+_lock = threading.Lock()
+_callbacks: List[Callable[[Capabilities], None]] = []
+
+# Rilevamento fallito: nuovo tentativo non prima di questo istante (monotonic)
+_retry_at = 0.0
+
+def get() -> Capabilities:
+    """
+    Registro corrente (rilevato al primo uso se init_app non è stato chiamato).
+    Se il rilevamento fallisce resta UNKNOWN per PROBE_RETRY_SECONDS: durante
+    un'interruzione del database non si tenta una query sul catalogo per
+    ogni controllo.
+    """
+    global _capabilities, _retry_at
+    capabilities = _capabilities
+    if capabilities is not None and (capabilities.probed or time.monotonic() < _retry_at):
+        return capabilities
+    with _lock:
+        capabilities = _capabilities
+        if capabilities is not None and (capabilities.probed or time.monotonic() < _retry_at):
+            return capabilities
+        # Un solo thread ritenta, gli altri usano UNKNOWN fino all'esito
+        _retry_at = time.monotonic() + PROBE_RETRY_SECONDS
+        if capabilities is None:
+            _capabilities = UNKNOWN
+    try:
+        return _store(probe())
+    except psycopg2.Error as e:
+        logger.warning(f"Schema non rilevato, uso i fallback dei moduli "
+                       f"(nuovo tentativo tra {PROBE_RETRY_SECONDS:g}s): {e}")
+        return UNKNOWN
+
+def _store(capabilities: Capabilities) -> Capabilities:
+    global _capabilities
+    with _lock:
+        _capabilities = capabilities
+    return capabilities
+
+def forget(name: str):
+    """Segna come assente un oggetto sparito dopo il rilevamento (es. UndefinedTable)."""
+    global _capabilities
+    with _lock:
+        if _capabilities is not None:
+            _capabilities = _capabilities.without(name)
+
+def on_refresh(callback: Callable[[Capabilities], None]):
+    """Registra una funzione da chiamare dopo ogni refresh()."""
+    _callbacks.append(callback)
+
+def refresh() -> Capabilities:
+    """Rileva di nuovo lo schema e notifica i moduli registrati."""
+    capabilities = _store(probe())
+    for callback in list(_callbacks):
+        try:
+            callback(capabilities)
+        except Exception:
+            logger.exception("Errore nell'aggiornamento dopo il rilevamento dello schema")
+    logger.info(f"Schema rilevato di nuovo: {capabilities.info()}")
+    return capabilities
+
+def init_app(app):
+    """Rileva lo schema all'avvio e segnala le migrazioni non applicate."""
+    capabilities = get()
+    if not capabilities.probed:
+        return
+    for name, migration in sorted(capabilities.missing().items()):
+        app.logger.warning(f"Schema: '{name}' assente, applicare {migration}")
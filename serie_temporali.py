@@ -0,0 +1,171 @@
+# serie_temporali.py - Serie temporali a intervalli (giorno/settimana/mese) per i grafici di tendenza
+"""
+Conteggi per intervallo di tempo con riempimento dei buchi: gli intervalli
+sono generati in SQL con generate_series e ogni serie ha un punto (anche 0)
+per ciascun intervallo, così il client non deve ricostruire l'asse.
+
+Le sorgenti sono descritte dal chiamante (tabella, colonna data, misura,
+filtri). Gli eventi leggono il rollup giornaliero (eventi_rollup.py), quindi
+una tendenza su più anni costa giorni x enti righe e non una scansione di
+eventi. Il raggruppamento per ente di primo livello usa l'albero in memoria
+(enti_hierarchy.py): la mappa ente -> gruppo viene passata alla query come
+coppia di array.
+
+Il numero di punti è limitato (TALON_SERIE_MAX_PUNTI): oltre il limite la
+richiesta va ripetuta con un intervallo più ampio.
+"""
+import os
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+# Intervalli supportati (argomento di date_trunc e di generate_series)
+GRANULARITA = ('day', 'week', 'month')
+
+# Numero massimo di intervalli per serie
+MAX_PUNTI = int(os.environ.get('TALON_SERIE_MAX_PUNTI', '400'))
+
+class SerieNonValida(ValueError):
+    """Parametri della serie non validi (granularità o troppi punti)."""
+
+# ===========================================
+# INTERVALLI
+# ===========================================
+
+def inizio_intervallo(giorno: date, granularita: str) -> date:
+    if granularita == 'week':
+        return giorno - timedelta(days=giorno.weekday())
+    if granularita == 'month':
+        return giorno.replace(day=1)
+    return giorno
+
+def numero_punti(dal: date, al: date, granularita: str) -> int:
+    """Numero di intervalli tra dal e al (estremi compresi)."""
+    inizio, fine = inizio_intervallo(dal, granularita), inizio_intervallo(al, granularita)
+    if granularita == 'week':
+        return (fine - inizio).days // 7 + 1
+    if granularita == 'month':
+        return (fine.year - inizio.year) * 12 + fine.month - inizio.month + 1
+    return (fine - inizio).days + 1
+
+def intervalli(dal: date, al: date, granularita: str) -> List[date]:
+    """Inizio di ogni intervallo tra dal e al (gli stessi di generate_series)."""
+    giorno = inizio_intervallo(dal, granularita)
+    risultato = []
+    for _ in range(numero_punti(dal, al, granularita)):
+        risultato.append(giorno)
+        if granularita == 'week':
+            giorno += timedelta(days=7)
+        elif granularita == 'month':
+            giorno = (giorno.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            giorno += timedelta(days=1)
+    return risultato
+
+def verifica(dal: date, al: date, granularita: str):
+    """Solleva SerieNonValida se la granularità non è supportata o i punti sono troppi."""
+    if granularita not in GRANULARITA:
+        raise SerieNonValida(f"Granularità '{granularita}' non supportata ({', '.join(GRANULARITA)})")
+    if al < dal:
+        raise SerieNonValida("Intervallo di date vuoto")
+    punti = numero_punti(dal, al, granularita)
+    if punti > MAX_PUNTI:
+        raise SerieNonValida(
+            f"{punti} intervalli richiesti, massimo {MAX_PUNTI}: usare una granularità più ampia"
+        )
+
+# ===========================================
+# RAGGRUPPAMENTO PER ENTE
+# ===========================================
+
+def mappa_primo_livello(tree, root_id: Optional[int] = None) -> Tuple[List[int], List[int]]:
+    """
+    Coppie (ente, ente di primo livello che lo contiene) come due liste per
+    `unnest(%s::int[], %s::int[])`. Con `root_id` i gruppi sono i figli
+    diretti della radice (la radice resta se stessa), altrimenti gli enti
+    di livello 1 dell'intera gerarchia.
+    """
+    enti, gruppi = [], []
+    if root_id is not None:
+        for ente_id in tree.descendants(root_id):
+            enti.append(ente_id)
+            gruppi.append(tree.bucket(ente_id, root_id))
+    else:
+        for ente_id in tree.all_ids:
+            enti.append(ente_id)
+            gruppi.append(tree.ancestor_at(ente_id, min(tree.depth(ente_id), 1)))
+    return enti, gruppi
+
+# ===========================================
+# QUERY
+# ===========================================
+
+def serie(conn, *, sorgente: str, colonna_data: str, misura: str,
+          where: str, params: Sequence, dal: date, al: date, granularita: str,
+          gruppo: Optional[str] = None, colonna_ente: Optional[str] = None,
+          mappa_enti: Optional[Tuple[List[int], List[int]]] = None) -> Dict:
+    """
+    Esegue la serie e restituisce {'labels': [date iso], 'series': [{'gruppo', 'data', 'totale'}]}.
+
+    - sorgente: FROM/JOIN della query (es. "eventi_daily_rollup r JOIN ...")
+    - colonna_data, misura: es. "r.day", "SUM(r.count)"
+    - where, params: filtri già parametrizzati (periodo compreso)
+    - gruppo: espressione di raggruppamento (None: un'unica serie 'totale')
+    - colonna_ente + mappa_enti: raggruppamento per ente di primo livello
+    """
+    verifica(dal, al, granularita)
+
+    join_mappa = ''
+    params_mappa: List = []
+    if mappa_enti is not None:
+        join_mappa = f'JOIN unnest(%s::int[], %s::int[]) AS m(ente_id, gruppo_id) ON m.ente_id = {colonna_ente}'
+        params_mappa = [list(mappa_enti[0]), list(mappa_enti[1])]
+        gruppo = 'm.gruppo_id'
+
+    if gruppo is None:
+        espressione_gruppo = "'totale'::text"
+        gruppi = "SELECT 'totale'::text AS gruppo"
+    else:
+        espressione_gruppo = gruppo
+        gruppi = 'SELECT DISTINCT gruppo FROM dati'
+
+    sql = f"""
+        WITH intervalli AS (
+            SELECT generate_series(
+                date_trunc('{granularita}', %s::date),
+                date_trunc('{granularita}', %s::date),
+                interval '1 {granularita}'
+            )::date AS intervallo
+        ),
+        dati AS (
+            SELECT date_trunc('{granularita}', {colonna_data})::date AS intervallo,
+                   {espressione_gruppo} AS gruppo,
+                   {misura} AS count
+            FROM {sorgente}
+            {join_mappa}
+            WHERE {where}
+            GROUP BY 1, 2
+        ),
+        gruppi AS ({gruppi})
+        SELECT i.intervallo, g.gruppo, COALESCE(d.count, 0) AS count
+        FROM intervalli i
+        CROSS JOIN gruppi g
+        LEFT JOIN dati d ON d.intervallo = i.intervallo AND d.gruppo IS NOT DISTINCT FROM g.gruppo
+        ORDER BY g.gruppo NULLS LAST, i.intervallo
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(sql, [dal, al] + params_mappa + list(params))
+        rows = cur.fetchall()
+
+    series: Dict = {}
+    for row in rows:
+        series.setdefault(row['gruppo'], []).append(int(row['count']))
+
+    return {
+        'labels': [giorno.isoformat() for giorno in intervalli(dal, al, granularita)],
+        'series': [
+            {'gruppo': chiave, 'data': punti, 'totale': sum(punti)}
+            for chiave, punti in series.items()
+        ],
+    }
@@ -0,0 +1,96 @@
+# singleflight.py - Accorpamento delle richieste identiche in corso
+"""
+Quando più thread chiedono lo stesso risultato costoso nello stesso momento
+(es. inizio turno: molti operatori aprono /eventi/dashboard e /drill-down/),
+solo il primo (leader) esegue la funzione; gli altri attendono il suo
+risultato invece di occupare altre connessioni del pool.
+
+    risultato, condiviso = group.do(chiave, funzione, timeout=30)
+
+- Il risultato viene consegnato a tutti i thread in attesa.
+- Un'eccezione del leader viene rilanciata anche ai thread in attesa.
+- Un thread in attesa oltre `timeout` riceve SingleFlightTimeout (il leader
+  continua e il suo risultato resta valido per chi arriva dopo).
+
+La chiave è rimossa al termine dell'esecuzione: l'accorpamento riguarda solo
+le richieste contemporanee, la memorizzazione dei risultati spetta alla
+cache (vedi response_cache.py).
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Attesa massima di un thread che segue il leader (secondi)
+DEFAULT_TIMEOUT = float(os.environ.get('TALON_SINGLEFLIGHT_TIMEOUT', '30'))
+
+class SingleFlightTimeout(Exception):
+    """Il leader non ha completato entro il timeout del thread in attesa."""
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Gruppo di chiavi in esecuzione con contatori per la telemetria."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.shared = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any],
+           timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Esegue `fn` una sola volta per le richieste contemporanee con la stessa chiave."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                call.waiters += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(DEFAULT_TIMEOUT if timeout is None else timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise SingleFlightTimeout(f"{self.name}: attesa oltre il timeout per {key!r}")
+        with self._lock:
+            self.shared += 1
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'name': self.name,
+                'in_flight': len(self._calls),
+                'executions': self.executions,
+                'shared': self.shared,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+            }
@@ -30,6 +30,7 @@ window.TalonCacheManager = window.TalonCacheManager || {};
                 // Strategie TTL per endpoint specifici
                 strategies: {
                     '/eventi/api/dashboard-data': 30 * 60 * 1000,      // 30 minuti - dati aggregati statici
+                    '/eventi/api/dashboard-bundle': 15 * 60 * 1000,    // 15 minuti - grafici + statistiche + stacked
                     '/eventi/api/enti-livello1': 15 * 60 * 1000,       // 15 minuti - enti cambiano poco
                     '/eventi/api/enti-livello2': 10 * 60 * 1000,       // 10 minuti - sottoenti
                     '/eventi/api/enti-stacked': 15 * 60 * 1000,        // 15 minuti - dati stacked
@@ -799,6 +800,7 @@ window.TalonCacheManager = window.TalonCacheManager || {};
             compressionEnabled: true,
             strategies: {
                 '/eventi/api/dashboard-data': 30 * 60 * 1000,
+                '/eventi/api/dashboard-bundle': 15 * 60 * 1000,
                 '/eventi/api/enti-livello1': 15 * 60 * 1000,
                 '/eventi/api/enti-livello2': 10 * 60 * 1000,
                 '/eventi/api/enti-stacked': 15 * 60 * 1000,
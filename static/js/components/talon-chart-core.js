@@ -24,7 +24,8 @@ window.TalonChartCore = window.TalonChartCore || {};
             animation: false,
             debounceDelay: 300,
             maxLabelsForDataLabels: 50,
-            chartResizeDelay: 150
+            chartResizeDelay: 150,
+            sharedRequestTTL: 15 * 60 * 1000 // Riuso del bundle dashboard tra le viste
         },
         ui: {
             maxLabelLength: 20,
@@ -1191,6 +1192,41 @@ window.TalonChartCore = window.TalonChartCore || {};
         }
     };
 
+    /**
+     * Richieste condivise tra le viste: url -> { promise, time }
+     * @type {Map<string, Object>}
+     */
+    namespace.sharedRequests = new Map();
+
+    /**
+     * Fetch con cache condiviso tra le viste (es. /eventi/api/dashboard-bundle):
+     * la chiave di fetchWithCache dipende dalla vista attiva, qui invece la
+     * stessa URL restituisce la stessa promise, anche se la richiesta è in corso
+     * @param {string} url - URL della richiesta
+     * @param {Object} options - Opzioni fetch + cache
+     * @returns {Promise<any>} Dati dalla richiesta condivisa
+     */
+    namespace.fetchShared = function(url, options = {}) {
+        const shared = namespace.sharedRequests.get(url);
+        if (shared && Date.now() - shared.time < namespace.config.performance.sharedRequestTTL) {
+            return shared.promise;
+        }
+
+        const promise = namespace.fetchWithCache(url, options).then(result => {
+            // Errori non riutilizzati: la prossima vista ritenta
+            if (!result || result.error) {
+                namespace.sharedRequests.delete(url);
+            }
+            return result;
+        }, error => {
+            namespace.sharedRequests.delete(url);
+            throw error;
+        });
+
+        namespace.sharedRequests.set(url, { promise: promise, time: Date.now() });
+        return promise;
+    };
+
     /**
      * Fetch diretto senza caching (fallback)
      * @param {string} url - URL della richiesta
@@ -1657,10 +1693,12 @@ window.TalonChartCore = window.TalonChartCore || {};
         // Il filtro carattere viene gestito tramite DOM input radio
         
         // CRITICO: Invalida cache quando cambia il filtro carattere
+        namespace.sharedRequests.clear();
         if (namespace.cacheManager) {
             // Invalida tutte le entry relative ai dati che dipendono dal carattere
             const keysToInvalidate = [
                 '/eventi/api/dashboard-data',
+                '/eventi/api/dashboard-bundle',
                 '/eventi/api/enti-livello1',
                 '/eventi/api/enti-livello2', 
                 '/eventi/api/dettagli'
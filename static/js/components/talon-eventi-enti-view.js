@@ -28,7 +28,7 @@ window.TalonEventiEntiView = window.TalonEventiEntiView || {};
         canvasId: 'eventEntiChartCanvas',
         viewType: 'enti',
         apiEndpoints: {
-            level0: '/eventi/api/enti-stacked',
+            level0: '/eventi/api/dashboard-bundle',
             level1: '/eventi/api/enti-stacked',
             level2: '/eventi/api/enti-stacked',
             level3: '/eventi/api/enti-stacked',
@@ -110,7 +110,9 @@ window.TalonEventiEntiView = window.TalonEventiEntiView || {};
                 level: level
             });
 
-            const result = await core.fetchWithCache(fullUrl, {
+            // Livello 0: bundle del dashboard condiviso con la vista tipologie
+            const fetchData = level === 0 ? core.fetchShared : core.fetchWithCache;
+            let result = await fetchData(fullUrl, {
                 method: 'GET',
                 headers: {
                     'X-Requested-With': 'XMLHttpRequest',
@@ -120,7 +122,7 @@ window.TalonEventiEntiView = window.TalonEventiEntiView || {};
                     level: level,
                     viewType: 'enti',
                     parentLabel: parentLabel,
-                    endpoint: 'enti-stacked'
+                    endpoint: level === 0 ? 'dashboard-bundle' : 'enti-stacked'
                 }
             });
 
@@ -133,6 +135,9 @@ window.TalonEventiEntiView = window.TalonEventiEntiView || {};
                 }
                 throw new Error(`API error: ${result?.error || 'Unknown error'}`);
             }
+            if (level === 0) {
+                result = bundleToStacked(result);
+            }
             namespace.state.lastAPIResponse = result;
 
             // Processa risposta specifica per enti
@@ -151,6 +156,28 @@ window.TalonEventiEntiView = window.TalonEventiEntiView || {};
         }
     }
 
+    /**
+     * Estrae dal bundle del dashboard i dati stacked e le statistiche
+     * nel formato di /eventi/api/enti-stacked
+     * @param {Object} bundle - Risposta di /eventi/api/dashboard-bundle
+     * @returns {Object} Risposta in formato enti-stacked
+     */
+    function bundleToStacked(bundle) {
+        const stackedData = bundle.stackedData || { labels: [], totals: [], backgroundColor: [], breakdown: {} };
+        const stats = bundle.stats || {};
+        return {
+            success: bundle.success,
+            stackedData: stackedData,
+            stats: {
+                total_events: (stackedData.totals || []).reduce((sum, val) => sum + val, 0),
+                categories: stats.tipologie || 0,
+                entities: (stackedData.labels || []).length,
+                positive_events: stats.positivi || 0,
+                negative_events: stats.negativi || 0
+            }
+        };
+    }
+
     /**
      * Fallback API per quando endpoint stacked non è disponibile
      * @param {number} level - Livello
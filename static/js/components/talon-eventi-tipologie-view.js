@@ -27,7 +27,7 @@ window.TalonEventiTipologieView = window.TalonEventiTipologieView || {};
         canvasId: 'eventChartCanvas',
         viewType: 'tipologie',
         apiEndpoints: {
-            level0: '/eventi/api/dashboard-data',
+            level0: '/eventi/api/dashboard-bundle',
             level1: '/eventi/api/enti-livello1',
             level2: '/eventi/api/enti-livello2',
             level3: '/eventi/api/dettagli'
@@ -110,7 +110,9 @@ window.TalonEventiTipologieView = window.TalonEventiTipologieView || {};
                 currentCategory: core.state.currentCategory
             });
 
-            const result = await core.fetchWithCache(fullUrl, {
+            // Livello 0: bundle del dashboard condiviso con la vista enti
+            const fetchData = level === 0 ? core.fetchShared : core.fetchWithCache;
+            const result = await fetchData(fullUrl, {
                 method: 'GET',
                 headers: {
                     'X-Requested-With': 'XMLHttpRequest',
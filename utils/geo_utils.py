@@ -3,11 +3,17 @@
 Utilità geografiche per TALON - SOLO PostGIS
 Versione pulita senza coordinate decimali, trigger o funzioni custom
 """
+import os
+import sys
+from contextlib import closing
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import json
 from typing import List, Dict, Tuple, Optional
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from db import get_connection as get_pooled_connection
+
 class GeoManager:
     """Gestione geografica esclusivamente con PostGIS"""
     
@@ -15,17 +21,8 @@ class GeoManager:
         self.db_config = db_config
         
     def get_connection(self):
-        """Ottiene connessione al database"""
-        conn = psycopg2.connect(
-            host=self.db_config.get('host', 'localhost'),
-            port=self.db_config.get('port', 5432),
-            database=self.db_config.get('database', 'talon'),
-            user=self.db_config.get('user', 'talon'),
-            password=self.db_config.get('password', 'TalonDB!2025'),
-            cursor_factory=RealDictCursor
-        )
-        conn.autocommit = True
-        return conn
+        """Ottiene connessione al database dal pool condiviso"""
+        return get_pooled_connection(cursor_factory=RealDictCursor, autocommit=True)
     
     def aggiorna_coordinate_ente(self, ente_id: int, lat: float, lon: float, tipo: str = 'militare') -> bool:
         """
@@ -39,7 +36,7 @@ class GeoManager:
         """
         table = 'enti_militari' if tipo == 'militare' else 'enti_civili'
         
-        with self.get_connection() as conn:
+        with closing(self.get_connection()) as conn:
             with conn.cursor() as cur:
                 # Aggiorna SOLO la geometria PostGIS
                 cur.execute(f"""
@@ -62,7 +59,7 @@ class GeoManager:
         """
         table = 'enti_militari' if tipo == 'militare' else 'enti_civili'
         
-        with self.get_connection() as conn:
+        with closing(self.get_connection()) as conn:
             with conn.cursor() as cur:
                 cur.execute(f"""
                     SELECT ST_Y(coordinate) as lat, ST_X(coordinate) as lon
@@ -88,7 +85,7 @@ class GeoManager:
         Returns:
             Lista di enti con distanza
         """
-        with self.get_connection() as conn:
+        with closing(self.get_connection()) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     SELECT 
@@ -151,7 +148,7 @@ class GeoManager:
         table1 = 'enti_militari' if tipo1 == 'militare' else 'enti_civili'
         table2 = 'enti_militari' if tipo2 == 'militare' else 'enti_civili'
         
-        with self.get_connection() as conn:
+        with closing(self.get_connection()) as conn:
             with conn.cursor() as cur:
                 cur.execute(f"""
                     SELECT 
@@ -177,7 +174,7 @@ class GeoManager:
         """
         features = []
         
-        with self.get_connection() as conn:
+        with closing(self.get_connection()) as conn:
             with conn.cursor() as cur:
                 # Enti militari
                 if tipo in ['militari', 'tutti']:
@@ -248,7 +245,7 @@ class GeoManager:
         """
         stats = {}
         
-        with self.get_connection() as conn:
+        with closing(self.get_connection()) as conn:
             with conn.cursor() as cur:
                 # Conteggi enti con geometrie
                 cur.execute("""
@@ -309,7 +306,7 @@ class GeoManager:
         Returns:
             Lista di enti nell'area
         """
-        with self.get_connection() as conn:
+        with closing(self.get_connection()) as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     SELECT 